@@ -1,19 +1,24 @@
 from flask import Flask, request, jsonify, Response, stream_with_context
 from dotenv import load_dotenv
 import json
-import asyncio
 from uuid import uuid4
 import os
 import sys
 from pathlib import Path
 
-from service import VideoAgentService
+from service import resolve_dom_profile
+from workers import AGENT_WORKERS, create_service, release_service
+from rate_limit import get_rate_limiter
+from router import get_model_stats
+from llm_cache import get_llm_cache
+from storage_state import check_save_options, storage_states
+from batch import build_service_options, duplicate_case_id, run_batch_streaming
 from flask_cors import CORS
 
 from edit_agent import pull_edit_pr_streaming
 from collections import defaultdict
 
-# Mapping from run IDs to VideoAgentService instances
+# Mapping from run IDs to VideoAgentService instances (or worker-hosted handles)
 agents = {}
 logs = defaultdict(list)
 
@@ -25,12 +30,22 @@ CORS(app)
 
 @app.route("/diag", methods=["GET"])
 def diag():
-    return jsonify({"agents": list(agents.keys())})
+    return jsonify({
+        "agents": list(agents.keys()),
+        "workers": AGENT_WORKERS,
+        "llm_rate_limit": get_rate_limiter().stats(),
+        "llm_models": get_model_stats().stats(),
+        "llm_cache": get_llm_cache().stats(),
+    })
 
 @app.route("/agent_logs/<run_id>", methods=["GET"])
 def agent_logs(run_id):
     return jsonify(logs[run_id])
 
+@app.route("/storage_states", methods=["GET"])
+def list_storage_states():
+    return jsonify(storage_states.list())
+
 @app.route("/run_command", methods=["POST"])
 def run_command():
 
@@ -40,6 +55,34 @@ def run_command():
     if not commands:
         return jsonify({"error": "Missing 'commands' in JSON body"}), 400
 
+    # Optional named snapshot (cookies, localStorage) to start the browser from
+    storage_state = None
+    storage_state_name = data.get("storage_state")
+    if storage_state_name:
+        storage_state = storage_states.load(storage_state_name)
+        if storage_state is None:
+            return (
+                jsonify(
+                    {
+                        "error": f"Storage state '{storage_state_name}' not found or expired."
+                    }
+                ),
+                404,
+            )
+
+    try:
+        dom_profile = resolve_dom_profile(data.get("dom_profile"))
+        save_storage_state = check_save_options(data.get("save_storage_state"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Browser options applied when a new service is created for this run
+    service_options = {
+        "storage_state": storage_state,
+        "network": data.get("network"),
+        "dom_profile": dom_profile,
+    }
+
     run_id = data.get(
         "run_id", None
     )  # if no run id specified then generate new browser
@@ -47,13 +90,13 @@ def run_command():
         run_id = str(uuid4())
 
         # Create a new service instance with a unique run ID
-        service = VideoAgentService(run_id)
+        service = create_service(run_id, **service_options)
         agents[run_id] = service
     else:
 
         if run_id not in agents:
             # Create a new service instance with a unique run ID
-            service = VideoAgentService(run_id)
+            service = create_service(run_id, **service_options)
             agents[run_id] = service
         else:
             service = agents.get(run_id)
@@ -68,6 +111,8 @@ def run_command():
                 )
             # Ensure the service is not marked as done if it's being reused
             service.done = False
+            if storage_state:
+                service.apply_storage_state(storage_state)
 
     print("Showing commands: ", commands)
 
@@ -76,25 +121,32 @@ def run_command():
             # Stream the unique run ID as the first message
             yield f"data: {{'type': 'uuid', 'id': '{run_id}'}}\n\n"
             # Ensure recorder is running
-            asyncio.run_coroutine_threadsafe(service.recorder.start(), service.loop).result()
+            service.start_recording()
             # Stream logs and results
-            for log_data in service.run_command_streaming(commands):
+            for log_data in service.run_command_streaming(
+                commands, save_storage_state=save_storage_state
+            ):
                 if (log_data != "data: {'type': 'keepalive'}\n\n"):
                     logs[run_id].append(log_data)
                 yield log_data
             # Signal completion to client
             yield "data: {'type': 'done'}\n\n"
             # Pause recording
-            asyncio.run_coroutine_threadsafe(service.recorder.stop(), service.loop).result()
+            service.stop_recording()
             if data.get("soft_shutdown_on_end", False):
                 service.shutdown()
         except Exception as e:
             # Catch exceptions during streaming and send an message
             yield f"data: {{'type': 'error', 'content': '{str(e)}'}}\n\n"
-            # Pause recording on error
-            asyncio.run_coroutine_threadsafe(service.recorder.stop(), service.loop).result()
-            service.shutdown()  # Shutdown on error
-            del agents[run_id]  # Remove from active agents
+            try:
+                # Pause recording on error
+                service.stop_recording()
+                service.shutdown()  # Shutdown on error
+            except Exception as cleanup_error:
+                # e.g. the worker hosting the service died
+                print(f"Cleanup of run {run_id} failed: {cleanup_error}")
+            agents.pop(run_id, None)  # Remove from active agents
+            release_service(run_id)
         finally:
             pass
 
@@ -108,6 +160,86 @@ def run_command():
     )
 
 
+@app.route("/run_batch", methods=["POST"])
+def run_batch():
+    """
+    Run many test cases concurrently, multiplexing their events onto one stream
+
+    Expected JSON body:
+    {
+        "test_cases": [
+            {"test_case_id": "test1", "commands": ["..."], "dom_profile": "optional override"}
+        ],
+        "parallelism": 4,
+        "storage_state": "optional snapshot applied to every case",
+        "network": {"block": ["analytics"], "cache": true},
+        "dom_profile": "viewport",
+        "soft_shutdown_on_end": false
+    }
+    """
+    data = request.get_json(force=True)
+    test_cases = data.get("test_cases")
+
+    if not test_cases:
+        return jsonify({"error": "Missing 'test_cases' in JSON body"}), 400
+
+    option_keys = ("storage_state", "network", "dom_profile")
+    defaults = {key: data.get(key) for key in option_keys}
+    cases = []
+    for case in test_cases:
+        if not case.get("test_case_id") or not case.get("commands"):
+            return (
+                jsonify({"error": "Each test case needs 'test_case_id' and 'commands'"}),
+                400,
+            )
+    duplicate = duplicate_case_id(case["test_case_id"] for case in test_cases)
+    if duplicate is not None:
+        return jsonify({"error": f"Duplicate test_case_id '{duplicate}'"}), 400
+    for case in test_cases:
+        try:
+            service_options = build_service_options(
+                defaults, {key: case.get(key) for key in option_keys}
+            )
+            save_storage_state = check_save_options(case.get("save_storage_state"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        cases.append(
+            {
+                "test_case_id": case["test_case_id"],
+                "commands": case["commands"],
+                "save_storage_state": save_storage_state,
+                "service_options": service_options,
+            }
+        )
+
+    def create_batch_service(run_id, **service_options):
+        service = create_service(run_id, **service_options)
+        agents[run_id] = service
+        return service
+
+    def generate():
+        for event in run_batch_streaming(
+            cases,
+            create_batch_service,
+            parallelism=data.get("parallelism"),
+            soft_shutdown_on_end=data.get("soft_shutdown_on_end", False),
+            record_event=lambda run_id, event: logs[run_id].append(event),
+        ):
+            yield event
+        yield "data: {'type': 'done'}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        content_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        },
+    )
+
+
 @app.route("/shutdown_run/<run_id>", methods=["POST"])
 def shutdown_run(run_id):
     data = request.get_json(force=True)
@@ -117,6 +249,8 @@ def shutdown_run(run_id):
         service = agents.get(run_id)
     if service:
         service.shutdown()
+        if data.get("delete_video", False):
+            release_service(run_id)
         return jsonify({"message": f"Run ID {run_id} shut down successfully."})
     return jsonify({"error": f"Run ID {run_id} not found."}), 404
 
@@ -127,7 +261,7 @@ def playlist(run_id):
     if not service:
         return "", 404
     if request.method == "PUT":
-        service.hls.put_playlist(request.data)
+        service.put_playlist(request.data)
         return ""
     pl = service.get_playlist()
     if not pl:
@@ -141,7 +275,7 @@ def segment(run_id, name):
     if not service:
         return "", 404
     if request.method == "PUT":
-        service.hls.put_segment(name, request.data)
+        service.put_segment(name, request.data)
         return ""
     data = service.get_segment(name)
     if not data:
@@ -255,7 +389,9 @@ def make_pr():
         "github_url": "https://github.com/owner/repo",
         "issue_description": "Description of the issue to fix",
         "branch": "Optional branch to work with (default: main)",
-        "cleanup": true
+        "cleanup": true,
+        "attempts": "Optional number of independent agent attempts, first success wins",
+        "prose": "Optional: have the LLM write the PR title and body even for small changes"
     }
     """
     data = request.get_json(force=True)
@@ -264,6 +400,8 @@ def make_pr():
     issue_description = data.get("issue_description")
     branch = data.get("branch")
     cleanup = data.get("cleanup", True)
+    attempts = data.get("attempts")
+    prose = bool(data.get("prose", False))
     
     if not github_url:
         return jsonify({"error": "Missing 'github_url' in JSON body"}), 400
@@ -283,7 +421,9 @@ def make_pr():
                 prompt=issue_description,
                 git_url=github_url,
                 cleanup=cleanup,
-                branch=branch
+                branch=branch,
+                attempts=attempts,
+                prose=prose
             ):
                 yield progress_update
             
@@ -8,14 +8,20 @@ import os
 import logging
 from uuid import uuid4
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from collections import defaultdict
 
-from service import VideoAgentService
+from service import resolve_dom_profile
+from workers import AGENT_WORKERS, create_service, release_service
+from rate_limit import get_rate_limiter
+from router import get_model_stats
+from llm_cache import get_llm_cache
+from storage_state import check_save_options, storage_states
+from batch import build_service_options, duplicate_case_id, run_batch_streaming
 from edit_agent import pull_edit_pr_streaming
 
-# Mapping from run IDs to VideoAgentService instances
-agents: Dict[str, VideoAgentService] = {}
+# Mapping from run IDs to VideoAgentService instances (or worker-hosted handles)
+agents: Dict[str, Any] = {}
 logs = defaultdict(list)
 
 # Load environment variables
@@ -34,10 +40,43 @@ app.add_middleware(
 default_error = HTTPException(status_code=400, detail="Invalid request")
 
 
+class SaveStorageStateBody(BaseModel):
+    name: str
+    after_step: Optional[int] = None
+    ttl: Optional[int] = None
+
+
+class NetworkBody(BaseModel):
+    block: Optional[List[str]] = None
+    cache: Optional[bool] = False
+
+
 class RunCommandBody(BaseModel):
     commands: List[str]
     run_id: Optional[str] = None
     soft_shutdown_on_end: Optional[bool] = False
+    storage_state: Optional[str] = None
+    save_storage_state: Optional[SaveStorageStateBody] = None
+    network: Optional[NetworkBody] = None
+    dom_profile: Optional[str] = None
+
+
+class BatchTestCase(BaseModel):
+    test_case_id: str
+    commands: List[str]
+    storage_state: Optional[str] = None
+    save_storage_state: Optional[SaveStorageStateBody] = None
+    network: Optional[NetworkBody] = None
+    dom_profile: Optional[str] = None
+
+
+class RunBatchBody(BaseModel):
+    test_cases: List[BatchTestCase]
+    parallelism: Optional[int] = None
+    storage_state: Optional[str] = None
+    network: Optional[NetworkBody] = None
+    dom_profile: Optional[str] = None
+    soft_shutdown_on_end: Optional[bool] = False
 
 
 class ShutdownBody(BaseModel):
@@ -54,11 +93,19 @@ class MakePRBody(BaseModel):
     issue_description: str
     branch: Optional[str] = None
     cleanup: Optional[bool] = True
+    attempts: Optional[int] = None
+    prose: Optional[bool] = False
 
 
 @app.get("/diag")
 async def diag():
-    return {"agents": list(agents.keys())}
+    return {
+        "agents": list(agents.keys()),
+        "workers": AGENT_WORKERS,
+        "llm_rate_limit": get_rate_limiter().stats(),
+        "llm_models": get_model_stats().stats(),
+        "llm_cache": get_llm_cache().stats(),
+    }
 
 
 @app.get("/agent_logs/{run_id}")
@@ -66,6 +113,11 @@ async def agent_logs(run_id: str):
     return {"logs": logs[run_id]}
 
 
+@app.get("/storage_states")
+async def list_storage_states():
+    return storage_states.list()
+
+
 @app.post("/run_command")
 async def run_command(body: RunCommandBody):
     commands = body.commands
@@ -73,49 +125,143 @@ async def run_command(body: RunCommandBody):
         raise HTTPException(
             status_code=400, detail="Missing 'commands' in request body"
         )
+    # Optional named snapshot (cookies, localStorage) to start the browser from
+    storage_state = None
+    if body.storage_state:
+        storage_state = storage_states.load(body.storage_state)
+        if storage_state is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Storage state '{body.storage_state}' not found or expired.",
+            )
+    try:
+        dom_profile = resolve_dom_profile(body.dom_profile)
+        save_storage_state = check_save_options(
+            body.save_storage_state.dict(exclude_none=True)
+            if body.save_storage_state
+            else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Browser options applied when a new service is created for this run
+    service_options = {
+        "storage_state": storage_state,
+        "network": body.network.dict(exclude_none=True) if body.network else None,
+        "dom_profile": dom_profile,
+    }
     run_id = body.run_id
     # Create or reuse agent service
     if not run_id:
         run_id = str(uuid4())
-        service = VideoAgentService(run_id)
+        service = create_service(run_id, **service_options)
         agents[run_id] = service
     else:
         if run_id not in agents:
-            service = VideoAgentService(run_id)
+            service = create_service(run_id, **service_options)
             agents[run_id] = service
         else:
             service = agents[run_id]
             service.done = False
+            if storage_state:
+                service.apply_storage_state(storage_state)
 
     def event_stream():
         try:
             # Send the generated run ID first
             yield f"data: {{'type': 'uuid', 'id': '{run_id}'}}\n\n"
             # Ensure recorder is running
-            asyncio.run_coroutine_threadsafe(
-                service.recorder.start(), service.loop
-            ).result()
+            service.start_recording()
             # Stream logs and results
-            for log_data in service.run_command_streaming(commands):
+            for log_data in service.run_command_streaming(
+                commands, save_storage_state=save_storage_state
+            ):
                 if (log_data != "data: {'type': 'keepalive'}\n\n"):
                     logs[run_id].append(log_data)
                 yield log_data
             # Signal completion to client
             yield "data: {'type': 'done'}\n\n"
             # Pause recording
-            asyncio.run_coroutine_threadsafe(
-                service.recorder.stop(), service.loop
-            ).result()
+            service.stop_recording()
             if body.soft_shutdown_on_end:
                 service.shutdown()
         except Exception as e:
             yield f"data: {{'type': 'error', 'content': '{str(e)}'}}\n\n"
-            # Pause recording and shutdown
-            asyncio.run_coroutine_threadsafe(
-                service.recorder.stop(), service.loop
-            ).result()
-            service.shutdown()
+            try:
+                # Pause recording and shutdown
+                service.stop_recording()
+                service.shutdown()
+            except Exception as cleanup_error:
+                # e.g. the worker hosting the service died
+                print(f"Cleanup of run {run_id} failed: {cleanup_error}")
             agents.pop(run_id, None)
+            release_service(run_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive"},
+    )
+
+
+@app.post("/run_batch")
+async def run_batch(body: RunBatchBody):
+    """Run many test cases concurrently, multiplexing their events onto one stream"""
+    if not body.test_cases:
+        raise HTTPException(
+            status_code=400, detail="Missing 'test_cases' in request body"
+        )
+    option_keys = {"storage_state", "network", "dom_profile"}
+    defaults = body.dict(include=option_keys, exclude_none=True)
+    cases = []
+    for case in body.test_cases:
+        if not case.commands:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Test case '{case.test_case_id}' has no commands",
+            )
+    duplicate = duplicate_case_id(case.test_case_id for case in body.test_cases)
+    if duplicate is not None:
+        raise HTTPException(
+            status_code=400, detail=f"Duplicate test_case_id '{duplicate}'"
+        )
+    for case in body.test_cases:
+        try:
+            service_options = build_service_options(
+                defaults, case.dict(include=option_keys, exclude_none=True)
+            )
+            save_storage_state = check_save_options(
+                case.save_storage_state.dict(exclude_none=True)
+                if case.save_storage_state
+                else None
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        cases.append(
+            {
+                "test_case_id": case.test_case_id,
+                "commands": case.commands,
+                "save_storage_state": save_storage_state,
+                "service_options": service_options,
+            }
+        )
+
+    def create_batch_service(run_id, **service_options):
+        service = create_service(run_id, **service_options)
+        agents[run_id] = service
+        return service
+
+    def event_stream():
+        for event in run_batch_streaming(
+            cases,
+            create_batch_service,
+            parallelism=body.parallelism,
+            soft_shutdown_on_end=bool(body.soft_shutdown_on_end),
+            record_event=lambda run_id, event: logs[run_id].append(event),
+        ):
+            yield event
+        yield "data: {'type': 'done'}\n\n"
 
     return StreamingResponse(
         event_stream(),
@@ -132,6 +278,8 @@ async def shutdown_run(run_id: str, body: ShutdownBody):
         service = agents.get(run_id)
     if service:
         service.shutdown()
+        if body.delete_video:
+            release_service(run_id)
         return {"message": f"Run ID {run_id} shut down successfully."}
     raise HTTPException(status_code=404, detail=f"Run ID {run_id} not found.")
 
@@ -142,7 +290,7 @@ async def put_playlist(run_id: str, request: Request):
     if not service:
         raise HTTPException(status_code=404, detail="Unknown run_id")
     data = await request.body()
-    service.hls.put_playlist(data)
+    service.put_playlist(data)
     return Response(status_code=200)
 
 
@@ -163,7 +311,7 @@ async def put_segment(run_id: str, name: str, request: Request):
     if not service:
         raise HTTPException(status_code=404, detail="Unknown run_id")
     data = await request.body()
-    service.hls.put_segment(name, data)
+    service.put_segment(name, data)
     return Response(status_code=200)
 
 
@@ -289,13 +437,17 @@ async def make_pr(body: MakePRBody):
         "github_url": "https://github.com/owner/repo",
         "issue_description": "Description of the issue to fix",
         "branch": "Optional branch to work with (default: main)",
-        "cleanup": true
+        "cleanup": true,
+        "attempts": "Optional number of independent agent attempts, first success wins",
+        "prose": "Optional: have the LLM write the PR title and body even for small changes"
     }
     """
     github_url = body.github_url
     issue_description = body.issue_description
     branch = body.branch
     cleanup = body.cleanup if body.cleanup is not None else True
+    attempts = body.attempts
+    prose = bool(body.prose)
     
     if not github_url:
         raise HTTPException(status_code=400, detail="Missing 'github_url' in request body")
@@ -315,7 +467,9 @@ async def make_pr(body: MakePRBody):
                 prompt=issue_description,
                 git_url=github_url,
                 cleanup=cleanup,
-                branch=branch
+                branch=branch,
+                attempts=attempts,
+                prose=prose
             ):
                 yield progress_update
             
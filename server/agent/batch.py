@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Concurrent execution of many test cases multiplexed onto one SSE stream
+
+Limitation: every test case gets a cold VideoAgentService, i.e. its own
+browser launch, even though at most `parallelism` run at once. Browsers
+are not reused across the cases of a concurrency slot because a case's
+DOM profile, network rules and starting storage state are launch options
+of the browser session, its video is recorded and served per service
+(run_id), and a context cannot be fully reset between cases (init scripts
+added to restore localStorage cannot be removed). Batches of many short
+cases therefore pay one browser start per case.
+"""
+
+import os
+import time
+import queue
+import threading
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from service import resolve_dom_profile
+from storage_state import storage_states
+
+DEFAULT_BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+MAX_BATCH_PARALLELISM = int(os.getenv("MAX_BATCH_PARALLELISM", "16"))
+
+KEEPALIVE = "data: {'type': 'keepalive'}\n\n"
+# Sentinel a worker puts on the event queue when its test case has finished
+_CASE_FINISHED = object()
+
+
+def tag_event(event: str, **tags: Any) -> str:
+    """Prefix an SSE event's payload with extra fields, e.g. the test case id"""
+    payload = event[len("data: "):].rstrip("\n")
+    fields = ", ".join(f"{k!r}: {v!r}" for k, v in tags.items())
+    return f"data: {{{fields}, {payload[1:]}\n\n"
+
+
+def duplicate_case_id(case_ids: Iterable[str]) -> Optional[str]:
+    """First test_case_id that occurs twice; events and the batch summary are keyed by it"""
+    seen = set()
+    for case_id in case_ids:
+        if case_id in seen:
+            return case_id
+        seen.add(case_id)
+    return None
+
+
+def build_service_options(defaults: Dict[str, Any], case: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge batch-level browser options with a test case's overrides
+
+    Raises ValueError for an unknown DOM profile and LookupError for a missing
+    or expired storage-state snapshot, so the caller can reject the batch before
+    any browser is launched.
+    """
+    merged = {**defaults, **{k: v for k, v in case.items() if v is not None}}
+    storage_state = None
+    if merged.get("storage_state"):
+        storage_state = storage_states.load(merged["storage_state"])
+        if storage_state is None:
+            raise LookupError(
+                f"Storage state '{merged['storage_state']}' not found or expired."
+            )
+    return {
+        "storage_state": storage_state,
+        "network": merged.get("network"),
+        "dom_profile": resolve_dom_profile(merged.get("dom_profile")),
+    }
+
+
+def run_batch_streaming(
+    test_cases: List[Dict[str, Any]],
+    create_service: Callable[..., Any],
+    parallelism: Optional[int] = None,
+    soft_shutdown_on_end: bool = False,
+    record_event: Optional[Callable[[str, str], None]] = None,
+):
+    """Run test cases concurrently and yield their events as one SSE stream
+
+    Each test case is {"test_case_id", "commands", "service_options",
+    "save_storage_state"?}, with unique test_case_ids.
+    create_service(run_id, **service_options) must return a started
+    VideoAgentService (and register it for the video endpoints). Every event
+    is tagged with its test_case_id and run_id; the stream ends with a
+    'batch_summary' event. Closing the stream early (a disconnected client)
+    cancels cases that haven't started and shuts down the running ones at
+    their next event.
+    """
+    parallelism = max(1, min(parallelism or DEFAULT_BATCH_PARALLELISM, MAX_BATCH_PARALLELISM, len(test_cases)))
+    events: "queue.Queue[Any]" = queue.Queue()
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    cancelled = threading.Event()
+
+    def run_case(case: Dict[str, Any]):
+        case_id = case["test_case_id"]
+        run_id = str(uuid4())
+        status = "success"
+        started = time.perf_counter()
+
+        def emit(event: str):
+            tagged = tag_event(event, test_case_id=case_id, run_id=run_id)
+            if record_event:
+                record_event(run_id, tagged)
+            events.put(tagged)
+
+        service = None
+        try:
+            service = create_service(run_id, **case["service_options"])
+            emit(f"data: {{'type': 'uuid', 'id': '{run_id}'}}\n\n")
+            service.start_recording()
+            for event in service.run_command_streaming(
+                case["commands"], save_storage_state=case.get("save_storage_state")
+            ):
+                if cancelled.is_set():
+                    status = "cancelled"
+                    break
+                if event == KEEPALIVE:
+                    continue
+                if "'type': 'step_status'" in event and "'status': 'failure'" in event:
+                    status = "failure"
+                emit(event)
+            service.stop_recording()
+            # Nobody is listening to a cancelled case, so its browser goes too
+            if soft_shutdown_on_end or status == "cancelled":
+                service.shutdown()
+        except Exception as e:
+            status = "error"
+            emit(f"data: {{'type': 'error', 'content': '{str(e)}'}}\n\n")
+            if service is not None:
+                try:
+                    service.stop_recording()
+                    service.shutdown()
+                except Exception:
+                    pass
+        finally:
+            duration = round(time.perf_counter() - started, 3)
+            outcomes[case_id] = {"status": status, "duration": duration}
+            emit(f"data: {{'type': 'case_done', 'status': '{status}', 'duration': {duration}}}\n\n")
+            events.put(_CASE_FINISHED)
+
+    batch_start = time.perf_counter()
+    yield f"data: {{'type': 'batch', 'test_cases': {len(test_cases)}, 'parallelism': {parallelism}}}\n\n"
+    pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="batch")
+    futures = [pool.submit(run_case, case) for case in test_cases]
+    try:
+        remaining = len(test_cases)
+        while remaining:
+            try:
+                event = events.get(timeout=1)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+            if event is _CASE_FINISHED:
+                remaining -= 1
+                continue
+            yield event
+    except GeneratorExit:
+        # The client went away: don't start the rest, stop the running ones
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        # Running cases wind down in their threads rather than blocking the close
+        pool.shutdown(wait=not cancelled.is_set())
+
+    counts = {"success": 0, "failure": 0, "error": 0}
+    for outcome in outcomes.values():
+        counts[outcome["status"]] += 1
+    summary = {
+        "type": "batch_summary",
+        "passed": counts["success"],
+        "failed": counts["failure"],
+        "errors": counts["error"],
+        "duration": round(time.perf_counter() - batch_start, 3),
+        "slowest_case": max((o["duration"] for o in outcomes.values()), default=0),
+    }
+    yield f"data: {summary!r}\n\n"
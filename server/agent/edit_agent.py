@@ -2,20 +2,57 @@
 """AI agent for editing code repositories and creating PRs"""
 
 import os
+import json
+import queue
 import stat
 import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from fetch import FetchAIAgent
-from git import clone_repo, make_pr, REPOS_DIR
-
-
-def call_fetch_agent(prompt, repo_path):
+from fetch import FetchAIAgent, summarize_actions, template_pr_metadata
+from engine import AgentEngine, format_metrics, format_summary
+from git import clone_repo, push_branch, open_pr, add_worktree, has_changes, is_worktree, remove_worktree, REPOS_DIR
+from repo_index import RepoIndex
+from rate_limit import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+# Independent agent attempts per PR job; the first to succeed wins and the
+# rest are cancelled. 1 runs the agent once, directly in the clone.
+AGENT_ATTEMPTS = int(os.getenv("AGENT_ATTEMPTS", "1"))
+AGENT_MAX_ATTEMPTS = int(os.getenv("AGENT_MAX_ATTEMPTS", "4"))
+# Shell command an attempt's workspace must pass before it can win, e.g.
+# "python -m pytest -q"; empty accepts any attempt the agent completes
+AGENT_VALIDATE_COMMAND = os.getenv("AGENT_VALIDATE_COMMAND", "")
+AGENT_VALIDATE_TIMEOUT = int(os.getenv("AGENT_VALIDATE_TIMEOUT", "600"))
+
+# Progress message, step prefix and the parameter shown, streamed after each successful action
+ACTION_PROGRESS = {
+    "view": ("📄 Viewed", "viewed", "path"),
+    "search": ("🔎 Searched", "searched", "query"),
+    "create": ("📝 Created file", "created", "path"),
+    "str_replace": ("✏️ Updated file", "updated", "path"),
+    "insert": ("📝 Inserted into file", "inserted", "path"),
+    "patch": ("🩹 Patched", "patched", None),
+}
+
+
+def describe_action(step):
+    """Subject shown in an action's progress message"""
+    key = ACTION_PROGRESS[step["action"]][2]
+    if key is None:
+        return ", ".join(f["path"] for f in step["result"].get("files", []))
+    return step["parameters"].get(key, ".")
+
+
+def call_fetch_agent(prompt, repo_path, index=None, priority=PRIORITY_INTERACTIVE):
     """Call Fetch.ai agent with a custom prompt and return results"""
     print(f"🤖 Calling Fetch.ai agent with prompt: '{prompt}'")
     
     try:
         # Initialize the Fetch.ai agent
-        agent = FetchAIAgent()
+        agent = FetchAIAgent(index=index, priority=priority)
         
         # Run the agent loop with the custom prompt
         result = agent.agent_loop(prompt, workspace_path=repo_path, max_iterations=50)
@@ -37,239 +74,104 @@ def call_fetch_agent(prompt, repo_path):
         return {"success": False, "error": str(e)}
 
 
-def call_fetch_agent_streaming_generator(prompt, repo_path):
+def agent_progress(event):
+    """Progress updates (message, step, data_type, data) for one AgentEngine event"""
+    kind = event["type"]
+    if kind == "iteration":
+        return [(f"🔄 Agent iteration {event['iteration']}/{event['max_iterations']}", f"iteration_{event['iteration']}", "progress", None)]
+    if kind == "thinking":
+        return [(f"🧠 AI thinking (iteration {event['iteration']})...", f"thinking_{event['iteration']}", "progress", None)]
+    if kind == "notice":
+        return [(event["message"], f"notice_{event['iteration']}", "progress", None)]
+    if kind == "token":
+        return [(event["text"], f"thinking_{event['iteration']}", "token", None)]
+    if kind == "decision":
+        return [
+            (f"🧠 Agent reasoning: {event['reasoning']}", f"reasoning_{event['iteration']}", "progress", None),
+            (f"⚡ Agent action: {', '.join(event['actions'])}", f"action_{event['iteration']}", "progress", None),
+        ]
+    if kind == "action":
+        step = event["step"]
+        if step["action"] not in ACTION_PROGRESS:
+            return [(f"❓ Unknown action: {step['action']}", f"unknown_{event['iteration']}", "progress", None)]
+        if step["result"].get("success"):
+            label, step_name, _ = ACTION_PROGRESS[step["action"]]
+            return [(f"{label}: {describe_action(step)}", f"{step_name}_{event['iteration']}", "progress", None)]
+        return []
+    if kind == "metrics":
+        return [(f"⏱️ Iteration {event['iteration']}: {format_metrics(event['metrics'])}", f"metrics_{event['iteration']}", "metrics", event["metrics"])]
+    if kind == "finished":
+        result = event["result"]
+        outcome = {
+            "completed": ("✅ Agent completed task successfully", "completed", "progress"),
+            "aborted": (f"🛑 Agent aborted: {result.get('reason')}", "aborted", "progress"),
+            "timeout": (f"⏰ {result.get('error')}", "timeout", "progress"),
+            "stalled": (f"🔁 {result.get('error')}", "stalled", "progress"),
+        }.get(result["outcome"], (f"❌ {result.get('error')}", "error", "progress"))
+        return [
+            (*outcome, None),
+            (f"📊 Agent summary: {format_summary(result['metrics'])}", "agent_summary", "metrics", result["metrics"]),
+        ]
+    return []
+
+
+def describe_clone(info):
+    """Suffix for the cloned progress message, e.g. (shallow clone, 12.3 MB, in 1.4s)"""
+    if not info:
+        return ""
+    size = f", {info['size_kb'] / 1024:.1f} MB" if info.get("size_kb") is not None else ""
+    if info.get("mirror"):
+        return f" (worktree of {info['mirror']} mirror{size}, fetch {info['fetch_seconds']}s, in {info['seconds']}s)"
+    sparse = f", sparse: {' '.join(info['sparse'])}" if info.get("sparse") else ""
+    return f" ({info['mode']} clone{size}{sparse}, in {info['seconds']}s)"
+
+
+def agent_result(result, agent):
+    """Engine result in the shape edit_agent callers expect"""
+    result = dict(result)
+    result["actions"] = result.pop("actions_taken")
+    result["agent"] = agent
+    return result
+
+
+def call_fetch_agent_streaming_generator(prompt, repo_path, index=None, priority=PRIORITY_INTERACTIVE):
     """Call Fetch.ai agent with streaming progress updates (generator version)"""
     import json
-    from fetch import FetchAIAgent
-    from pathlib import Path
-    import requests
     
-    def stream_progress(message, step=None, data_type="progress"):
+    def stream_progress(message, step=None, data_type="progress", data=None):
         """Helper function to yield SSE formatted progress updates"""
         progress_data = {
             'type': data_type,
             'message': message,
             'step': step or 'unknown'
         }
+        if data is not None:
+            progress_data['data'] = data
         return f"data: {json.dumps(progress_data)}\n\n"
     
     yield stream_progress(f"🤖 Calling Fetch.ai agent with prompt: '{prompt}'", "agent_start")
     
     try:
         # Initialize the Fetch.ai agent
-        agent = FetchAIAgent()
+        agent = FetchAIAgent(index=index, priority=priority)
         yield stream_progress("✓ Fetch.ai agent initialized", "agent_initialized")
         
-        # Run agent loop with manual iterations for streaming
-        workspace_path = Path(repo_path)
-        actions_taken = []
-        max_iterations = 50
-        
-        for iteration in range(max_iterations):
-            yield stream_progress(f"🔄 Agent iteration {iteration + 1}/{max_iterations}", f"iteration_{iteration + 1}")
-            
-            # Get current workspace state
-            workspace_info = agent.view(workspace_path)
-            
-            # Build conversation context
-            context = {
-                "task": prompt,
-                "workspace": str(workspace_path),
-                "workspace_contents": workspace_info,
-                "actions_taken": actions_taken,
-                "iteration": iteration + 1
-            }
-            
-            # System prompt for the agent
-            system_prompt = """You are an autonomous AI agent with file management capabilities. You can:
-
-1. view(path) - Read files or list directories  
-2. str_replace(path, old_str, new_str) - Replace text in files
-3. insert(path, line_num, text) - Insert text at specific lines
-4. create(path, content) - Create new files
-
-IMPORTANT: You must respond with a JSON object containing:
-- "action": one of ["view", "str_replace", "insert", "create", "complete", "abort"]
-- "parameters": object with the parameters for the action
-- "reasoning": string explaining why you're taking this action
-- "status": "continue" or "complete" or "abort"
-
-If action is "complete", you're done. If "abort", you're stopping due to an error.
-For file operations, check if files exist first using "view" before modifying them."""
-
-            # Build user prompt with context
-            user_prompt = f"""Task: {prompt}
-
-Current workspace: {workspace_path}
-Workspace contents: {json.dumps(workspace_info, indent=2)}
-
-Actions taken so far: {json.dumps(actions_taken, indent=2)}
-
-What should I do next to complete this task? Respond with JSON only."""
-
-            try:
-                # Make API call
-                yield stream_progress(f"🧠 AI thinking (iteration {iteration + 1})...", f"thinking_{iteration + 1}")
-                
-                response = requests.post(
-                    f"{agent.base_url}/chat/completions",
-                    headers=agent.headers,
-                    json={
-                        "model": agent.model,
-                        "max_tokens": 2000,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user", 
-                                "content": user_prompt
-                            }
-                        ]
-                    },
-                    timeout=30
-                )
-                
-                if response.status_code != 200:
-                    yield stream_progress(f"❌ API request failed: {response.status_code}", "error")
-                    yield {
-                        "success": False,
-                        "error": f"API request failed: {response.status_code}",
-                        "actions": actions_taken
-                    }
-                    return
-                
-                ai_response = response.json()
-                content = ai_response.get("choices", [{}])[0].get("message", {}).get("content", "")
-                
-                # Parse AI response
-                try:
-                    decision = json.loads(content)
-                except json.JSONDecodeError:
-                    # Try to extract JSON from response
-                    import re
-                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                    if json_match:
-                        decision = json.loads(json_match.group())
-                    else:
-                        yield stream_progress("❌ Could not parse AI response as JSON", "error")
-                        yield {
-                            "success": False,
-                            "error": "Could not parse AI response as JSON",
-                            "actions": actions_taken,
-                            "raw_response": content
-                        }
-                        return
-                
-                action = decision.get("action", "abort")
-                parameters = decision.get("parameters", {})
-                reasoning = decision.get("reasoning", "No reasoning provided")
-                status = decision.get("status", "abort")
-                
-                yield stream_progress(f"🧠 Agent reasoning: {reasoning}", f"reasoning_{iteration + 1}")
-                yield stream_progress(f"⚡ Agent action: {action}", f"action_{iteration + 1}")
-                
-                # Execute the action
-                if action == "complete":
-                    yield stream_progress("✅ Agent completed task successfully", "completed")
-                    yield {
-                        "success": True,
-                        "message": "Task completed successfully",
-                        "agent": agent,
-                        "actions": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                    return
-                elif action == "abort":
-                    yield stream_progress(f"🛑 Agent aborted: {reasoning}", "aborted")
-                    yield {
-                        "success": False,
-                        "message": "Agent decided to abort",
-                        "reason": reasoning,
-                        "actions": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                    return
-                elif action == "view":
-                    result = agent.view(parameters.get("path", "."))
-                    actions_taken.append({
-                        "type": "view",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        yield stream_progress(f"📄 Viewed: {parameters.get('path', '.')}", f"viewed_{iteration + 1}")
-                elif action == "create":
-                    result = agent.create(parameters.get("path"), parameters.get("content", ""))
-                    actions_taken.append({
-                        "type": "create",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        yield stream_progress(f"📝 Created file: {parameters.get('path')}", f"created_{iteration + 1}")
-                elif action == "str_replace":
-                    result = agent.str_replace(
-                        parameters.get("path"), 
-                        parameters.get("old_str"), 
-                        parameters.get("new_str")
-                    )
-                    actions_taken.append({
-                        "type": "str_replace",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        yield stream_progress(f"✏️ Updated file: {parameters.get('path')}", f"updated_{iteration + 1}")
-                elif action == "insert":
-                    result = agent.insert(
-                        parameters.get("path"),
-                        parameters.get("line_num", 1),
-                        parameters.get("text", "")
-                    )
-                    actions_taken.append({
-                        "type": "insert", 
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        yield stream_progress(f"📝 Inserted into file: {parameters.get('path')}", f"inserted_{iteration + 1}")
-                else:
-                    yield stream_progress(f"❓ Unknown action: {action}", f"unknown_{iteration + 1}")
-                    
-            except Exception as e:
-                yield stream_progress(f"❌ Error in iteration {iteration + 1}: {str(e)}", "error")
-                yield {
-                    "success": False,
-                    "error": f"Error in iteration {iteration + 1}: {str(e)}",
-                    "actions": actions_taken
-                }
+        # Tokens are forwarded as they arrive and each turn is acted on as
+        # soon as its JSON decision closes
+        for event in AgentEngine(agent, max_iterations=50, stream=True).run(prompt, repo_path):
+            for update in agent_progress(event):
+                yield stream_progress(*update)
+            if event["type"] == "finished":
+                yield agent_result(event["result"], agent)
                 return
         
-        # If we've reached max iterations
-        yield stream_progress(f"⏰ Agent exceeded maximum iterations ({max_iterations})", "timeout")
-        yield {
-            "success": False,
-            "error": f"Agent exceeded maximum iterations ({max_iterations})",
-            "actions": actions_taken
-        }
-        
     except Exception as e:
         yield stream_progress(f"❌ Error with Fetch.ai agent: {str(e)}", "error")
         yield {"success": False, "error": str(e)}
 
 
-def call_fetch_agent_streaming(prompt, repo_path, stream_callback=None):
+def call_fetch_agent_streaming(prompt, repo_path, stream_callback=None, index=None, priority=PRIORITY_INTERACTIVE):
     """Call Fetch.ai agent with streaming progress updates"""
-    import json
-    from fetch import FetchAIAgent
-    from pathlib import Path
-    import requests
     
     def stream_update(message, step=None, data_type="progress"):
         """Helper to send streaming updates"""
@@ -280,206 +182,153 @@ def call_fetch_agent_streaming(prompt, repo_path, stream_callback=None):
     
     try:
         # Initialize the Fetch.ai agent
-        agent = FetchAIAgent()
+        agent = FetchAIAgent(index=index, priority=priority)
         stream_update("✓ Fetch.ai agent initialized", "agent_initialized")
         
-        # Run agent loop with manual iterations for streaming
-        workspace_path = Path(repo_path)
-        actions_taken = []
-        max_iterations = 50
+        result = None
+        for event in AgentEngine(agent, max_iterations=50, stream=True).run(prompt, repo_path):
+            for message, step, data_type, _ in agent_progress(event):
+                stream_update(message, step, data_type)
+            if event["type"] == "finished":
+                result = agent_result(event["result"], agent)
+        return result
         
-        for iteration in range(max_iterations):
-            stream_update(f"🔄 Agent iteration {iteration + 1}/{max_iterations}", f"iteration_{iteration + 1}")
-            
-            # Get current workspace state
-            workspace_info = agent.view(workspace_path)
-            
-            # Build conversation context
-            context = {
-                "task": prompt,
-                "workspace": str(workspace_path),
-                "workspace_contents": workspace_info,
-                "actions_taken": actions_taken,
-                "iteration": iteration + 1
-            }
-            
-            # System prompt for the agent
-            system_prompt = """You are an autonomous AI agent with file management capabilities. You can:
-
-1. view(path) - Read files or list directories  
-2. str_replace(path, old_str, new_str) - Replace text in files
-3. insert(path, line_num, text) - Insert text at specific lines
-4. create(path, content) - Create new files
-
-IMPORTANT: You must respond with a JSON object containing:
-- "action": one of ["view", "str_replace", "insert", "create", "complete", "abort"]
-- "parameters": object with the parameters for the action
-- "reasoning": string explaining why you're taking this action
-- "status": "continue" or "complete" or "abort"
+    except Exception as e:
+        stream_update(f"❌ Error with Fetch.ai agent: {str(e)}", "error")
+        return {"success": False, "error": str(e)}
 
-If action is "complete", you're done. If "abort", you're stopping due to an error.
-For file operations, check if files exist first using "view" before modifying them."""
 
-            # Build user prompt with context
-            user_prompt = f"""Task: {prompt}
+def validate_workspace(path, command=AGENT_VALIDATE_COMMAND, timeout=AGENT_VALIDATE_TIMEOUT):
+    """Run the validation command in path; returns (passed, tail of its output)"""
+    if not command:
+        return True, ""
+    try:
+        result = subprocess.run(command, shell=True, cwd=str(path), capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False, f"timed out after {timeout}s"
+    return result.returncode == 0, (result.stdout + result.stderr)[-500:]
 
-Current workspace: {workspace_path}
-Workspace contents: {json.dumps(workspace_info, indent=2)}
 
-Actions taken so far: {json.dumps(actions_taken, indent=2)}
+def tag_attempt(update, attempt, attempts):
+    """An attempt's SSE progress update, marked with the attempt it came from"""
+    progress_data = json.loads(update[len("data: "):])
+    progress_data["attempt"] = attempt
+    if progress_data["type"] != "token":
+        progress_data["message"] = f"[{attempt}/{attempts}] {progress_data['message']}"
+    return f"data: {json.dumps(progress_data)}\n\n"
 
-What should I do next to complete this task? Respond with JSON only."""
 
+def call_fetch_agent_speculative_generator(prompt, repo_path, attempts, priority=PRIORITY_BACKGROUND):
+    """Run several independent agent attempts on repo_path; the first success wins
+    
+    Each attempt runs in its own thread, in its own git worktree checked out
+    from repo_path's HEAD next to it, and its progress is streamed tagged
+    with its attempt number. The first attempt that completes with changes
+    in its worktree and passes validate_workspace wins: the others are cancelled at their next event
+    and their worktrees removed. Same protocol as
+    call_fetch_agent_streaming_generator: SSE updates, then a result dict,
+    whose "workspace" is the winner's worktree, where the PR is made from.
+    The caller removes it with cleanup_repo.
+    """
+    def stream_progress(message, step=None, data_type="progress"):
+        """Helper function to yield SSE formatted progress updates"""
+        return f"data: {json.dumps({'type': data_type, 'message': message, 'step': step or 'unknown'})}\n\n"
+    
+    repo_path = Path(repo_path).resolve()
+    events = queue.Queue()
+    cancelled = threading.Event()
+    claim = threading.Lock()
+    winner = []
+    
+    def run_attempt(attempt):
+        workspace = Path(tempfile.mkdtemp(prefix=f"{repo_path.name}.attempt{attempt}-", dir=repo_path.parent))
+        won = False
+        try:
+            if not add_worktree(repo_path, workspace):
+                raise RuntimeError(f"Could not check out a worktree of {repo_path}")
+            index = RepoIndex.build(workspace)
+            generator = call_fetch_agent_streaming_generator(prompt, str(workspace), index=index, priority=priority)
             try:
-                # Make API call
-                stream_update(f"🧠 AI thinking (iteration {iteration + 1})...", f"thinking_{iteration + 1}")
-                
-                response = requests.post(
-                    f"{agent.base_url}/chat/completions",
-                    headers=agent.headers,
-                    json={
-                        "model": agent.model,
-                        "max_tokens": 2000,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user", 
-                                "content": user_prompt
-                            }
-                        ]
-                    },
-                    timeout=30
-                )
-                
-                if response.status_code != 200:
-                    stream_update(f"❌ API request failed: {response.status_code}", "error")
-                    return {
-                        "success": False,
-                        "error": f"API request failed: {response.status_code}",
-                        "actions_taken": actions_taken
-                    }
-                
-                ai_response = response.json()
-                content = ai_response.get("choices", [{}])[0].get("message", {}).get("content", "")
-                
-                # Parse AI response
-                try:
-                    decision = json.loads(content)
-                except json.JSONDecodeError:
-                    # Try to extract JSON from response
-                    import re
-                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                    if json_match:
-                        decision = json.loads(json_match.group())
-                    else:
-                        stream_update("❌ Could not parse AI response as JSON", "error")
-                        return {
-                            "success": False,
-                            "error": "Could not parse AI response as JSON",
-                            "actions_taken": actions_taken,
-                            "raw_response": content
-                        }
-                
-                action = decision.get("action", "abort")
-                parameters = decision.get("parameters", {})
-                reasoning = decision.get("reasoning", "No reasoning provided")
-                status = decision.get("status", "abort")
-                
-                stream_update(f"🧠 Agent reasoning: {reasoning}", f"reasoning_{iteration + 1}")
-                stream_update(f"⚡ Agent action: {action}", f"action_{iteration + 1}")
-                
-                # Execute the action
-                if action == "complete":
-                    stream_update("✅ Agent completed task successfully", "completed")
-                    return {
-                        "success": True,
-                        "message": "Task completed successfully",
-                        "agent": agent,
-                        "actions": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                elif action == "abort":
-                    stream_update(f"🛑 Agent aborted: {reasoning}", "aborted")
-                    return {
-                        "success": False,
-                        "message": "Agent decided to abort",
-                        "reason": reasoning,
-                        "actions": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                elif action == "view":
-                    result = agent.view(parameters.get("path", "."))
-                    actions_taken.append({
-                        "type": "view",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        stream_update(f"📄 Viewed: {parameters.get('path', '.')}", f"viewed_{iteration + 1}")
-                elif action == "create":
-                    result = agent.create(parameters.get("path"), parameters.get("content", ""))
-                    actions_taken.append({
-                        "type": "create",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        stream_update(f"📝 Created file: {parameters.get('path')}", f"created_{iteration + 1}")
-                elif action == "str_replace":
-                    result = agent.str_replace(
-                        parameters.get("path"), 
-                        parameters.get("old_str"), 
-                        parameters.get("new_str")
-                    )
-                    actions_taken.append({
-                        "type": "str_replace",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        stream_update(f"✏️ Updated file: {parameters.get('path')}", f"updated_{iteration + 1}")
-                elif action == "insert":
-                    result = agent.insert(
-                        parameters.get("path"),
-                        parameters.get("line_num", 1),
-                        parameters.get("text", "")
-                    )
-                    actions_taken.append({
-                        "type": "insert", 
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result.get("success"):
-                        stream_update(f"📝 Inserted into file: {parameters.get('path')}", f"inserted_{iteration + 1}")
-                else:
-                    stream_update(f"❓ Unknown action: {action}", f"unknown_{iteration + 1}")
-                    
-            except Exception as e:
-                stream_update(f"❌ Error in iteration {iteration + 1}: {str(e)}", "error")
-                return {
-                    "success": False,
-                    "error": f"Error in iteration {iteration + 1}: {str(e)}",
-                    "actions": actions_taken
-                }
-        
-        # If we've reached max iterations
-        stream_update(f"⏰ Agent exceeded maximum iterations ({max_iterations})", "timeout")
-        return {
-            "success": False,
-            "error": f"Agent exceeded maximum iterations ({max_iterations})",
-            "actions": actions_taken
-        }
-        
-    except Exception as e:
-        stream_update(f"❌ Error with Fetch.ai agent: {str(e)}", "error")
-        return {"success": False, "error": str(e)}
+                for update in generator:
+                    if cancelled.is_set():
+                        events.put(("result", attempt, {"success": False, "error": "cancelled"}))
+                        return
+                    if isinstance(update, dict):
+                        if update["success"] and not has_changes(workspace):
+                            # Nothing to make a PR from; leave the win to an attempt that edited
+                            update["success"] = False
+                            update["error"] = "Finished without changing any files"
+                        if update["success"]:
+                            passed, output = validate_workspace(workspace)
+                            update["validated"] = passed
+                            if not passed:
+                                update["success"] = False
+                                update["error"] = f"Validation failed: {output}"
+                        if update["success"]:
+                            # Only one attempt may keep its worktree
+                            with claim:
+                                won = not winner
+                                if won:
+                                    winner.append(attempt)
+                                    cancelled.set()
+                            if not won:
+                                update = {"success": False, "error": "cancelled"}
+                            update["workspace"] = str(workspace)
+                        events.put(("result", attempt, update))
+                        return
+                    events.put(("update", attempt, update))
+            finally:
+                generator.close()
+        except Exception as e:
+            events.put(("result", attempt, {"success": False, "error": str(e)}))
+        finally:
+            if not won and not remove_worktree(workspace):
+                shutil.rmtree(workspace, ignore_errors=True)
+    
+    yield stream_progress(f"🏁 Starting {attempts} independent agent attempts", "attempts")
+    for attempt in range(1, attempts + 1):
+        threading.Thread(target=run_attempt, args=(attempt,), name=f"agent-attempt-{attempt}", daemon=True).start()
+    
+    delivered = False
+    try:
+        errors = []
+        pending = attempts
+        while pending:
+            kind, attempt, payload = events.get()
+            if kind == "update":
+                yield tag_attempt(payload, attempt, attempts)
+                continue
+            pending -= 1
+            if not payload["success"]:
+                errors.append(f"attempt {attempt}: {payload.get('error', 'Unknown error')}")
+                yield stream_progress(f"✗ Attempt {attempt}/{attempts} failed: {payload.get('error', 'Unknown error')}", f"attempt_{attempt}_failed")
+                continue
+            # The rest were cancelled when this one claimed the win and
+            # drain in the background
+            payload["attempt"] = attempt
+            payload["attempts"] = attempts
+            yield stream_progress(f"🏆 Attempt {attempt}/{attempts} won after {payload['iterations']} iterations; "
+                                  "cancelling the others", "attempt_won")
+            delivered = True
+            yield payload
+            return
+        yield {"success": False, "error": "; ".join(errors) or "No attempt finished"}
+    finally:
+        cancelled.set()
+        if not delivered:
+            # Closed early: remove a winner nobody will make a PR from
+            with claim:
+                winner.append(None)
+            
+            def drain(pending):
+                while pending:
+                    kind, _, payload = events.get()
+                    if kind == "result":
+                        pending -= 1
+                        if payload.get("success"):
+                            remove_worktree(payload["workspace"])
+            
+            threading.Thread(target=drain, args=(pending,), name="agent-attempts-drain", daemon=True).start()
 
 
 def cleanup_repo(repo_path):
@@ -489,6 +338,11 @@ def cleanup_repo(repo_path):
         os.chmod(path, stat.S_IWRITE)
         func(path)
     
+    # Worktrees are unregistered from their mirror, which stays for the next job
+    if is_worktree(repo_path) and remove_worktree(repo_path):
+        print(f"🧹 Removed worktree: {repo_path}")
+        return True
+    
     try:
         shutil.rmtree(repo_path, onerror=remove_readonly)
         print(f"🧹 Cleaned up repository folder: {repo_path}")
@@ -499,7 +353,7 @@ def cleanup_repo(repo_path):
         return False
 
 
-def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, progress_callback=None, source_branch=None, target_branch=None):
+def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, progress_callback=None, source_branch=None, target_branch=None, prose=False):
     """
     Pull a repository, edit it using AI agent, and create a PR
     
@@ -512,6 +366,7 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
         progress_callback (callable): Optional callback function for progress updates
         source_branch (str): Branch to clone from (default: main/master)
         target_branch (str): Branch to create PR against (default: main)
+        prose (bool): Have the LLM write the PR title and body even for small changes
     
     Returns:
         dict: Result containing success status, PR URL, and other metadata
@@ -535,7 +390,8 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
     else:
         log_progress("📥 Cloning repository...", "clone")
     
-    repo_path = clone_repo(git_url, branch=source_branch)
+    clone_info = {}
+    repo_path = clone_repo(git_url, branch=source_branch, info=clone_info)
     if not repo_path:
         return {
             "success": False,
@@ -543,12 +399,18 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
             "pr_url": None
         }
 
-    log_progress(f"📁 Repository cloned to: {repo_path}", "cloned")
+    log_progress(f"📁 Repository cloned to: {repo_path}{describe_clone(clone_info)}", "cloned")
     
+    cleaned = False
     try:
+        index = RepoIndex.build(repo_path)
+        stats = index.stats()
+        log_progress(f"🗂️ Indexed {stats['files']} files, {stats['symbols']} symbols in {stats['build_seconds']}s", "indexed")
+        
         # Use Fetch.ai agent with the provided prompt
         log_progress("🤖 Initializing AI agent for code editing...", "agent_init")
-        agent_result = call_fetch_agent(prompt, repo_path)
+        # PR jobs yield the LLM quota to interactive browser runs
+        agent_result = call_fetch_agent(prompt, repo_path, index=index, priority=PRIORITY_BACKGROUND)
         if not agent_result["success"]:
             return {
                 "success": False,
@@ -559,29 +421,45 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
         
         log_progress("✓ AI agent completed code changes successfully", "agent_complete")
         
-        # Generate AI-powered PR metadata if not provided
-        if pr_title is None or pr_body is None:
-            log_progress("🤖 Generating intelligent PR metadata...", "pr_metadata")
-            agent = agent_result["agent"]
-            actions = agent_result["actions"]
-            
-            pr_metadata = agent.generate_pr_metadata(
-                actions, 
-                repo_context=f"Repository: {git_url}"
-            )
+        # Small change sets get template PR metadata at once; an LLM-written
+        # description is generated while the branch is pushed
+        agent = agent_result["agent"]
+        actions = agent_result["actions"]
+        template = template_pr_metadata(summarize_actions(actions, repo_path), prompt)
+        
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            metadata_future = None
+            if pr_title is None or pr_body is None:
+                log_progress("📝 Preparing PR metadata...", "pr_metadata")
+                metadata_future = pool.submit(
+                    agent.generate_pr_metadata,
+                    actions,
+                    repo_context=f"Repository: {git_url}",
+                    task=prompt,
+                    prose=prose,
+                    root=repo_path
+                )
+            log_progress("📤 Pushing changes...", "pr_push")
+            head_branch = push_branch(repo_path, pr_title or template["title"])
             
-            if pr_metadata["success"]:
-                log_progress(f"✓ AI generated PR title: '{pr_metadata['title']}'", "pr_title")
+            if metadata_future is not None:
+                pr_metadata = metadata_future.result()
+                if pr_metadata["success"]:
+                    log_progress(f"✓ PR title: '{pr_metadata['title']}'", "pr_title")
+                else:
+                    log_progress(f"⚠️ AI metadata generation failed, using template: {pr_metadata.get('error', 'Unknown error')}", "pr_fallback")
                 if pr_title is None:
                     pr_title = pr_metadata["title"]
                 if pr_body is None:
                     pr_body = pr_metadata["body"]
-            else:
-                log_progress(f"⚠️ AI metadata generation failed, using fallback: {pr_metadata.get('error', 'Unknown error')}", "pr_fallback")
-                if pr_title is None:
-                    pr_title = "AI Agent: Automated code changes"
-                if pr_body is None:
-                    pr_body = f"This PR was created by an AI agent.\n\nPrompt used: {prompt}"
+        
+        if not head_branch:
+            return {
+                "success": False,
+                "error": "Failed to push changes",
+                "pr_url": None,
+                "repo_path": repo_path
+            }
         
         # Make PR with the metadata
         if target_branch:
@@ -589,7 +467,7 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
         else:
             log_progress("📤 Creating pull request...", "pr_create")
         
-        pr_url = make_pr(repo_path, pr_title, body=pr_body, base=target_branch or 'main')
+        pr_url = open_pr(repo_path, head_branch, pr_title, body=pr_body, base=target_branch or 'main')
         
         if pr_url:
             log_progress("🎉 PR created successfully!", "pr_success")
@@ -609,6 +487,7 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
             if cleanup:
                 log_progress("🧹 Cleaning up repository folder...", "cleanup")
                 cleanup_success = cleanup_repo(repo_path)
+                cleaned = True
                 result["cleanup_success"] = cleanup_success
                 if cleanup_success:
                     log_progress("✓ Repository folder cleaned up successfully", "cleanup_complete")
@@ -631,9 +510,13 @@ def pull_edit_pr(prompt, git_url, cleanup=True, pr_title=None, pr_body=None, pro
             "pr_url": None,
             "repo_path": repo_path
         }
+    finally:
+        # Failed jobs leave their checkout behind too unless it is removed here
+        if cleanup and not cleaned:
+            cleanup_repo(repo_path)
 
 
-def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
+def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None, attempts=None, prose=False):
     """
     Streaming version of pull_edit_pr that yields progress updates
     
@@ -642,21 +525,28 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
         git_url (str): The URL of the git repository to clone
         cleanup (bool): Whether to clean up the repo folder after creating PR (default: True)
         branch (str): Branch to clone from and create PR against (default: main)
+        attempts (int): Independent agent attempts, first success wins (default: AGENT_ATTEMPTS,
+            capped at AGENT_MAX_ATTEMPTS)
+        prose (bool): Have the LLM write the PR title and body even for small changes
     
     Yields:
         str: Server-sent event formatted progress updates
     """
     import json
     
-    def stream_progress(message, step=None, data_type="progress"):
+    def stream_progress(message, step=None, data_type="progress", data=None):
         """Helper function to yield SSE formatted progress updates"""
         progress_data = {
             'type': data_type,
             'message': message,
             'step': step or 'unknown'
         }
+        if data is not None:
+            progress_data['data'] = data
         return f"data: {json.dumps(progress_data)}\n\n"
     
+    repo_path = workspace = None
+    cleaned = False
     try:
         yield stream_progress("🚀 Starting pull_edit_pr workflow...", "init")
         yield stream_progress(f"📋 Prompt: {prompt}", "prompt")
@@ -671,18 +561,29 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
         else:
             yield stream_progress("📥 Cloning repository...", "clone")
         
-        repo_path = clone_repo(git_url, branch=branch)
+        clone_info = {}
+        repo_path = clone_repo(git_url, branch=branch, info=clone_info)
         if not repo_path:
             yield stream_progress("❌ Failed to clone repository", "error", "error")
             return
         
-        yield stream_progress(f"📁 Repository cloned to: {repo_path}", "cloned")
+        yield stream_progress(f"📁 Repository cloned to: {repo_path}{describe_clone(clone_info)}", "cloned", data=clone_info or None)
+        
+        # Index once up front so the agent's searches don't walk the tree
+        index = RepoIndex.build(repo_path)
+        stats = index.stats()
+        yield stream_progress(f"🗂️ Indexed {stats['files']} files, {stats['symbols']} symbols in {stats['build_seconds']}s", "indexed")
         
         # Use Fetch.ai agent with the provided prompt (streaming version)  
         yield stream_progress("🤖 Initializing AI agent for code editing...", "agent_init")
         
         # Use generator-based streaming for agent
-        agent_generator = call_fetch_agent_streaming_generator(prompt, repo_path)
+        # PR jobs yield the LLM quota to interactive browser runs
+        attempts = max(1, min(int(attempts or AGENT_ATTEMPTS), AGENT_MAX_ATTEMPTS))
+        if attempts > 1:
+            agent_generator = call_fetch_agent_speculative_generator(prompt, repo_path, attempts, priority=PRIORITY_BACKGROUND)
+        else:
+            agent_generator = call_fetch_agent_streaming_generator(prompt, repo_path, index=index, priority=PRIORITY_BACKGROUND)
         agent_result = None
         
         for update in agent_generator:
@@ -701,26 +602,45 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
         
         yield stream_progress("✓ AI agent completed code changes successfully", "agent_complete")
         
-        # Generate AI-powered PR metadata
-        yield stream_progress("🤖 Generating intelligent PR metadata...", "pr_metadata")
+        # Speculative runs make the PR from the winning attempt's worktree
+        workspace = agent_result.get("workspace", repo_path)
+        
+        # Small change sets get template PR metadata at once; an LLM-written
+        # description is generated while the branch is pushed, and the
+        # commit message always comes from the template
         agent = agent_result["agent"]
         actions = agent_result["actions"]
+        template = template_pr_metadata(summarize_actions(actions, workspace), prompt)
         
-        pr_metadata = agent.generate_pr_metadata(
-            actions, 
-            repo_context=f"Repository: {git_url}"
-        )
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            metadata_future = pool.submit(
+                agent.generate_pr_metadata,
+                actions,
+                repo_context=f"Repository: {git_url}",
+                task=prompt,
+                prose=prose,
+                root=workspace
+            )
+            yield stream_progress("📤 Pushing changes...", "pr_push")
+            started = time.monotonic()
+            head_branch = push_branch(workspace, template["title"])
+            if head_branch:
+                yield stream_progress(f"✓ Pushed branch {head_branch} in {time.monotonic() - started:.1f}s", "pr_pushed")
+            pr_metadata = metadata_future.result()
         
-        if pr_metadata["success"]:
-            yield stream_progress(f"✓ AI generated PR title: '{pr_metadata['title']}'", "pr_title")
-            pr_title = pr_metadata["title"]
-            pr_body = pr_metadata["body"]
-        else:
+        pr_title = pr_metadata["title"]
+        pr_body = pr_metadata["body"]
+        if not pr_metadata["success"]:
             error_msg = pr_metadata.get('error', 'Unknown error')
-            yield stream_progress(f"⚠️ AI metadata generation failed: {error_msg}", "pr_fallback")
-            yield stream_progress(f"📋 Full metadata response: {pr_metadata}", "debug")
-            pr_title = "AI Agent: Automated code changes"
-            pr_body = f"This PR was created by an AI agent.\n\nPrompt used: {prompt}"
+            yield stream_progress(f"⚠️ AI metadata generation failed, using template: {error_msg}", "pr_fallback")
+        elif pr_metadata["generator"] == "llm":
+            yield stream_progress(f"✓ AI generated PR title: '{pr_title}'", "pr_title")
+        else:
+            yield stream_progress(f"📝 PR title: '{pr_title}'", "pr_title")
+        
+        if not head_branch:
+            yield stream_progress("❌ Failed to push changes", "error", "error")
+            return
         
         # Make PR with the metadata
         if branch:
@@ -728,7 +648,7 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
         else:
             yield stream_progress("📤 Creating pull request...", "pr_create")
         
-        pr_url = make_pr(repo_path, pr_title, body=pr_body, base=branch or 'main')
+        pr_url = open_pr(workspace, head_branch, pr_title, body=pr_body, base=branch or 'main')
         
         if pr_url:
             yield stream_progress("🎉 PR created successfully!", "pr_success")
@@ -742,15 +662,20 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
                 'pr_body': pr_body,
                 'actions': agent_result["actions"],
                 'iterations': agent_result["iterations"],
-                'repo_path': repo_path
+                'repo_path': workspace
             }
+            if "attempt" in agent_result:
+                success_data['attempt'] = agent_result["attempt"]
+                success_data['attempts'] = agent_result["attempts"]
             
             yield f"data: {json.dumps(success_data)}\n\n"
             
             # Clean up if requested
             if cleanup:
                 yield stream_progress("🧹 Cleaning up repository folder...", "cleanup")
-                cleanup_success = cleanup_repo(repo_path)
+                # Worktrees go before the repository they belong to
+                cleanup_success = all([cleanup_repo(path) for path in dict.fromkeys([workspace, repo_path])])
+                cleaned = True
                 if cleanup_success:
                     yield stream_progress("✓ Repository folder cleaned up successfully", "cleanup_complete")
                     success_data["cleanup_success"] = True
@@ -764,6 +689,12 @@ def pull_edit_pr_streaming(prompt, git_url, cleanup=True, branch=None):
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         yield stream_progress(f"❌ {error_msg}", "error", "error")
+    finally:
+        # Every job checks out a directory of its own; don't leave failed ones behind
+        if cleanup and not cleaned:
+            for path in dict.fromkeys([workspace, repo_path]):
+                if path:
+                    cleanup_repo(path)
 
 
 def main():
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""Agent loop engine shared by the blocking, generator and callback entry points"""
+
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from fetch import (FetchAIAgent, ContextBudget, JsonObjectScanner, parse_actions, parse_decision,
+                   TERMINAL_ACTIONS, AGENT_DECISION_SCHEMA)
+from llm_client import LLMError
+from stall import StallDetector, AGENT_STALL_ITERATIONS
+from router import ModelRouter
+
+MAX_ITERATIONS = 50
+
+# Structured output requested from the API: json_schema (the typed decision
+# schema), json_object (any JSON object) or none. A server rejecting one is
+# retried with the next weaker format, remembered per server and model.
+AGENT_RESPONSE_FORMAT = os.getenv("AGENT_RESPONSE_FORMAT", "json_schema")
+RESPONSE_FORMATS = {
+    "json_schema": {"type": "json_schema", "json_schema": AGENT_DECISION_SCHEMA},
+    "json_object": {"type": "json_object"},
+}
+FORMAT_FALLBACK = {"json_schema": "json_object", "json_object": "none"}
+_accepted_formats: Dict[tuple, str] = {}
+
+# Correction turns allowed per iteration before a malformed reply ends the run
+AGENT_REPAIR_ATTEMPTS = int(os.getenv("AGENT_REPAIR_ATTEMPTS", "2"))
+REPAIR_PROMPT = (
+    "Your last reply could not be used: {problem}. Reply again with only the JSON "
+    "object described in the instructions, with no other text."
+)
+
+# Streamed model output is forwarded in batches of this many chars or seconds
+TOKEN_FLUSH_CHARS = 64
+TOKEN_FLUSH_SECONDS = 0.1
+
+
+def summarize_metrics(iterations: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Totals over the per-iteration metrics of one run"""
+    llm = sorted(m["llm_seconds"] for m in iterations)
+    return {
+        "iterations": len(iterations),
+        "wall_seconds": round(wall_seconds, 3),
+        "llm_seconds": round(sum(llm), 3),
+        "llm_p50_seconds": round(llm[len(llm) // 2], 3) if llm else 0.0,
+        "llm_max_seconds": round(llm[-1], 3) if llm else 0.0,
+        "tool_seconds": round(sum(m["tool_seconds"] for m in iterations), 3),
+        "prompt_bytes": sum(m["prompt_bytes"] for m in iterations),
+        "prompt_tokens": sum(m["prompt_tokens"] for m in iterations),
+        "completion_tokens": sum(m["completion_tokens"] for m in iterations),
+        "repairs": sum(m["repairs"] for m in iterations),
+    }
+
+
+def format_metrics(metrics: Dict[str, Any]) -> str:
+    """One-line rendering of an iteration's metrics"""
+    first_token = f" (first token {metrics['first_token_seconds']}s)" if metrics.get("first_token_seconds") is not None else ""
+    return (
+        f"{metrics['model']}{' (escalated)' if metrics.get('escalated') else ''}: "
+        f"LLM {metrics['llm_seconds']}s{first_token}, tools {metrics['tool_seconds']}s, "
+        f"prompt {metrics['prompt_tokens']} tokens / {metrics['prompt_bytes'] // 1024} KB, "
+        f"completion {metrics['completion_tokens']} tokens"
+        + (f", {metrics['repairs']} repair(s)" if metrics.get("repairs") else "")
+    )
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """One-line rendering of a run's metrics summary"""
+    return (
+        f"{summary['iterations']} iterations in {summary['wall_seconds']}s: "
+        f"LLM {summary['llm_seconds']}s (median {summary['llm_p50_seconds']}s, slowest {summary['llm_max_seconds']}s), "
+        f"tools {summary['tool_seconds']}s, {summary['prompt_tokens']} prompt + "
+        f"{summary['completion_tokens']} completion tokens"
+    )
+
+
+class AgentEngine:
+    """Runs one agent conversation and reports it as a stream of events
+
+    FetchAIAgent.agent_loop and the generator and callback drivers in
+    edit_agent all consume these events, so the loop, its limits and its
+    timing live in one place. Each event is a dict with a "type":
+
+        iteration  {iteration, max_iterations}
+        thinking   {iteration}
+        token      {iteration, text}              streamed runs only
+        notice     {iteration, message}           repairs, format fallbacks, stalls
+        decision   {iteration, reasoning, actions}
+        action     {iteration, step}              one per executed action
+        metrics    {iteration, metrics}
+        finished   {result}                       always the last event
+
+    The finished result has "success", "outcome" (completed, aborted, error,
+    stalled or timeout), "actions_taken", "iterations" and "metrics", the summary of
+    every iteration's LLM latency, tool time, prompt size and tokens.
+    """
+
+    def __init__(self, agent: FetchAIAgent, max_iterations: int = MAX_ITERATIONS, stream: bool = False,
+                 response_format: str = AGENT_RESPONSE_FORMAT, stall_iterations: int = AGENT_STALL_ITERATIONS):
+        self.agent = agent
+        self.max_iterations = max_iterations
+        # Consecutive no-progress iterations before the run is ended (0 = never)
+        self.stall_iterations = stall_iterations
+        # Streamed runs emit token events and stop reading once the decision closes
+        self.stream = stream
+        self.default_format = response_format
+        # model -> response format in use for it
+        self.formats: Dict[str, str] = {}
+        self.context: Optional[ContextBudget] = None
+        self.router = ModelRouter(agent.model, agent.fast_model)
+
+    def _format(self, model: str) -> str:
+        # Start from the strongest format this server is known to accept
+        if model not in self.formats:
+            self.formats[model] = _accepted_formats.get((self.agent.client.base_url, model), self.default_format)
+        return self.formats[model]
+
+    def _request(self, payload: Dict[str, Any], iteration: int,
+                 metrics: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Run one completion, yielding token events; returns (reply text, usage, finish reason)"""
+        if not self.stream:
+            body = self.agent.client.chat(payload, priority=self.agent.priority)
+            choice = body.get("choices", [{}])[0]
+            content = choice.get("message", {}).get("content", "")
+            return content or "", body.get("usage") or {}, choice.get("finish_reason")
+
+        started = time.monotonic()
+        scanner = JsonObjectScanner()
+        pending, flushed_at = "", time.monotonic()
+        info: Dict[str, Any] = {}
+        chunks = self.agent.client.stream_chat(payload, priority=self.agent.priority, info=info)
+        try:
+            for delta in chunks:
+                if metrics["first_token_seconds"] is None:
+                    metrics["first_token_seconds"] = round(time.monotonic() - started, 3)
+                closed = scanner.feed(delta)
+                # Only the part up to the closing brace belongs to the decision
+                pending += scanner.parts[-1]
+                if closed or len(pending) >= TOKEN_FLUSH_CHARS or time.monotonic() - flushed_at >= TOKEN_FLUSH_SECONDS:
+                    yield {"type": "token", "iteration": iteration, "text": pending}
+                    pending, flushed_at = "", time.monotonic()
+                if closed:
+                    break
+        finally:
+            chunks.close()
+        if pending:
+            yield {"type": "token", "iteration": iteration, "text": pending}
+        # A reply cut off at max_tokens never closes, so the stream was read to its end
+        return scanner.text, info.get("usage") or {}, info.get("finish_reason")
+
+    def _complete(self, messages: List[Dict[str, str]], iteration: int,
+                  metrics: Dict[str, Any], model: str) -> Iterator[Dict[str, Any]]:
+        """Ask model for the next decision, downgrading the response format if the server rejects it
+
+        Adds the call's latency, prompt size and tokens to metrics and the
+        router's per-model stats; returns the reply text and finish reason.
+        """
+        prompt_tokens = self.context.count(messages)
+        metrics["prompt_bytes"] += sum(len(m["content"].encode("utf-8")) for m in messages)
+        while True:
+            response_format = self._format(model)
+            payload = {
+                "model": model,
+                "max_tokens": self.router.max_tokens(model),
+                "messages": messages
+            }
+            if response_format in RESPONSE_FORMATS:
+                payload["response_format"] = RESPONSE_FORMATS[response_format]
+            started = time.monotonic()
+            try:
+                content, usage, finish_reason = yield from self._request(payload, iteration, metrics)
+            except LLMError as e:
+                metrics["llm_seconds"] = round(metrics["llm_seconds"] + time.monotonic() - started, 3)
+                # Servers without structured outputs answer 400 naming the parameter
+                if (e.status_code != 400 or response_format not in RESPONSE_FORMATS
+                        or "response_format" not in str(e) and "json_schema" not in str(e)):
+                    raise
+                self.formats[model] = FORMAT_FALLBACK[response_format]
+                _accepted_formats[(self.agent.client.base_url, model)] = self.formats[model]
+                yield {"type": "notice", "iteration": iteration,
+                       "message": f"⚠️ Server rejected response_format {response_format}; retrying with {self.formats[model]}"}
+                continue
+            elapsed = time.monotonic() - started
+            call_prompt = usage.get("prompt_tokens") or prompt_tokens
+            call_completion = usage.get("completion_tokens") or self.context.count_text(content)
+            metrics["llm_seconds"] = round(metrics["llm_seconds"] + elapsed, 3)
+            metrics["prompt_tokens"] += call_prompt
+            metrics["completion_tokens"] += call_completion
+            self.router.record(model, elapsed, call_prompt, call_completion)
+            return content, finish_reason
+
+    def _decide(self, messages: List[Dict[str, str]], iteration: int,
+                metrics: Dict[str, Any], model: str) -> Iterator[Dict[str, Any]]:
+        """Get a decision from model; returns (reply text, decision, problem)
+
+        A malformed reply gets a short correction turn instead of ending the
+        run; only the repaired reply enters the history. A reply cut off at
+        the fast model's token cap is not repaired on the same model, which
+        would only cut it off again; run() retries it on the strong model.
+        """
+        content, finish_reason = yield from self._complete(messages, iteration, metrics, model)
+        decision, problem = parse_decision(content)
+        repairs = 0
+        while problem and repairs < AGENT_REPAIR_ATTEMPTS:
+            if finish_reason == "length" and model == self.router.fast:
+                break
+            repairs += 1
+            metrics["repairs"] += 1
+            yield {"type": "notice", "iteration": iteration,
+                   "message": f"🔧 Malformed decision ({problem}); asking the model to repair it"}
+            repair = messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": REPAIR_PROMPT.format(problem=problem)},
+            ]
+            content, finish_reason = yield from self._complete(repair, iteration, metrics, model)
+            decision, problem = parse_decision(content)
+        return content, decision, problem
+
+    def run(self, task_description: str, workspace_path: Union[str, Path] = ".") -> Iterator[Dict[str, Any]]:
+        """Drive the agent until it completes, aborts, fails or runs out of iterations"""
+        agent = self.agent
+        started = time.monotonic()
+        actions_taken: List[Dict[str, Any]] = []
+        history: List[Dict[str, Any]] = []
+        router = self.router
+
+        def finished(outcome: str, iterations: int, **fields) -> Dict[str, Any]:
+            result = {
+                "success": outcome == "completed",
+                "outcome": outcome,
+                **fields,
+                "actions_taken": actions_taken,
+                "iterations": iterations,
+                "metrics": {**summarize_metrics(history, time.monotonic() - started), **router.summary()},
+            }
+            return {"type": "finished", "result": result}
+
+        # Message history grows by one assistant turn and one tool result per
+        # iteration, so earlier turns form a stable prefix for prompt caching
+        messages = agent.build_initial_messages(task_description, Path(workspace_path))
+        context = self.context = ContextBudget(model=agent.model)
+        stall = StallDetector(self.stall_iterations)
+
+        for iteration in range(1, self.max_iterations + 1):
+            yield {"type": "iteration", "iteration": iteration, "max_iterations": self.max_iterations}
+            try:
+                context.fit(messages)
+                model = router.choose()
+                metrics = {
+                    "iteration": iteration,
+                    "model": model,
+                    "llm_seconds": 0.0,
+                    "first_token_seconds": None,
+                    "prompt_bytes": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "repairs": 0,
+                    "tool_seconds": 0.0,
+                }
+                history.append(metrics)
+                yield {"type": "thinking", "iteration": iteration}
+                content, decision, problem = yield from self._decide(messages, iteration, metrics, model)
+                # Edits proposed by the fast model are re-decided by the strong one
+                if not problem and router.should_escalate(model, [step["action"] for step in parse_actions(decision)]):
+                    model = metrics["model"] = router.strong
+                    metrics["escalated"] = True
+                    yield {"type": "notice", "iteration": iteration,
+                           "message": f"⬆️ Edit turn: asking {model} instead"}
+                    content, decision, problem = yield from self._decide(messages, iteration, metrics, model)
+                # The fast model's token cap truncates long edits; the strong
+                # model gets a chance before the run fails
+                if problem and router.should_retry_strong(model):
+                    model = metrics["model"] = router.strong
+                    metrics["escalated"] = True
+                    yield {"type": "notice", "iteration": iteration,
+                           "message": f"⬆️ Unusable reply ({problem}): asking {model} instead"}
+                    content, decision, problem = yield from self._decide(messages, iteration, metrics, model)
+                if problem:
+                    yield finished("error", iteration, error="Could not parse AI response as JSON",
+                                   detail=problem, raw_response=content)
+                    return
+
+                steps = parse_actions(decision)
+                reasoning = decision.get("reasoning", "No reasoning provided")
+                yield {"type": "decision", "iteration": iteration, "reasoning": reasoning,
+                       "actions": [step["action"] for step in steps]}
+                messages.append({"role": "assistant", "content": content})
+
+                # Execute the turn's actions; complete/abort end the loop afterwards
+                terminal = next((step["action"] for step in steps if step["action"] in TERMINAL_ACTIONS), None)
+                tools_started = time.monotonic()
+                results = agent.execute_actions([step for step in steps if step["action"] not in TERMINAL_ACTIONS])
+                metrics["tool_seconds"] = round(time.monotonic() - tools_started, 3)
+                metrics["actions"] = len(results)
+                for step in results:
+                    actions_taken.append({
+                        "type": step["action"],
+                        "parameters": step["parameters"],
+                        "result": step["result"],
+                        "reasoning": reasoning
+                    })
+                    yield {"type": "action", "iteration": iteration, "step": step}
+                yield {"type": "metrics", "iteration": iteration, "metrics": metrics}
+
+                if terminal == "complete":
+                    yield finished("completed", iteration, message="Task completed successfully")
+                    return
+                elif terminal == "abort":
+                    yield finished("aborted", iteration, message="Agent decided to abort", reason=reasoning)
+                    return
+
+                # Repeated or failing actions get a corrective note with their
+                # results; a run that keeps stalling ends here instead of
+                # spending the remaining iterations
+                stall.observe(iteration, results)
+                router.observe(results, troubled=bool(metrics["repairs"] or stall.stalled))
+                if stall.exhausted:
+                    yield finished("stalled", iteration, error=f"Agent stalled: {stall.reason}")
+                    return
+                feedback = stall.feedback()
+                if feedback:
+                    yield {"type": "notice", "iteration": iteration,
+                           "message": f"🔁 No progress in {stall.stalled} iteration(s); sent corrective feedback"}
+                context.add_results(messages, results, note=feedback)
+
+            except LLMError as e:
+                yield finished("error", iteration, error=str(e))
+                return
+            except Exception as e:
+                yield finished("error", iteration, error=f"Error in iteration {iteration}: {str(e)}")
+                return
+
+        yield finished("timeout", self.max_iterations,
+                       error=f"Agent exceeded maximum iterations ({self.max_iterations})")
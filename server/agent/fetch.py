@@ -2,26 +2,505 @@
 """Fetch.ai SDK for AI-powered file operations and code editing"""
 
 import os
+import re
 import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Union
-import requests
+from typing import Dict, List, Any, Optional, Tuple, Union
 from datetime import datetime
 
+from repo_index import RepoIndex, list_repo_files
+from workspace import Workspace, is_binary, create_overlay, LARGE_FILE_BYTES
+from patch import apply_patch, merge_versions, write_atomic
+from llm_client import get_llm_client, LLMError, OPENAI_BASE_URL
+from rate_limit import PRIORITY_INTERACTIVE
+from router import AGENT_FAST_MODEL, get_model_stats
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a chars/4 estimate
+    tiktoken = None
+
+# Prompt budget for one agent conversation, in tokens
+CONTEXT_TOKEN_BUDGET = int(os.getenv("AGENT_CONTEXT_TOKENS", "100000"))
+
+# Actions that never modify the workspace and may run concurrently
+READ_ONLY_ACTIONS = {"view", "search"}
+WRITE_ACTIONS = {"create", "str_replace", "insert", "patch"}
+TERMINAL_ACTIONS = {"complete", "abort"}
+MAX_PARALLEL_READS = 8
+# Per-file agent loops apply_fixes runs at once
+AGENT_FIX_WORKERS = int(os.getenv("AGENT_FIX_WORKERS", "4"))
+# Change sets touching at most this many files get a template PR title and
+# body; larger ones are described by the LLM
+AGENT_PR_TEMPLATE_MAX_FILES = int(os.getenv("AGENT_PR_TEMPLATE_MAX_FILES", "3"))
+PR_TITLE_MAX_CHARS = 60
+
+# Largest file content a single view returns; bigger files get a head/tail summary
+VIEW_MAX_CHARS = int(os.getenv("AGENT_VIEW_MAX_CHARS", "60000"))
+VIEW_SUMMARY_LINES = 60
+
 
 class FetchAIError(Exception):
     """Custom exception for Fetch.ai operations"""
     pass
 
 
+# System prompt for the agent loop
+AGENT_SYSTEM_PROMPT = """You are an autonomous AI agent with file management capabilities. You can:
+
+1. view(path, start_line, end_line) - Read files or list directories. Optional
+   1-based inclusive line range; large files without a range return head and tail
+2. str_replace(path, old_str, new_str) - Replace text in files
+3. insert(path, line_num, text) - Insert text at specific lines
+4. create(path, content) - Create new files
+5. search(query, regex, path) - Find symbol definitions, file names and matching
+   lines across the repository, ranked, with line numbers. "regex" (default false)
+   treats query as a regular expression; "path" limits the search to a directory
+6. patch(diff) - Apply a unified diff (---/+++ file headers, @@ hunks, 3 lines of
+   context) to one or more files at once, paths relative to the workspace. Every
+   hunk is checked before anything is written; if one fails, no file changes and
+   the failing hunks are reported. Prefer it for edits at several places
+
+Paths are relative to the workspace root, as in the file tree and in results.
+
+IMPORTANT: You must respond with a JSON object containing:
+- "action": one of ["view", "str_replace", "insert", "create", "search", "patch", "complete", "abort"]
+- "parameters": object with the parameters for the action
+- "reasoning": string explaining why you're taking this action
+- "status": "continue" or "complete" or "abort"
+
+To do several things in one turn, replace "action"/"parameters" with
+"actions": a list of {"action": ..., "parameters": ...} objects. Read-only actions
+(view, search) run in parallel; edits are applied in the order given. Batch
+independent views together, e.g. every file you need to read next.
+
+If action is "complete", you're done. If "abort", you're stopping due to an error.
+For file operations, check if files exist first using "view" before modifying them.
+Prefer "search" over viewing directories one by one to locate code.
+Each result of your actions is sent back to you once, in the following message.
+Old results may later be shortened to save space; view a file again if you need its full content."""
+
+
+class ContextBudget:
+    """Keeps an agent conversation under a token budget
+
+    Tool results are appended through add_results, which replaces a repeated
+    view of an unchanged file with a hash reference. fit() is called before
+    each API request and compacts the oldest tool results in place (first
+    truncating, then summarizing them) until the prompt fits, leaving the
+    opening messages and the most recent turns untouched.
+    """
+    
+    def __init__(self, max_tokens: int = CONTEXT_TOKEN_BUDGET, keep_recent: int = 6,
+                 truncate_chars: int = 2000, model: Optional[str] = None):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.truncate_chars = truncate_chars
+        self.encoder = None
+        if tiktoken is not None:
+            try:
+                self.encoder = tiktoken.encoding_for_model(model or "gpt-4o")
+            except Exception:
+                self.encoder = tiktoken.get_encoding("o200k_base")
+        # message index -> {"items": [{"action", "result", "view_key"}], "stage"}
+        self.entries: Dict[int, Dict[str, Any]] = {}
+        # (path, sha256) of file views whose full content is still in the prompt
+        self.views: Dict[tuple, int] = {}
+        # message index -> (content, tokens); the content is checked on every
+        # lookup because temporary lists (repair turns) reuse later indexes
+        self.token_counts: Dict[int, Tuple[str, int]] = {}
+        self.turn = 0
+    
+    def count_text(self, text: str) -> int:
+        if self.encoder is not None:
+            return len(self.encoder.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+    
+    def count(self, messages: List[Dict[str, str]]) -> int:
+        """Approximate prompt tokens, caching per-message counts"""
+        total = 0
+        for index, message in enumerate(messages):
+            content = message["content"]
+            cached = self.token_counts.get(index)
+            if cached is None or (cached[0] is not content and cached[0] != content):
+                cached = self.token_counts[index] = (content, self.count_text(content) + 4)
+            total += cached[1]
+        return total
+    
+    @staticmethod
+    def format_results(items: List[Dict[str, Any]], note: Optional[str] = None) -> Dict[str, str]:
+        """Wrap the results of one turn's actions, and an optional note, as the next user turn"""
+        if len(items) == 1:
+            body = f"Result of {items[0]['action']}: {json.dumps(items[0]['result'], separators=(',', ':'))}"
+        else:
+            body = "Results of your actions, in order:\n" + "\n".join(
+                f"{n}. {item['action']}: {json.dumps(item['result'], separators=(',', ':'))}"
+                for n, item in enumerate(items, 1)
+            )
+        if note:
+            body = f"{body}\n\n{note}"
+        return {"role": "user", "content": f"{body}\n\nWhat should I do next? Respond with JSON only."}
+    
+    def _dedupe_view(self, result: Dict[str, Any]):
+        if result.get("type") != "file" or not isinstance(result.get("content"), str):
+            return result, None
+        digest = hashlib.sha256(result["content"].encode("utf-8", errors="ignore")).hexdigest()
+        view_key = (result.get("path"), digest)
+        if view_key in self.views:
+            return {
+                "success": True,
+                "type": "file",
+                "path": result.get("path"),
+                "unchanged": True,
+                "sha256": digest[:12],
+                "note": f"File is identical to the content shown in result turn {self.views[view_key]}"
+            }, None
+        self.views[view_key] = self.turn
+        return result, view_key
+    
+    def add_results(self, messages: List[Dict[str, str]], results: List[Dict[str, Any]],
+                    note: Optional[str] = None):
+        """Append one message carrying every action result of a turn"""
+        self.turn += 1
+        items = []
+        for step in results:
+            result, view_key = step["result"], None
+            if step["action"] == "view":
+                result, view_key = self._dedupe_view(result)
+            items.append({"action": step["action"], "result": result, "view_key": view_key})
+        self.entries[len(messages)] = {"items": items, "stage": 0, "note": note}
+        messages.append(self.format_results(items, note))
+    
+    def add_result(self, messages: List[Dict[str, str]], action: str, result: Dict[str, Any]):
+        self.add_results(messages, [{"action": action, "result": result}])
+    
+    def _compact_result(self, result: Dict[str, Any], stage: int) -> Dict[str, Any]:
+        if stage == 0:
+            compacted = {}
+            for key, value in result.items():
+                if isinstance(value, str) and len(value) > self.truncate_chars:
+                    half = self.truncate_chars // 2
+                    value = f"{value[:half]}\n...[{len(value) - self.truncate_chars} chars elided]...\n{value[-half:]}"
+                elif isinstance(value, list) and len(value) > 50:
+                    value = value[:50] + [f"...[{len(value) - 50} more items elided]"]
+                compacted[key] = value
+            return compacted
+        compacted = {k: v for k, v in result.items() if k in ("success", "type", "path", "error", "lines", "count", "replacements")}
+        compacted["note"] = "Result summarized to save context"
+        return compacted
+    
+    def _compact(self, messages: List[Dict[str, str]], index: int):
+        entry = self.entries[index]
+        for item in entry["items"]:
+            if item["view_key"] is not None:
+                # Later views of this file must carry the content again
+                self.views.pop(item["view_key"], None)
+                item["view_key"] = None
+            item["result"] = self._compact_result(item["result"], entry["stage"])
+        entry["stage"] += 1
+        messages[index] = self.format_results(entry["items"], entry["note"])
+        self.token_counts.pop(index, None)
+    
+    def fit(self, messages: List[Dict[str, str]]) -> int:
+        """Compact old tool results until the prompt fits; returns the token count"""
+        total = self.count(messages)
+        protected_from = max(0, len(messages) - self.keep_recent)
+        for stage in (0, 1):
+            for index in sorted(self.entries):
+                if total <= self.max_tokens:
+                    return total
+                if index >= protected_from or self.entries[index]["stage"] != stage:
+                    continue
+                self._compact(messages, index)
+                total = self.count(messages)
+        if total > self.max_tokens:
+            raise FetchAIError(
+                f"Context budget exceeded: prompt needs ~{total} tokens, budget is {self.max_tokens}"
+            )
+        return total
+
+
+AGENT_ACTIONS = ["view", "str_replace", "insert", "create", "search", "patch", "complete", "abort"]
+# Every tool parameter and its JSON type. Strict structured outputs need a
+# closed schema, so all of them are listed and unused ones are sent as null.
+ACTION_PARAMETERS = {
+    "path": "string",
+    "start_line": "integer",
+    "end_line": "integer",
+    "old_str": "string",
+    "new_str": "string",
+    "line_num": "integer",
+    "text": "string",
+    "content": "string",
+    "query": "string",
+    "regex": "boolean",
+    "diff": "string",
+}
+
+# response_format for servers supporting structured outputs; guarantees a
+# decision that parses and names a known action
+AGENT_DECISION_SCHEMA = {
+    "name": "agent_decision",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "reasoning": {"type": "string"},
+            "status": {"type": "string", "enum": ["continue", "complete", "abort"]},
+            "actions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "action": {"type": "string", "enum": AGENT_ACTIONS},
+                        "parameters": {
+                            "type": "object",
+                            "properties": {name: {"type": [kind, "null"]} for name, kind in ACTION_PARAMETERS.items()},
+                            "required": list(ACTION_PARAMETERS),
+                            "additionalProperties": False,
+                        },
+                    },
+                    "required": ["action", "parameters"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["reasoning", "status", "actions"],
+        "additionalProperties": False,
+    },
+}
+
+
+class JsonObjectScanner:
+    """Detects when the first top-level JSON object in streamed text is complete
+    
+    Lets a streamed decision be acted on as soon as its closing brace arrives
+    rather than when the stream ends. Text after the object is dropped.
+    """
+    
+    def __init__(self):
+        self.parts: List[str] = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.closed = False
+    
+    def feed(self, chunk: str) -> bool:
+        """Consume a chunk; returns True once the object has closed"""
+        if self.closed:
+            return True
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth:
+                self.depth -= 1
+                if not self.depth:
+                    self.parts.append(chunk[:i + 1])
+                    self.closed = True
+                    return True
+        self.parts.append(chunk)
+        return False
+    
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def parse_decision(content: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Decode a model reply; returns (decision, None) or (None, what is wrong with it)"""
+    try:
+        decision = json.loads(content)
+    except json.JSONDecodeError as e:
+        # Without structured outputs the JSON is sometimes wrapped in prose
+        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+        try:
+            decision = json.loads(json_match.group()) if json_match else None
+        except json.JSONDecodeError:
+            decision = None
+        if decision is None:
+            return None, f"invalid JSON ({e.msg} at line {e.lineno}, column {e.colno})"
+    if not isinstance(decision, dict):
+        return None, "the reply must be a JSON object"
+    actions = decision.get("actions")
+    if isinstance(actions, list) and actions:
+        if not all(isinstance(step, dict) and step.get("action") for step in actions):
+            return None, 'every entry of "actions" needs an "action"'
+    elif not decision.get("action"):
+        return None, 'missing "action" (or a non-empty "actions" list)'
+    return decision, None
+
+
+def parse_actions(decision: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Normalize a decision into a list of {"action", "parameters"} steps
+
+    Null parameters (unused fields of the structured-output schema) are
+    dropped so the tools fall back to their defaults.
+    """
+    def clean(parameters):
+        return {k: v for k, v in (parameters or {}).items() if v is not None}
+    
+    if isinstance(decision.get("actions"), list) and decision["actions"]:
+        return [
+            {"action": step.get("action", "abort"), "parameters": clean(step.get("parameters"))}
+            for step in decision["actions"] if isinstance(step, dict)
+        ]
+    return [{"action": decision.get("action", "abort"), "parameters": clean(decision.get("parameters"))}]
+
+
+def summarize_actions(actions_taken: List[Dict[str, Any]], root: Optional[Union[str, Path]] = None) -> Dict[str, Any]:
+    """Files an agent run created, modified and deleted, with one summary line per edit
+
+    Paths are shown relative to root where possible. A file both created and
+    later edited counts as created; a file created and then deleted is left
+    out, and one modified and then deleted counts as deleted.
+    """
+    def show(path):
+        # Tool paths are already workspace-relative unless the model gave an absolute one
+        if root is not None and Path(path).is_absolute():
+            try:
+                return Path(path).resolve().relative_to(Path(root).resolve()).as_posix()
+            except ValueError:
+                pass
+        return str(path)
+    
+    files_created: List[str] = []
+    files_modified: List[str] = []
+    files_deleted: List[str] = []
+    actions_summary: List[str] = []
+    detailed_actions: List[str] = []
+    reasons: List[str] = []
+    
+    def record(file_path, status):
+        if status == "created":
+            if file_path in files_deleted:
+                files_deleted.remove(file_path)
+                status = "modified"
+            elif file_path not in files_created:
+                files_created.append(file_path)
+                return
+        if status == "deleted":
+            if file_path in files_created:
+                files_created.remove(file_path)
+                return
+            if file_path in files_modified:
+                files_modified.remove(file_path)
+            if file_path not in files_deleted:
+                files_deleted.append(file_path)
+            return
+        if file_path not in files_created and file_path not in files_modified:
+            files_modified.append(file_path)
+    
+    for action in actions_taken:
+        action_type = action.get("type", "unknown")
+        parameters = action.get("parameters", {})
+        if action_type not in WRITE_ACTIONS or not (action.get("result") or {"success": True}).get("success"):
+            # View and search actions are just analysis
+            continue
+        if action_type == "patch":
+            for entry in (action.get("result") or {}).get("files", []):
+                file_path = show(entry["path"])
+                status = entry.get("status", "modified")
+                record(file_path, status)
+                verb = {"created": "Created", "deleted": "Deleted"}.get(status, "Patched")
+                actions_summary.append(f"{verb} {file_path}")
+                detailed_actions.append(f"Applied a diff to {file_path} ({status}: +{entry.get('added', 0)} -{entry.get('removed', 0)} lines)")
+        else:
+            file_path = show(parameters.get("path", "unknown"))
+            if action_type == "create":
+                content = parameters.get("content", "")
+                record(file_path, "created")
+                actions_summary.append(f"Created {file_path}")
+                detailed_actions.append(f"Created file '{file_path}' with content: '{content[:50]}{'...' if len(content) > 50 else ''}'")
+            elif action_type == "str_replace":
+                record(file_path, "modified")
+                actions_summary.append(f"Updated content in {file_path}")
+                detailed_actions.append(f"Replaced '{parameters.get('old_str', '')[:30]}...' with '{parameters.get('new_str', '')[:30]}...' in {file_path}")
+            else:
+                record(file_path, "modified")
+                actions_summary.append(f"Added lines to {file_path}")
+                detailed_actions.append(f"Inserted '{parameters.get('text', '')[:30]}...' at line {parameters.get('line_num', 0)} in {file_path}")
+        reasoning = (action.get("reasoning") or "").strip()
+        if reasoning and reasoning not in reasons:
+            reasons.append(reasoning)
+    return {
+        "files_created": files_created,
+        "files_modified": files_modified,
+        "files_deleted": files_deleted,
+        "actions_summary": list(dict.fromkeys(actions_summary)),
+        "detailed_actions": detailed_actions,
+        "reasons": reasons,
+    }
+
+
+def template_pr_metadata(changes: Dict[str, Any], task: str = "") -> Dict[str, str]:
+    """Deterministic PR title and body from a summarize_actions result"""
+    created, modified = changes["files_created"], changes["files_modified"]
+    deleted = changes.get("files_deleted", [])
+    
+    def names(paths):
+        return ", ".join(Path(p).name for p in paths)
+    
+    def count(paths):
+        return f"{len(paths)} file{'s' if len(paths) != 1 else ''}"
+    
+    def title_for(describe):
+        parts = [f"{verb} {describe(paths)}" for verb, paths in
+                 (("add", created), ("update", modified), ("remove", deleted)) if paths]
+        if len(parts) > 1:
+            return ", ".join(parts[:-1]) + " and " + parts[-1]
+        return parts[0] if parts else ""
+    
+    title = title_for(names)
+    if len(title) > PR_TITLE_MAX_CHARS:
+        title = title_for(count)
+    title = (title[:1].upper() + title[1:]) if title else "AI-generated changes"
+    
+    sections = []
+    if task:
+        sections.append(f"Requested change: {task.strip()}")
+    if changes["reasons"]:
+        sections.append("Agent notes:\n\n" + "\n".join(f"- {reason[:200]}" for reason in changes["reasons"][:5]))
+    lines = ([f"- Created `{p}`" for p in created] + [f"- Modified `{p}`" for p in modified]
+             + [f"- Deleted `{p}`" for p in deleted])
+    sections.append("Changes made by Fetch.ai agent:\n\n" + ("\n".join(lines) or "- No file changes"))
+    return {"title": title, "body": "\n\n".join(sections)}
+
+
 class FetchAIAgent:
     """AI agent for automated code editing and file operations"""
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4.1-2025-04-14"):
-        """Initialize the Fetch.ai agent with API configuration"""
+    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4.1-2025-04-14",
+                 index: Optional[RepoIndex] = None, priority: int = PRIORITY_INTERACTIVE,
+                 fast_model: Optional[str] = AGENT_FAST_MODEL):
+        """Initialize the Fetch.ai agent with API configuration
+        
+        index is a prebuilt RepoIndex of the workspace (built at clone time);
+        without one, the agent loop indexes its workspace on start. priority
+        orders this agent's requests in the shared LLM rate limiter.
+        fast_model handles navigation turns and PR metadata (see router.py);
+        model makes the edits.
+        """
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         self.model = model
-        self.base_url = "https://api.openai.com/v1"
+        self.fast_model = fast_model
+        self.index = index
+        self.priority = priority
+        # File I/O goes through the workspace cache; agent_loop re-roots it
+        self.workspace = Workspace(index.root if index else ".")
+        self.base_url = OPENAI_BASE_URL
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}"
@@ -29,47 +508,47 @@ class FetchAIAgent:
         
         if not self.api_key:
             raise FetchAIError("API key not provided. Set OPENAI_API_KEY environment variable.")
+        # Shared keep-alive pool with timeouts and retry/backoff on 429 and 5xx
+        self.client = get_llm_client(self.api_key, self.base_url)
     
-    def view(self, path: Union[str, Path]) -> Dict[str, Any]: # type: ignore
-        """Read files or list directory contents"""
-        path = Path(path)
+    def view(self, path: Union[str, Path], start_line: Optional[int] = None,
+             end_line: Optional[int] = None) -> Dict[str, Any]: # type: ignore
+        """Read files or list directory contents
+        
+        start_line/end_line (1-based, inclusive) select part of a file. Content
+        is capped at VIEW_MAX_CHARS; a larger file viewed without a range comes
+        back as its first and last VIEW_SUMMARY_LINES lines.
+        """
+        path = self.workspace.resolve(path)
+        shown = self.workspace.display(path)
         
         try:
             if not path.exists():
                 return {
                     "success": False,
-                    "error": f"Path does not exist: {path}",
+                    "error": f"Path does not exist: {shown}",
                     "content": None
                 }
             
             if path.is_file():
-                # Read file content
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                
-                return {
-                    "success": True,
-                    "type": "file",
-                    "path": str(path),
-                    "content": content,
-                    "size": len(content),
-                    "lines": len(content.splitlines())
-                }
+                return self._view_file(path, start_line, end_line)
             
             elif path.is_dir():
-                # List directory contents
-                items = []
-                for item in path.iterdir():
-                    items.append({
-                        "name": item.name,
-                        "type": "directory" if item.is_dir() else "file",
-                        "path": str(item)
-                    })
+                # List directory contents, from the cached tree inside the workspace
+                items = self.workspace.list_dir(path)
+                if items is None:
+                    items = []
+                    for item in path.iterdir():
+                        items.append({
+                            "name": item.name,
+                            "type": "directory" if item.is_dir() else "file",
+                            "path": str(item)
+                        })
                 
                 return {
                     "success": True,
                     "type": "directory",
-                    "path": str(path),
+                    "path": shown,
                     "items": items,
                     "count": len(items)
                 }
@@ -77,41 +556,114 @@ class FetchAIAgent:
         except Exception as e:
             return {
                 "success": False,
-                "error": f"Failed to read {path}: {str(e)}",
+                "error": f"Failed to read {shown}: {self.workspace.scrub(str(e))}",
                 "content": None
             }
     
+    def _view_file(self, path: Path, start_line: Optional[int], end_line: Optional[int]) -> Dict[str, Any]:
+        shown = self.workspace.display(path)
+        size = path.stat().st_size
+        if size > LARGE_FILE_BYTES:
+            # Large files are never loaded whole; lines come out of an mmap
+            index = self.workspace.line_index(path)
+            binary = index.binary
+            total = index.line_count
+            get_lines = index.lines
+        else:
+            data = self.workspace.read_bytes(path)
+            binary = is_binary(data)
+            file_lines = data.decode('utf-8', errors='ignore').splitlines(keepends=True)
+            total = len(file_lines)
+
+            def get_lines(start: int, end: int, max_chars: Optional[int] = None, from_end: bool = False) -> str:
+                text = ''.join(file_lines[start - 1:end])
+                if max_chars is None:
+                    return text
+                return (text[-max_chars:] if max_chars else '') if from_end else text[:max_chars]
+        
+        if binary:
+            return {
+                "success": True,
+                "type": "binary",
+                "path": shown,
+                "content": None,
+                "size": size,
+                "note": "Binary file, content not shown"
+            }
+        
+        result = {"success": True, "type": "file", "path": shown, "size": size, "lines": total}
+        if start_line is not None or end_line is not None:
+            start = int(start_line or 1)
+            end = min(int(end_line or total), total)
+            if start < 1 or start > max(total, 1) or end < start - 1:
+                return {
+                    "success": False,
+                    "error": f"Invalid line range {start_line}-{end_line}: {shown} has {total} lines",
+                    "content": None
+                }
+            # One character past the cap is enough to tell the range was cut
+            content = get_lines(start, end, VIEW_MAX_CHARS + 1)
+            if len(content) > VIEW_MAX_CHARS:
+                # Cut at a line boundary where possible and report where it stopped
+                cut = content.rfind('\n', 0, VIEW_MAX_CHARS) + 1 or VIEW_MAX_CHARS
+                content = content[:cut]
+                end = start + max(content.count('\n') - 1, 0)
+                result["truncated"] = True
+                result["note"] = f"Range capped at {VIEW_MAX_CHARS} chars; continue from line {end + 1}"
+            result.update({"content": content, "start_line": start, "end_line": end})
+            return result
+        
+        if size <= VIEW_MAX_CHARS:
+            result["content"] = get_lines(1, total)
+            return result
+        half = VIEW_MAX_CHARS // 2
+        if total <= 2 * VIEW_SUMMARY_LINES:
+            # Few but very long lines (minified or generated code)
+            head = get_lines(1, total, half)
+            tail = get_lines(1, total, half, from_end=True)
+            omitted = size - len(head.encode('utf-8')) - len(tail.encode('utf-8'))
+            content = f"{head}\n... [about {max(omitted, 0)} bytes omitted] ...\n{tail}"
+            note = f"File has {total} very long lines ({size} bytes); showing first and last {half} chars"
+        else:
+            head_end = VIEW_SUMMARY_LINES
+            tail_start = total - VIEW_SUMMARY_LINES + 1
+            head = get_lines(1, head_end, half)
+            tail = get_lines(tail_start, total, half, from_end=True)
+            content = f"{head}... [lines {head_end + 1}-{tail_start - 1} omitted; view them with start_line/end_line] ...\n{tail}"
+            note = f"File has {total} lines ({size} bytes); showing first and last {VIEW_SUMMARY_LINES} lines"
+        result.update({"content": content, "truncated": True, "note": note})
+        return result
+    
     def str_replace(self, path: Union[str, Path], old_str: str, new_str: str) -> Dict[str, Any]:
         """Replace string in file with new string"""
-        path = Path(path)
+        path = self.workspace.resolve(path)
+        shown = self.workspace.display(path)
         
         try:
             if not path.exists() or not path.is_file():
                 return {
                     "success": False,
-                    "error": f"File does not exist: {path}"
+                    "error": f"File does not exist: {shown}"
                 }
             
             # Read current content
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            content = self.workspace.read_text(path)
             
             # Check if old_str exists
             if old_str not in content:
                 return {
                     "success": False,
-                    "error": f"String not found in {path}: '{old_str[:50]}...'"
+                    "error": f"String not found in {shown}: '{old_str[:50]}...'"
                 }
             
             # Replace and write back
             new_content = content.replace(old_str, new_str)
             
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
+            self.workspace.write_text(path, new_content)
             
             return {
                 "success": True,
-                "path": str(path),
+                "path": shown,
                 "replacements": content.count(old_str),
                 "old_length": len(content),
                 "new_length": len(new_content)
@@ -120,23 +672,23 @@ class FetchAIAgent:
         except Exception as e:
             return {
                 "success": False,
-                "error": f"Failed to replace string in {path}: {str(e)}"
+                "error": f"Failed to replace string in {shown}: {self.workspace.scrub(str(e))}"
             }
     
     def insert(self, path: Union[str, Path], insert_line: int, new_str: str) -> Dict[str, Any]:
         """Insert new string at specified line number (1-indexed)"""
-        path = Path(path)
+        path = self.workspace.resolve(path)
+        shown = self.workspace.display(path)
         
         try:
             if not path.exists() or not path.is_file():
                 return {
                     "success": False,
-                    "error": f"File does not exist: {path}"
+                    "error": f"File does not exist: {shown}"
                 }
             
             # Read current content
-            with open(path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
+            lines = self.workspace.read_text(path).splitlines(keepends=True)
             
             # Validate line number
             if insert_line < 1 or insert_line > len(lines) + 1:
@@ -149,12 +701,11 @@ class FetchAIAgent:
             lines.insert(insert_line - 1, new_str + '\n' if not new_str.endswith('\n') else new_str)
             
             # Write back
-            with open(path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
+            self.workspace.write_text(path, ''.join(lines))
             
             return {
                 "success": True,
-                "path": str(path),
+                "path": shown,
                 "inserted_at_line": insert_line,
                 "total_lines": len(lines)
             }
@@ -162,12 +713,13 @@ class FetchAIAgent:
         except Exception as e:
             return {
                 "success": False,
-                "error": f"Failed to insert into {path}: {str(e)}"
+                "error": f"Failed to insert into {shown}: {self.workspace.scrub(str(e))}"
             }
     
     def create(self, path: Union[str, Path], file_text: str) -> Dict[str, Any]:
         """Create new file with specified content"""
-        path = Path(path)
+        path = self.workspace.resolve(path)
+        shown = self.workspace.display(path)
         
         try:
             # Create parent directories if they don't exist
@@ -177,16 +729,15 @@ class FetchAIAgent:
             if path.exists():
                 return {
                     "success": False,
-                    "error": f"File already exists: {path}"
+                    "error": f"File already exists: {shown}"
                 }
             
             # Create file
-            with open(path, 'w', encoding='utf-8') as f:
-                f.write(file_text)
+            self.workspace.write_text(path, file_text)
             
             return {
                 "success": True,
-                "path": str(path),
+                "path": shown,
                 "size": len(file_text),
                 "lines": len(file_text.splitlines())
             }
@@ -194,275 +745,306 @@ class FetchAIAgent:
         except Exception as e:
             return {
                 "success": False,
-                "error": f"Failed to create {path}: {str(e)}"
+                "error": f"Failed to create {shown}: {self.workspace.scrub(str(e))}"
             }
     
+    def patch(self, diff: str) -> Dict[str, Any]:
+        """Apply a unified diff to workspace files, all hunks or nothing"""
+        result = apply_patch(diff, self.workspace.root, read_bytes=self.workspace.read_bytes)
+        if result["success"]:
+            for entry in result["files"]:
+                self.workspace.forget(entry["path"])
+        for entry in result.get("files", []) + result.get("failures", []):
+            entry["path"] = self.workspace.display(entry["path"])
+        for entry in result.get("failures", []):
+            entry["reason"] = self.workspace.scrub(entry["reason"])
+        if "error" in result:
+            result["error"] = self.workspace.scrub(result["error"])
+        return result
+    
+    def search(self, query: str, regex: bool = False, path: Optional[Union[str, Path]] = None) -> Dict[str, Any]:
+        """Search the workspace index for symbols, file names and content"""
+        if self.index is None:
+            return {"success": False, "error": "No search index for this workspace"}
+        return self.index.search(query, regex=bool(regex), path=str(path) if path else None)
+    
+    def execute_action(self, action: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a single tool action and return its result"""
+        if action == "view":
+            return self.view(parameters.get("path", "."), parameters.get("start_line"), parameters.get("end_line"))
+        if action == "patch":
+            return self.patch(parameters.get("diff", ""))
+        if action == "search":
+            return self.search(parameters.get("query", ""), parameters.get("regex", False), parameters.get("path"))
+        if action == "create":
+            return self.create(parameters.get("path"), parameters.get("content", ""))  # type: ignore
+        if action == "str_replace":
+            return self.str_replace(
+                parameters.get("path"),  # type: ignore
+                parameters.get("old_str"),  # type: ignore
+                parameters.get("new_str")  # type: ignore
+            )
+        if action == "insert":
+            return self.insert(
+                parameters.get("path"),  # type: ignore
+                parameters.get("line_num", 1),
+                parameters.get("text", "")
+            )
+        return {"success": False, "error": f"Unknown action: {action}"}
+    
+    def execute_actions(self, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run a turn's actions: consecutive read-only ones concurrently, writes in order"""
+        results: List[Dict[str, Any]] = []
+        batch: List[Dict[str, Any]] = []
+        
+        def flush():
+            if len(batch) == 1:
+                results.append({**batch[0], "result": self.execute_action(batch[0]["action"], batch[0]["parameters"])})
+            elif batch:
+                with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_READS, len(batch))) as pool:
+                    outputs = list(pool.map(lambda a: self.execute_action(a["action"], a["parameters"]), batch))
+                results.extend({**a, "result": r} for a, r in zip(batch, outputs))
+            batch.clear()
+        
+        for step in actions:
+            if step["action"] in READ_ONLY_ACTIONS:
+                batch.append(step)
+                continue
+            flush()
+            result = self.execute_action(step["action"], step["parameters"])
+            if self.index is not None and step["action"] in WRITE_ACTIONS and result.get("success"):
+                changed = [f["path"] for f in result["files"]] if step["action"] == "patch" else [step["parameters"].get("path")]
+                for path in changed:
+                    # Tool paths are workspace-relative
+                    self.index.update_file(self.workspace.resolve(path))
+            results.append({**step, "result": result})
+        flush()
+        return results
+    
+    def build_initial_messages(self, task_description: str, workspace_path: Union[str, Path]) -> List[Dict[str, str]]:
+        """Build the fixed opening of an agent conversation: system prompt, task and workspace"""
+        if self.index is None or self.index.relative(workspace_path) is None:
+            self.index = RepoIndex.build(workspace_path)
+        if self.workspace.relative(workspace_path) != "":
+            self.workspace = Workspace(workspace_path)
+        # Checkout paths differ per job; leaving them out keeps prompts (and LLMCache keys) stable
+        user_prompt = f"""Task: {task_description}
+
+Current workspace: .
+Workspace files (paths relative to the workspace):
+{self.workspace.render_tree()}
+
+What should I do first to complete this task? Respond with JSON only."""
+        return [
+            {"role": "system", "content": AGENT_SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+    
     def agent_loop(self, task_description: str, workspace_path: Union[str, Path] = ".", max_iterations: int = 50) -> Dict[str, Any]:
         """Run an agent loop where AI can make multiple tool calls until task completion"""
-        workspace_path = Path(workspace_path)
-        actions_taken = []
-        conversation_history = []
+        from engine import AgentEngine, format_metrics, format_summary
         
         print(f"🤖 Starting agent loop for task: {task_description}")
         
-        for iteration in range(max_iterations):
-            print(f"🔄 Agent iteration {iteration + 1}/{max_iterations}")
-            
-            # Get current workspace state
-            workspace_info = self.view(workspace_path)
-            
-            # Build conversation context
-            context = {
-                "task": task_description,
-                "workspace": str(workspace_path),
-                "workspace_contents": workspace_info,
-                "actions_taken": actions_taken,
-                "iteration": iteration + 1
+        result: Dict[str, Any] = {}
+        for event in AgentEngine(self, max_iterations=max_iterations).run(task_description, workspace_path):
+            if event["type"] == "iteration":
+                print(f"🔄 Agent iteration {event['iteration']}/{max_iterations}")
+            elif event["type"] == "decision":
+                print(f"🧠 Agent reasoning: {event['reasoning']}")
+                print(f"⚡ Agent action: {', '.join(event['actions'])}")
+            elif event["type"] == "notice":
+                print(event["message"])
+            elif event["type"] == "action":
+                step = event["step"]
+                if step["action"] in WRITE_ACTIONS and step["result"].get("success"):
+                    changed = step['parameters'].get('path') or ', '.join(f['path'] for f in step['result'].get('files', []))
+                    print(f"✅ {step['action']}: {changed}")
+                elif step["action"] not in READ_ONLY_ACTIONS | WRITE_ACTIONS:
+                    print(f"❓ Unknown action: {step['action']}")
+            elif event["type"] == "metrics":
+                print(f"⏱️ Iteration {event['iteration']}: {format_metrics(event['metrics'])}")
+            elif event["type"] == "finished":
+                result = event["result"]
+                print(f"📊 Agent summary: {format_summary(result['metrics'])}")
+        return result
+    
+    def _fix_file(self, file_path: Union[str, Path], fix_description: str) -> Dict[str, Any]:
+        """Run one agent loop fixing a single file"""
+        # Caller paths are relative to the process, not to a workspace
+        file_path = Path(file_path).resolve()
+        # Read the file first
+        file_info = self.view(file_path)
+        
+        if not file_info["success"]:
+            return {
+                "file": str(file_path),
+                "success": False,
+                "error": file_info["error"]
             }
-            
-            # System prompt for the agent
-            system_prompt = """You are an autonomous AI agent with file management capabilities. You can:
-
-1. view(path) - Read files or list directories  
-2. str_replace(path, old_str, new_str) - Replace text in files
-3. insert(path, line_num, text) - Insert text at specific lines
-4. create(path, content) - Create new files
-
-IMPORTANT: You must respond with a JSON object containing:
-- "action": one of ["view", "str_replace", "insert", "create", "complete", "abort"]
-- "parameters": object with the parameters for the action
-- "reasoning": string explaining why you're taking this action
-- "status": "continue" or "complete" or "abort"
-
-If action is "complete", you're done. If "abort", you're stopping due to an error.
-For file operations, check if files exist first using "view" before modifying them."""
-
-            # Build user prompt with context
-            user_prompt = f"""Task: {task_description}
-
-Current workspace: {workspace_path}
-Workspace contents: {json.dumps(workspace_info, indent=2)}
-
-Actions taken so far: {json.dumps(actions_taken, indent=2)}
+        
+        # Let AI analyze and suggest fixes
+        fix_prompt = f"""Analyze this file and apply the requested fix: {fix_description}
 
-What should I do next to complete this task? Respond with JSON only."""
+File: {file_path.name}
+Content:
+{file_info['content']}
 
-            try:
-                # Make API call
-                response = requests.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=self.headers,
-                    json={
-                        "model": self.model,
-                        "max_tokens": 2000,
-                        "messages": [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user", 
-                                "content": user_prompt
-                            }
-                        ]
-                    }
-                )
-                
-                if response.status_code != 200:
-                    return {
-                        "success": False,
-                        "error": f"API request failed: {response.status_code}",
-                        "actions_taken": actions_taken
-                    }
-                
-                ai_response = response.json()
-                content = ai_response.get("choices", [{}])[0].get("message", {}).get("content", "")
-                
-                # Parse AI response
-                try:
-                    decision = json.loads(content)
-                except json.JSONDecodeError:
-                    # Try to extract JSON from response
-                    import re
-                    json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                    if json_match:
-                        decision = json.loads(json_match.group())
-                    else:
-                        return {
-                            "success": False,
-                            "error": "Could not parse AI response as JSON",
-                            "actions_taken": actions_taken,
-                            "raw_response": content
-                        }
-                
-                action = decision.get("action", "abort")
-                parameters = decision.get("parameters", {})
-                reasoning = decision.get("reasoning", "No reasoning provided")
-                status = decision.get("status", "abort")
-                
-                print(f"🧠 Agent reasoning: {reasoning}")
-                print(f"⚡ Agent action: {action}")
-                
-                # Execute the action
-                if action == "complete":
-                    return {
-                        "success": True,
-                        "message": "Task completed successfully",
-                        "actions_taken": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                elif action == "abort":
-                    return {
-                        "success": False,
-                        "message": "Agent decided to abort",
-                        "reason": reasoning,
-                        "actions_taken": actions_taken,
-                        "iterations": iteration + 1
-                    }
-                elif action == "view":
-                    result = self.view(parameters.get("path", "."))
-                    actions_taken.append({
-                        "type": "view",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                elif action == "create":
-                    result = self.create(parameters.get("path"), parameters.get("content", ""))
-                    actions_taken.append({
-                        "type": "create",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result["success"]:
-                        print(f"✅ Created file: {parameters.get('path')}")
-                elif action == "str_replace":
-                    result = self.str_replace(
-                        parameters.get("path"), 
-                        parameters.get("old_str"), 
-                        parameters.get("new_str")
-                    )
-                    actions_taken.append({
-                        "type": "str_replace",
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result["success"]:
-                        print(f"✅ Updated file: {parameters.get('path')}")
-                elif action == "insert":
-                    result = self.insert(
-                        parameters.get("path"),
-                        parameters.get("line_num", 1),
-                        parameters.get("text", "")
-                    )
-                    actions_taken.append({
-                        "type": "insert", 
-                        "parameters": parameters,
-                        "result": result,
-                        "reasoning": reasoning
-                    })
-                    if result["success"]:
-                        print(f"✅ Inserted into file: {parameters.get('path')}")
-                else:
-                    print(f"❓ Unknown action: {action}")
-                    
-            except Exception as e:
-                return {
-                    "success": False,
-                    "error": f"Error in iteration {iteration + 1}: {str(e)}",
-                    "actions_taken": actions_taken
-                }
+Please provide specific file operations to fix the issue."""
         
-        # If we've reached max iterations
+        ai_result = self.agent_loop(fix_prompt, workspace_path=Path(file_path).parent)
         return {
-            "success": False,
-            "error": f"Agent exceeded maximum iterations ({max_iterations})",
-            "actions_taken": actions_taken
+            "file": str(file_path),
+            "success": ai_result["success"],
+            "result": ai_result
         }
     
-    def apply_fixes(self, files_to_fix: List[str], fix_description: str) -> Dict[str, Any]:
-        """Apply automated fixes to specified files"""
-        results = []
+    def _fix_in_overlay(self, root: Path, files: List[str], rel: str, fix_description: str) -> Dict[str, Any]:
+        """Fix one file in a private overlay of root; returns the outcome and the edited files"""
+        overlay = create_overlay(root, files)
+        try:
+            agent = FetchAIAgent(api_key=self.api_key, model=self.model, priority=self.priority,
+                                 fast_model=self.fast_model)
+            outcome = agent._fix_file(overlay / rel, fix_description)
+            # Edited files as relative path -> new content (None if deleted)
+            changes: Dict[str, Optional[bytes]] = {}
+            for action in (outcome.get("result") or {}).get("actions_taken", []):
+                if action["type"] not in WRITE_ACTIONS or not action["result"].get("success"):
+                    continue
+                paths = [f["path"] for f in action["result"].get("files", [])] or [action["parameters"].get("path")]
+                for path in paths:
+                    changed = agent.workspace.resolve(path).resolve()
+                    try:
+                        name = changed.relative_to(overlay.resolve()).as_posix()
+                    except ValueError:
+                        continue
+                    changes[name] = changed.read_bytes() if changed.is_file() else None
+            # Report paths as they are in the workspace, not the overlay
+            outcome["file"] = str(root / rel)
+            outcome["changes"] = changes
+            return outcome
+        finally:
+            shutil.rmtree(overlay, ignore_errors=True)
+    
+    def apply_fixes(self, files_to_fix: List[str], fix_description: str,
+                    workspace_path: Optional[Union[str, Path]] = None,
+                    max_workers: int = AGENT_FIX_WORKERS) -> Dict[str, Any]:
+        """Apply automated fixes to specified files
         
+        Each file gets its own agent loop. With several files, up to
+        max_workers loops run at once, each in a copy-on-write overlay of the
+        workspace (default: the files' common directory) so they never see or
+        clobber each other's edits. Their edits are then applied: a file
+        changed by one loop is copied over, one changed by several is
+        three-way merged, and a loop whose edits conflict with earlier ones
+        is discarded and re-run on the merged workspace, one at a time.
+        """
+        if len(files_to_fix) < 2 or max_workers < 2:
+            results = [self._fix_file(file_path, fix_description) for file_path in files_to_fix]
+            return {
+                "success": all(r["success"] for r in results),
+                "results": results,
+                "total_files": len(files_to_fix)
+            }
+        
+        root = Path(workspace_path or os.path.commonpath([str(Path(f).resolve().parent) for f in files_to_fix])).resolve()
+        files = list_repo_files(root)
+        jobs = []
         for file_path in files_to_fix:
-            # Read the file first
-            file_info = self.view(file_path)
-            
-            if not file_info["success"]:
-                results.append({
-                    "file": file_path,
-                    "success": False,
-                    "error": file_info["error"]
-                })
+            try:
+                jobs.append((file_path, Path(file_path).resolve().relative_to(root).as_posix()))
+            except ValueError:
+                jobs.append((file_path, None))
+        
+        def run(job):
+            file_path, rel = job
+            if rel is None:
+                return {"file": file_path, "success": False, "error": f"File is outside the workspace {root}"}
+            return self._fix_in_overlay(root, files, rel, fix_description)
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            outcomes = list(pool.map(run, jobs))
+        
+        # Merge in file order; original holds the content every loop started from
+        original: Dict[str, Optional[bytes]] = {}
+        merged: Dict[str, Optional[bytes]] = {}
+        conflicts: List[Dict[str, Any]] = []
+        for (file_path, rel), outcome in zip(jobs, outcomes):
+            changes = outcome.pop("changes", {})
+            staged: Dict[str, Optional[bytes]] = {}
+            for name, data in changes.items():
+                if name not in original:
+                    path = root / name
+                    original[name] = path.read_bytes() if path.is_file() else None
+                current = merged.get(name, original[name])
+                if current == original[name] or current == data:
+                    staged[name] = data
+                elif None in (current, data, original[name]):
+                    break
+                else:
+                    combined = merge_versions(original[name], current, data)
+                    if combined is None:
+                        break
+                    staged[name] = combined
+            else:
+                merged.update(staged)
+                outcome["merge"] = "merged" if any(merged[n] != changes[n] for n in changes) else "applied"
+                outcome["files_changed"] = sorted(changes)
                 continue
-            
-            # Let AI analyze and suggest fixes
-            fix_prompt = f"""Analyze this file and apply the requested fix: {fix_description}
-
-File: {file_path}
-Content:
-{file_info['content']}
-
-Please provide specific file operations to fix the issue."""
-            
-            ai_result = self.agent_loop(fix_prompt, workspace_path=Path(file_path).parent)
-            results.append({
-                "file": file_path,
-                "success": ai_result["success"],
-                "result": ai_result
-            })
+            conflicts.append({"file": file_path, "rel": rel, "conflicting_file": name})
+        
+        for name, data in merged.items():
+            path = root / name
+            if data is None:
+                path.unlink(missing_ok=True)
+            else:
+                write_atomic(path, data)
+            self.workspace.forget(path)
+            if self.index is not None:
+                self.index.update_file(path)
         
+        # Conflicting loops run again, serially, on top of everything merged
+        results = {file_path: outcome for (file_path, _), outcome in zip(jobs, outcomes)}
+        for conflict in conflicts:
+            outcome = self._fix_file(root / conflict["rel"], fix_description)
+            outcome["merge"] = "serialized"
+            outcome["conflicting_file"] = conflict["conflicting_file"]
+            results[conflict["file"]] = outcome
+        
+        ordered = [results[file_path] for file_path, _ in jobs]
         return {
-            "success": all(r["success"] for r in results),
-            "results": results,
-            "total_files": len(files_to_fix)
+            "success": all(r["success"] for r in ordered),
+            "results": ordered,
+            "total_files": len(files_to_fix),
+            "conflicts": [c["file"] for c in conflicts]
         }
     
-    def generate_pr_metadata(self, actions_taken: List[Dict[str, Any]], repo_context: str = "") -> Dict[str, Any]:
-        """Generate intelligent PR title and description based on actions taken"""
+    def generate_pr_metadata(self, actions_taken: List[Dict[str, Any]], repo_context: str = "",
+                             task: str = "", prose: bool = False,
+                             root: Optional[Union[str, Path]] = None) -> Dict[str, Any]:
+        """Generate a PR title and description based on actions taken
         
-        # Build detailed summary of actions
-        actions_summary = []
-        files_created = []
-        files_modified = []
-        detailed_actions = []
+        Small change sets (up to AGENT_PR_TEMPLATE_MAX_FILES files) get a
+        deterministic title and body from template_pr_metadata, without an
+        LLM call; larger ones, or prose=True, ask the fast model. Paths are
+        shown relative to root (default: the agent's workspace). The result's
+        "generator" is "template" or "llm".
+        """
+        changes = summarize_actions(actions_taken, root or self.workspace.root)
+        template = template_pr_metadata(changes, task)
+        if not prose and len(changes["files_created"]) + len(changes["files_modified"]) + len(changes["files_deleted"]) <= AGENT_PR_TEMPLATE_MAX_FILES:
+            return {"success": True, "generator": "template", **template}
         
-        for action in actions_taken:
-            action_type = action.get("type", "unknown")
-            parameters = action.get("parameters", {})
-            reasoning = action.get("reasoning", "")
-            
-            if action_type == "create":
-                file_path = parameters.get("path", "unknown")
-                content = parameters.get("content", "")
-                files_created.append(file_path)
-                actions_summary.append(f"Created {file_path}")
-                detailed_actions.append(f"Created file '{file_path}' with content: '{content[:50]}{'...' if len(content) > 50 else ''}'")
-            elif action_type == "str_replace":
-                file_path = parameters.get("path", "unknown")
-                old_str = parameters.get("old_str", "")
-                new_str = parameters.get("new_str", "")
-                files_modified.append(file_path)
-                actions_summary.append(f"Updated content in {file_path}")
-                detailed_actions.append(f"Replaced '{old_str[:30]}...' with '{new_str[:30]}...' in {file_path}")
-            elif action_type == "insert":
-                file_path = parameters.get("path", "unknown")
-                text = parameters.get("text", "")
-                line_num = parameters.get("line_num", 0)
-                files_modified.append(file_path)
-                actions_summary.append(f"Added lines to {file_path}")
-                detailed_actions.append(f"Inserted '{text[:30]}...' at line {line_num} in {file_path}")
-            elif action_type == "view":
-                # Skip view actions in PR description as they're just for analysis
-                continue
+        files_created = changes["files_created"]
+        files_modified = changes["files_modified"]
+        files_deleted = changes["files_deleted"]
+        detailed_actions = changes["detailed_actions"]
         
         # Create prompt for AI to generate PR metadata
         system_prompt = """You are an AI assistant that generates professional pull request titles and descriptions.
 Based on the specific file operations performed, generate:
 1. A concise, specific title (under 60 characters) describing exactly what was changed
-2. A clear description explaining what files were created/modified and their actual content/purpose
+2. A clear description explaining what files were created/modified/deleted and their actual content/purpose
 
 Be SPECIFIC about what was actually done, not generic. Use the actual file names and content mentioned.
 The title should be in imperative mood (e.g., "Add balls.txt test file", "Update configuration file", "Create Python module").
@@ -477,6 +1059,7 @@ Specific actions performed:
 
 Files created: {files_created}
 Files modified: {files_modified}
+Files deleted: {files_deleted}
 
 IMPORTANT: Be specific about what was actually done. If a test file was created, mention it's a test file. If content is unusual (like "fart"), acknowledge it's for testing. Don't be generic.
 
@@ -488,72 +1071,70 @@ Respond with JSON: {{"title": "specific title here", "body": "detailed descripti
                 return {
                     "success": False,
                     "error": "OPENAI_API_KEY not set or empty",
-                    "title": "AI-generated changes",
-                    "body": f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}"
+                    "generator": "llm",
+                    **template
                 }
             
-            # Make API call to generate PR metadata
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json={
-                    "model": self.model,
-                    "max_tokens": 1000,
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": user_prompt
-                        }
-                    ]
-                },
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                error_detail = ""
-                try:
-                    error_response = response.json()
-                    error_detail = f" - {error_response.get('error', {}).get('message', 'Unknown error')}"
-                except:
-                    error_detail = f" - {response.text[:200]}"
-                
+            # Summarizing the actions is an easy task for the fast model
+            model = self.fast_model or self.model
+            started = time.monotonic()
+            # chat() serves and records the response cache (LLM_CACHE_MODE)
+            try:
+                ai_response = self.client.chat(
+                    {
+                        "model": model,
+                        "max_tokens": 1000,
+                        "messages": [
+                            {
+                                "role": "system",
+                                "content": system_prompt
+                            },
+                            {
+                                "role": "user",
+                                "content": user_prompt
+                            }
+                        ]
+                    },
+                    timeout=30,
+                    priority=self.priority
+                )
+            except LLMError as e:
                 return {
                     "success": False,
-                    "error": f"API request failed: {response.status_code}{error_detail}",
-                    "title": "AI-generated changes",
-                    "body": f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}"
+                    "error": str(e),
+                    "generator": "llm",
+                    **template
                 }
             
-            ai_response = response.json()
             content = ai_response.get("choices", [{}])[0].get("message", {}).get("content", "")
+            usage = ai_response.get("usage") or {}
+            get_model_stats().record(model, time.monotonic() - started,
+                                     usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
             
             if not content:
                 return {
                     "success": False,
                     "error": "Empty response from API",
-                    "title": "AI-generated changes",
-                    "body": f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}",
+                    "generator": "llm",
+                    **template,
                     "raw_response": str(ai_response)
                 }
             
             # Try to parse JSON response
             try:
                 pr_data = json.loads(content)
-                title = pr_data.get("title", "AI-generated changes")
-                body = pr_data.get("body", "Changes made by Fetch.ai agent")
+                title = pr_data.get("title", template["title"])
+                body = pr_data.get("body", template["body"])
                 
                 # Validate that title and body are not empty
                 if not title.strip():
-                    title = "AI-generated changes"
+                    title = template["title"]
                 if not body.strip():
-                    body = f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}"
+                    body = template["body"]
                 
                 return {
                     "success": True,
+                    "generator": "llm",
                     "title": title,
                     "body": body,
                     "ai_response": content
@@ -567,8 +1148,9 @@ Respond with JSON: {{"title": "specific title here", "body": "detailed descripti
                         pr_data = json.loads(json_match.group())
                         return {
                             "success": True,
-                            "title": pr_data.get("title", "AI-generated changes"),
-                            "body": pr_data.get("body", f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}"),
+                            "generator": "llm",
+                            "title": pr_data.get("title", template["title"]),
+                            "body": pr_data.get("body", template["body"]),
                             "ai_response": content
                         }
                     except:
@@ -578,8 +1160,8 @@ Respond with JSON: {{"title": "specific title here", "body": "detailed descripti
                 return {
                     "success": False,
                     "error": f"JSON parsing failed: {str(e)}",
-                    "title": "AI-generated changes",
-                    "body": f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}",
+                    "generator": "llm",
+                    **template,
                     "ai_response": content
                 }
             
@@ -587,8 +1169,8 @@ Respond with JSON: {{"title": "specific title here", "body": "detailed descripti
             return {
                 "success": False,
                 "error": f"Failed to generate PR metadata: {str(e)}",
-                "title": "AI-generated changes",
-                "body": f"Changes made by Fetch.ai agent:\n\n{chr(10).join(actions_summary)}"
+                "generator": "llm",
+                **template
             }
 
 
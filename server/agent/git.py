@@ -3,39 +3,259 @@
 
 import os
 import subprocess
+from contextlib import contextmanager
 from pathlib import Path
 import dotenv
 import requests
 import re
 import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no cross-process mirror locking on Windows
+    fcntl = None
 
 dotenv.load_dotenv()
 
 GITHUB_TOKEN = os.getenv('GITHUB_API_KEY')
 REPOS_DIR = Path('repos')
+# Persistent bare mirrors, one per remote, that each job checks out a fresh
+# worktree from; 0 clones every job from the remote instead
+GIT_USE_MIRRORS = os.getenv('GIT_USE_MIRRORS', '1') == '1'
+MIRRORS_DIR = REPOS_DIR / '.mirrors'
+
+# auto picks full or shallow by repository size; full, shallow (--depth 1) and
+# partial (--filter=blob:none) force a strategy
+GIT_CLONE_MODE = os.getenv('GIT_CLONE_MODE', 'auto')
+# Under auto, repositories up to this size get a full clone, larger ones a shallow one
+GIT_FULL_CLONE_MAX_KB = int(os.getenv('GIT_FULL_CLONE_MAX_KB', str(20 * 1024)))
+CLONE_MODES = ('auto', 'full', 'shallow', 'partial')
+
+def repo_size_kb(repo_url):
+    """Size of a repository in KB, from the GitHub API or the local object store; None if unknown"""
+    match = re.match(r'https://github\.com/([^/]+)/([^/]+?)(?:\.git)?/?$', repo_url)
+    if match:
+        headers = {'Accept': 'application/vnd.github.v3+json'}
+        if GITHUB_TOKEN:
+            headers['Authorization'] = f'token {GITHUB_TOKEN}'
+        try:
+            response = requests.get(f'https://api.github.com/repos/{match.group(1)}/{match.group(2)}', headers=headers, timeout=5)
+        except requests.RequestException:
+            return None
+        return response.json().get('size') if response.status_code == 200 else None
+
+    local = Path(repo_url[len('file://'):] if repo_url.startswith('file://') else repo_url)
+    objects = local / 'objects' if (local / 'objects').is_dir() else local / '.git' / 'objects'
+    if not objects.is_dir():
+        return None
+    total = 0
+    for dirpath, _, filenames in os.walk(objects):
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+    return total // 1024
+
+def clone_options(mode, size_kb=None, depth=None, filter=None, single_branch=None, sparse=None):
+    """Resolve a clone mode and overrides into (mode, git clone arguments)"""
+    if mode not in CLONE_MODES:
+        raise ValueError(f"Unknown clone mode {mode!r}; expected one of {', '.join(CLONE_MODES)}")
+    if mode == 'auto':
+        mode = 'full' if size_kb is not None and size_kb <= GIT_FULL_CLONE_MAX_KB else 'shallow'
+    if mode == 'shallow':
+        depth = depth or 1
+    elif mode == 'partial':
+        filter = filter or 'blob:none'
+    if single_branch is None:
+        single_branch = mode != 'full'
+    # Sparse checkouts only make sense if the skipped blobs are never fetched
+    if sparse and not filter:
+        filter = 'blob:none'
+
+    args = []
+    if depth:
+        args.append(f'--depth={depth}')
+    if filter:
+        args.append(f'--filter={filter}')
+    args.append('--single-branch' if single_branch else '--no-single-branch')
+    if sparse:
+        args.append('--sparse')
+    return mode, args
+
+def remote_url(repo_url):
+    """URL git should fetch repo_url from: with the token for https, file:// for local paths"""
+    if repo_url.startswith('https://'):
+        return repo_url.replace('https://', f'https://{GITHUB_TOKEN}@') if GITHUB_TOKEN else repo_url
+    if '://' not in repo_url and not re.match(r'^[\w.-]+@[\w.-]+:', repo_url):
+        # A plain local path; git ignores --depth and --filter unless it is a URL
+        return Path(repo_url).resolve().as_uri()
+    return repo_url
+
+def mirror_path(repo_url):
+    """Bare mirror directory for repo_url under MIRRORS_DIR"""
+    name = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
+    digest = hashlib.sha1(repo_url.rstrip('/').encode('utf-8')).hexdigest()[:10]
+    return (MIRRORS_DIR / f'{name}-{digest}.git').resolve()
+
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
+@contextmanager
+def mirror_lock(path):
+    """Serialize creating and fetching one mirror across threads and processes"""
+    with _mirror_locks_lock:
+        lock = _mirror_locks.setdefault(str(path), threading.Lock())
+    with lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f'{path}.lock', 'w') as handle:
+            if fcntl:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            yield
+
+def update_mirror(repo_url, filter=None):
+    """Create the bare mirror of repo_url, or fetch what changed since the last job
+
+    Remote branches are kept as refs/remotes/origin/*, so the branches jobs
+    create locally never collide with fetched ones. filter (e.g. blob:none)
+    only applies when the mirror is created. Returns (path, created), or
+    None if git failed.
+    """
+    path = mirror_path(repo_url)
+    with mirror_lock(path):
+        created = not path.exists()
+        git = ['git', '-C', str(path)]
+        if created:
+            steps = [
+                ['git', 'init', '-q', '--bare', str(path)],
+                git + ['remote', 'add', 'origin', remote_url(repo_url)],
+                git + ['config', 'remote.origin.fetch', '+refs/heads/*:refs/remotes/origin/*'],
+                git + ['fetch', '-q', 'origin'] + ([f'--filter={filter}'] if filter else []),
+                git + ['remote', 'set-head', 'origin', '--auto'],
+            ]
+        else:
+            steps = [
+                # The token may have changed since the mirror was created
+                git + ['remote', 'set-url', 'origin', remote_url(repo_url)],
+                git + ['fetch', '-q', '--prune', 'origin'],
+                # Forget worktrees whose directories were deleted without git
+                git + ['worktree', 'prune'],
+            ]
+        for cmd in steps:
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"❌ Mirror update failed: {result.stderr}")
+                if created:
+                    shutil.rmtree(path, ignore_errors=True)
+                return None
+    return path, created
+
+def add_worktree(source, destination, start='HEAD'):
+    """Check out start from the repository at source into a new detached worktree"""
+    result = subprocess.run(['git', '-C', str(source), 'worktree', 'add', '-q', '--detach',
+                             str(Path(destination).resolve()), start], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ Worktree checkout failed: {result.stderr}")
+        return False
+    return True
+
+def has_changes(path):
+    """True if the checkout at path has uncommitted changes, including untracked files"""
+    result = subprocess.run(['git', 'status', '--porcelain'], cwd=str(path), capture_output=True, text=True)
+    return result.returncode == 0 and bool(result.stdout.strip())
 
-def clone_repo(repo_url, destination=None, branch=None):
-    """Clone repository using git, optionally from a specific branch"""
-    if not destination:
-        repo_name = repo_url.split('/')[-1].replace('.git', '')
-        destination = REPOS_DIR / repo_name
+def is_worktree(path):
+    """True for a linked worktree, whose .git is a file pointing at the shared repository"""
+    return (Path(path) / '.git').is_file()
+
+def remove_worktree(path):
+    """Remove a linked worktree and the local branch it had checked out"""
+    path = Path(path).resolve()
+    result = subprocess.run(['git', 'rev-parse', '--git-common-dir', '--abbrev-ref', 'HEAD'],
+                            cwd=str(path), capture_output=True, text=True)
+    if result.returncode != 0:
+        return False
+    # One value per line; the mirror path may contain spaces
+    common_dir, branch = result.stdout.splitlines()[:2]
+    common_dir = (path / common_dir).resolve()
+    result = subprocess.run(['git', '-C', str(common_dir), 'worktree', 'remove', '--force', str(path)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"⚠️ Worktree removal failed: {result.stderr}")
+        return False
+    if branch != 'HEAD':
+        subprocess.run(['git', '-C', str(common_dir), 'branch', '-D', branch], capture_output=True, text=True)
+    return True
+
+def clone_repo(repo_url, destination=None, branch=None, mode=None, depth=None, filter=None,
+               single_branch=None, sparse=None, info=None):
+    """Clone repository using git, optionally from a specific branch
+
+    mode is one of CLONE_MODES (default GIT_CLONE_MODE); depth, filter and
+    single_branch override what it implies, and sparse is a list of
+    directories to check out, leaving the rest of the tree out of the
+    working copy. Local paths are cloned through file:// so the shallow and
+    partial options apply to them too. If info is a dict it receives the
+    chosen mode, arguments, repository size and clone time.
+
+    Without a destination and with GIT_USE_MIRRORS, the job instead gets a
+    worktree in a new directory under REPOS_DIR, checked out from the
+    repository's persistent mirror after an incremental fetch. The mirror
+    keeps full history; shallow and partial modes make it blob-less. Remove
+    such checkouts with remove_worktree.
+    """
+    mode = mode or GIT_CLONE_MODE
+    use_mirror = not destination and GIT_USE_MIRRORS and not sparse
+    # A mirror's clone strategy only matters when it is created
+    sized = mode == 'auto' and not (use_mirror and mirror_path(repo_url).exists())
+    size_kb = repo_size_kb(repo_url) if sized else None
+    mode, args = clone_options(mode, size_kb, depth=depth, filter=filter, single_branch=single_branch, sparse=sparse)
+    repo_name = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
+
+    if use_mirror:
+        started = time.monotonic()
+        mirror = update_mirror(repo_url, filter=filter or ('blob:none' if mode != 'full' else None))
+        if not mirror:
+            return None
+        fetch_seconds = round(time.monotonic() - started, 2)
+        REPOS_DIR.mkdir(exist_ok=True)
+        destination = Path(tempfile.mkdtemp(prefix=f'{repo_name}-', dir=REPOS_DIR))
+        if branch:
+            print(f"🌿 Checking out branch: {branch}")
+        if not add_worktree(mirror[0], destination, f'origin/{branch}' if branch else 'origin/HEAD'):
+            shutil.rmtree(destination, ignore_errors=True)
+            return None
+        seconds = round(time.monotonic() - started, 2)
+        if info is not None:
+            info.update({'mode': 'worktree', 'mirror': 'created' if mirror[1] else 'fetched', 'args': [],
+                         'size_kb': size_kb, 'sparse': [], 'fetch_seconds': fetch_seconds, 'seconds': seconds})
+        print(f"✓ Checked out {destination} from mirror {mirror[0]} in {seconds}s")
+        return str(destination)
+
+    destination = Path(destination or REPOS_DIR / repo_name)
 
     if destination.exists():
         print(f"Repository already exists at {destination}")
         return str(destination)
 
-    auth_url = repo_url.replace('https://', f'https://{GITHUB_TOKEN}@')
+    auth_url = remote_url(repo_url)
     
     # Build clone command with optional branch
-    cmd = ['git', 'clone', auth_url, str(destination)]
+    cmd = ['git', 'clone', *args, auth_url, str(destination)]
     if branch:
         cmd.extend(['--branch', branch])
         print(f"🌿 Cloning branch: {branch}")
     
+    started = time.monotonic()
     result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode == 0 and sparse:
+        result = subprocess.run(['git', 'sparse-checkout', 'set', *sparse], cwd=str(destination), capture_output=True, text=True)
+    seconds = round(time.monotonic() - started, 2)
+    if info is not None:
+        info.update({'mode': mode, 'args': args, 'size_kb': size_kb, 'sparse': list(sparse or []), 'seconds': seconds})
 
     if result.returncode == 0:
-        print(f"✓ Cloned to {destination}")
+        print(f"✓ Cloned to {destination} ({mode} clone in {seconds}s)")
         return str(destination)
     else:
         print(f"❌ Clone failed: {result.stderr}")
@@ -47,20 +267,32 @@ def make_pr(path, title, body='', head=None, base='main'):
         print("❌ GITHUB_API_KEY environment variable not set")
         return None
 
+    head_branch = push_branch(path, title, head=head)
+    if not head_branch:
+        return None
+    return open_pr(path, head_branch, title, body=body, base=base)
+
+def push_branch(path, message, head=None):
+    """Commit all changes in the repo at path to a new branch and push it.
+
+    Returns the pushed branch name, or None if there was nothing to push or
+    a git step failed. open_pr then turns the branch into a pull request, so
+    the PR text can still be written while the push runs.
+    """
     path = Path(path)
     if not path.exists():
         print(f"❌ Path {path} does not exist")
         return None
 
-    head_branch = head or f"pr-{int(time.time())}"
+    # Jobs on one mirror share its branches, so the name must be unique per job
+    head_branch = head or f"pr-{int(time.time())}-{os.urandom(3).hex()}"
     
     # Configure git user for this repo (use funny-ai-pipeline account)
     subprocess.run(['git', 'config', 'user.name', 'funny-ai-pipeline'], cwd=str(path), capture_output=True, text=True)
     subprocess.run(['git', 'config', 'user.email', 'funny-ai-pipeline@users.noreply.github.com'], cwd=str(path), capture_output=True, text=True)
     
     # Check if there are any changes to commit
-    result = subprocess.run(['git', 'status', '--porcelain'], cwd=str(path), capture_output=True, text=True)
-    if not result.stdout.strip():
+    if not has_changes(path):
         print("ℹ️ No changes detected, aborting PR creation")
         return None
     
@@ -76,7 +308,7 @@ def make_pr(path, title, body='', head=None, base='main'):
         print(f"❌ Failed to stage changes: {result.stderr}")
         return None
 
-    result = subprocess.run(['git', 'commit', '-m', title], cwd=str(path), capture_output=True, text=True)
+    result = subprocess.run(['git', 'commit', '-m', message], cwd=str(path), capture_output=True, text=True)
     if result.returncode != 0:
         print(f"❌ Failed to commit changes: {result.stderr}")
         return None
@@ -87,6 +319,14 @@ def make_pr(path, title, body='', head=None, base='main'):
         print(f"❌ Failed to push branch {head_branch}: {result.stderr}")
         return None
 
+    return head_branch
+
+def open_pr(path, head_branch, title, body='', base='main'):
+    """Open a pull request for an already pushed branch of the repo at path."""
+    if not GITHUB_TOKEN:
+        print("❌ GITHUB_API_KEY environment variable not set")
+        return None
+
     # Get remote URL
     result = subprocess.run(['git', 'config', '--get', 'remote.origin.url'], cwd=str(path), capture_output=True, text=True)
     remote_url = result.stdout.strip()
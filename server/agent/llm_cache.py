@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""On-disk cache of chat completions, for replaying identical agent jobs"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from patch import write_atomic
+
+# passthrough: no caching; record: serve recorded responses and record new
+# ones; replay: serve recorded responses only, a miss is an error (offline runs)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "passthrough")
+LLM_CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", ".llm_cache"))
+CACHE_MODES = ("passthrough", "record", "replay")
+
+# Request fields that change how a response is delivered, not what it says
+TRANSPORT_FIELDS = ("stream", "stream_options")
+
+
+class LLMCache:
+    """Chat-completion response bodies keyed by a hash of the request
+
+    The key covers the model, the messages and every other request field
+    except the streaming options, so a streamed and a plain request for the
+    same prompt share an entry. Entries are JSON files sharded by the first
+    two hex digits of the key.
+    """
+
+    def __init__(self, mode: str = LLM_CACHE_MODE, directory: Union[str, Path] = LLM_CACHE_DIR):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r}; expected one of {', '.join(CACHE_MODES)}")
+        self.mode = mode
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "passthrough"
+
+    @staticmethod
+    def key(payload: Dict[str, Any]) -> str:
+        request = {k: v for k, v in payload.items() if k not in TRANSPORT_FIELDS}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Recorded response body for this request, or None"""
+        if not self.enabled:
+            return None
+        path = self._path(self.key(payload))
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return entry["body"]
+
+    def put(self, payload: Dict[str, Any], body: Dict[str, Any]):
+        """Record a response body; only record mode writes"""
+        if self.mode != "record":
+            return
+        key = self.key(payload)
+        entry = {"key": key, "model": payload.get("model"), "created": time.time(), "body": body}
+        write_atomic(self._path(key), json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+        with self.lock:
+            self.stored += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {"mode": self.mode, "directory": str(self.directory),
+                    "hits": self.hits, "misses": self.misses, "stored": self.stored}
+
+
+def completion_body(content: str, model: Optional[str] = None, finish_reason: str = "stop") -> Dict[str, Any]:
+    """Minimal chat.completion body for content assembled from a stream"""
+    return {
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                     "finish_reason": finish_reason}],
+    }
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Return the process-wide cache configured by LLM_CACHE_MODE and LLM_CACHE_DIR"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""Shared OpenAI-compatible HTTP client: pooled connections, timeouts and retries with backoff"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import RateLimiter, get_rate_limiter, PRIORITY_INTERACTIVE
+from llm_cache import LLMCache, get_llm_cache, completion_body
+
+try:
+    import httpx
+except ImportError:  # only AsyncLLMClient needs it
+    httpx = None
+
+# Point at any OpenAI-compatible server, e.g. testing/openai_stub.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+
+# Rate limits, conflicts and transient server errors are worth another attempt
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when a chat completion fails after all retries"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def retry_delay(attempt: int, headers: Optional[Any] = None) -> float:
+    """Seconds to wait before retry number attempt (0-based)
+
+    A Retry-After (seconds or HTTP date) or retry-after-ms header from the
+    server wins; otherwise exponential backoff with full jitter.
+    """
+    if headers is not None:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return min(float(retry_after_ms) / 1000, LLM_BACKOFF_MAX)
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), LLM_BACKOFF_MAX)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(max(delay, 0.0), LLM_BACKOFF_MAX)
+                except (TypeError, ValueError):
+                    pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+def error_message(status_code: int, body: str) -> str:
+    return f"API request failed: {status_code} - {body[:200]}"
+
+
+def cache_miss(cache: LLMCache, payload: Dict[str, Any]) -> LLMError:
+    return LLMError(f"No recorded response for this request (LLM_CACHE_MODE={cache.mode}, "
+                    f"key {cache.key(payload)[:12]} in {cache.directory})")
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Prompt plus completion allowance, as charged against the token budget"""
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in payload.get("messages", []))
+    return prompt_chars // 4 + int(payload.get("max_tokens") or 1000)
+
+
+def reported_tokens(body: Any) -> Optional[int]:
+    try:
+        return int(body["usage"]["total_tokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class LLMClient:
+    """Chat-completions client sharing one keep-alive connection pool across threads"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = OPENAI_BASE_URL,
+                 timeout: Tuple[float, float] = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+                 max_retries: int = LLM_MAX_RETRIES, pool_size: int = LLM_POOL_SIZE,
+                 limiter: Optional[RateLimiter] = None, cache: Optional[LLMCache] = None):
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter or get_rate_limiter()
+        self.cache = cache or get_llm_cache()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}",
+        })
+        self.retries = 0
+
+    def post(self, path: str, payload: Dict[str, Any], stream: bool = False,
+             timeout: Optional[Any] = None, priority: int = PRIORITY_INTERACTIVE) -> requests.Response:
+        """POST with retries on connection errors and retryable statuses
+
+        Every attempt is admitted by the shared rate limiter first. The last
+        response is returned whatever its status, so callers keep their own
+        handling of non-200 answers.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        estimate = estimate_tokens(payload)
+        attempt = 0
+        while True:
+            self.limiter.acquire(estimate, priority)
+            try:
+                response = self.session.post(url, json=payload, stream=stream, timeout=timeout or self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(retry_delay(attempt))
+            else:
+                if response.status_code == 429:
+                    delay = retry_delay(attempt, response.headers)
+                    self.limiter.pause(delay)
+                elif response.status_code == 200 and not stream:
+                    self.limiter.record_usage(estimate, reported_tokens(response.json()))
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+                if response.status_code != 429:
+                    # 429 waits are served by the limiter pause for every caller
+                    time.sleep(retry_delay(attempt, response.headers))
+            attempt += 1
+            self.retries += 1
+
+    def chat(self, payload: Dict[str, Any], timeout: Optional[Any] = None,
+             priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+        """Run a chat completion and return the decoded response body
+
+        Goes through the response cache: recorded bodies are returned without
+        a request, and in replay mode a request never recorded is an error.
+        """
+        cached = self.cache.get(payload)
+        if cached is not None:
+            return cached
+        if self.cache.mode == "replay":
+            raise cache_miss(self.cache, payload)
+        response = self.post("/chat/completions", payload, timeout=timeout, priority=priority)
+        if response.status_code != 200:
+            raise LLMError(error_message(response.status_code, response.text), response.status_code)
+        body = response.json()
+        self.cache.put(payload, body)
+        return body
+
+    def stream_chat(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE,
+                    info: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Yield the content deltas of a streamed chat completion
+
+        Closing the generator early, e.g. once the caller has a complete
+        answer, drops the connection so the server stops generating. A
+        recorded response is replayed as a single delta. If info is a dict
+        it receives the "finish_reason" of the first choice and the "usage"
+        the server reported, as far as the stream was read.
+        """
+        info = {} if info is None else info
+        cached = self.cache.get(payload)
+        if cached is not None:
+            choice = (cached.get("choices") or [{}])[0]
+            info.update({"finish_reason": choice.get("finish_reason"), "usage": cached.get("usage")})
+            content = choice.get("message", {}).get("content") or ""
+            if content:
+                yield content
+            return
+        if self.cache.mode == "replay":
+            raise cache_miss(self.cache, payload)
+        request = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        response = self.post("/chat/completions", request, stream=True, priority=priority)
+        if response.status_code != 200:
+            raise LLMError(error_message(response.status_code, response.text), response.status_code)
+        # text/event-stream carries no charset, which requests would read as latin-1
+        response.encoding = "utf-8"
+        parts = []
+        finished = False
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if chunk.get("usage"):
+                    info["usage"] = chunk["usage"]
+                    self.limiter.record_usage(estimate_tokens(payload), reported_tokens(chunk))
+                for choice in chunk.get("choices") or []:
+                    # Only a choice's last chunk carries its finish_reason
+                    if choice.get("finish_reason") and choice.get("index", 0) == 0:
+                        info["finish_reason"] = choice["finish_reason"]
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            finished = True
+        except GeneratorExit:
+            # Callers stop reading once a JSON answer is complete; a stream
+            # cut short for any other reason is not worth recording
+            text = "".join(parts).strip()
+            try:
+                _, end = json.JSONDecoder().raw_decode(text)
+                parts, finished = [text[:end]], True
+            except ValueError:
+                pass
+            raise
+        finally:
+            response.close()
+            if finished and parts:
+                self.cache.put(payload, completion_body("".join(parts), payload.get("model"),
+                                                        info.get("finish_reason") or "stop"))
+
+
+class AsyncLLMClient:
+    """asyncio counterpart of LLMClient, built on an httpx connection pool"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: str = OPENAI_BASE_URL,
+                 timeout: Tuple[float, float] = (LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT),
+                 max_retries: int = LLM_MAX_RETRIES, pool_size: int = LLM_POOL_SIZE,
+                 limiter: Optional[RateLimiter] = None, cache: Optional[LLMCache] = None):
+        if httpx is None:
+            raise LLMError("httpx is required for AsyncLLMClient")
+        self.max_retries = max_retries
+        self.limiter = limiter or get_rate_limiter()
+        self.cache = cache or get_llm_cache()
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}",
+            },
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+        self.retries = 0
+
+    async def post(self, path: str, payload: Dict[str, Any],
+                   priority: int = PRIORITY_INTERACTIVE) -> "httpx.Response":
+        estimate = estimate_tokens(payload)
+        attempt = 0
+        while True:
+            await self.limiter.aacquire(estimate, priority)
+            try:
+                response = await self.client.post(f"/{path.lstrip('/')}", json=payload)
+            except (httpx.TransportError, httpx.TimeoutException):
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+            else:
+                if response.status_code == 429:
+                    self.limiter.pause(retry_delay(attempt, response.headers))
+                elif response.status_code == 200:
+                    self.limiter.record_usage(estimate, reported_tokens(response.json()))
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                if response.status_code != 429:
+                    await asyncio.sleep(retry_delay(attempt, response.headers))
+            attempt += 1
+            self.retries += 1
+
+    async def chat(self, payload: Dict[str, Any], priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+        cached = self.cache.get(payload)
+        if cached is not None:
+            return cached
+        if self.cache.mode == "replay":
+            raise cache_miss(self.cache, payload)
+        response = await self.post("/chat/completions", payload, priority=priority)
+        if response.status_code != 200:
+            raise LLMError(error_message(response.status_code, response.text), response.status_code)
+        body = response.json()
+        self.cache.put(payload, body)
+        return body
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_clients: Dict[Tuple[Optional[str], str], LLMClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_llm_client(api_key: Optional[str] = None, base_url: str = OPENAI_BASE_URL) -> LLMClient:
+    """Return the process-wide client for an API key, creating it on first use"""
+    key = (api_key or os.getenv("OPENAI_API_KEY"), base_url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = LLMClient(api_key=key[0], base_url=base_url)
+        return _clients[key]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Request interception for agent browsers: resource blocking and a shared HTTP disk cache"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: the cache is only guarded within a process
+    fcntl = None
+
+HTTP_CACHE_DIR = Path(os.getenv("HTTP_CACHE_DIR", "http_cache"))
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+HTTP_CACHE_TTL = int(os.getenv("HTTP_CACHE_TTL", str(24 * 3600)))
+
+# Named block rules selectable from run_command; anything else in the block list
+# is treated as a URL pattern (glob if it contains '*', substring otherwise)
+BLOCK_PRESETS: Dict[str, Dict[str, List[str]]] = {
+    "analytics": {
+        "patterns": [
+            "google-analytics.com",
+            "googletagmanager.com",
+            "analytics.google.com",
+            "segment.io",
+            "segment.com/analytics",
+            "mixpanel.com",
+            "hotjar.com",
+            "fullstory.com",
+            "amplitude.com",
+            "heap.io",
+            "clarity.ms",
+            "sentry.io",
+            "connect.facebook.net",
+        ],
+        "resource_types": [],
+    },
+    "ads": {
+        "patterns": [
+            "doubleclick.net",
+            "googlesyndication.com",
+            "googleadservices.com",
+            "adservice.google.",
+            "amazon-adsystem.com",
+            "adnxs.com",
+            "taboola.com",
+            "outbrain.com",
+            "criteo.com",
+        ],
+        "resource_types": [],
+    },
+    "media": {"patterns": [], "resource_types": ["media"]},
+    "images": {"patterns": [], "resource_types": ["image"]},
+    "fonts": {"patterns": [], "resource_types": ["font"]},
+}
+
+# Static sub-resources worth serving from disk across runs
+CACHEABLE_RESOURCE_TYPES = {"script", "stylesheet", "font", "image"}
+# Headers that describe the wire encoding, which no longer applies to a cached body
+HOP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class HttpDiskCache:
+    """Size-bounded, LRU-evicted response cache shared by all browser sessions
+
+    Every worker process opens the same directory, so the size bound is kept
+    on disk: a byte total in SIZE_FILE, updated under an exclusive file lock
+    whenever entries are written or removed. A body's mtime is its last
+    access, and eviction removes the least recently used bodies until the
+    total fits again. The total is recounted from a directory scan when a
+    cache is opened, which also repairs drift left by a crashed process.
+    """
+
+    SIZE_FILE = "size"
+    LOCK_FILE = ".lock"
+
+    def __init__(self, root: Path = HTTP_CACHE_DIR, max_bytes: int = HTTP_CACHE_MAX_BYTES, ttl: int = HTTP_CACHE_TTL):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            self._write_total(self._scan_total())
+            self._evict()
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the cache directory across threads and processes"""
+        with self.lock:
+            with open(self.root / self.LOCK_FILE, "w") as handle:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                yield
+
+    def _bodies(self) -> List[Tuple[str, int, float]]:
+        """(key, size, last access) of every cached body on disk"""
+        bodies = []
+        for body_path in self.root.glob("*.body"):
+            try:
+                stat = body_path.stat()
+            except OSError:
+                continue
+            bodies.append((body_path.stem, stat.st_size, stat.st_mtime))
+        return bodies
+
+    def _scan_total(self) -> int:
+        for meta_path in self.root.glob("*.json"):
+            if not meta_path.with_suffix(".body").exists():
+                meta_path.unlink(missing_ok=True)
+        return sum(size for _, size, _ in self._bodies())
+
+    def _read_total(self) -> int:
+        try:
+            return int((self.root / self.SIZE_FILE).read_text())
+        except (OSError, ValueError):
+            return self._scan_total()
+
+    def _write_total(self, total: int):
+        self._write(self.root / self.SIZE_FILE, str(max(0, total)).encode("utf-8"))
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cacheable_request(method: str, resource_type: str) -> bool:
+        return method == "GET" and resource_type in CACHEABLE_RESOURCE_TYPES
+
+    def cacheable_response(self, status: int, headers: Dict[str, str], size: int) -> bool:
+        if status != 200 or size > self.max_bytes // 8:
+            return False
+        cache_control = headers.get("cache-control", "").lower()
+        return "no-store" not in cache_control and "private" not in cache_control
+
+    def get(self, url: str) -> Optional[Tuple[int, Dict[str, str], bytes]]:
+        key = self.key(url)
+        body_path = self.root / f"{key}.body"
+        try:
+            with open(self.root / f"{key}.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            expired = meta["stored_at"] + self.ttl <= time.time()
+            body = None if expired else body_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            expired, body = True, None
+        if body is None:
+            with self._locked():
+                self._write_total(self._read_total() - self._remove(key))
+            return None
+        try:
+            # The body's mtime is its LRU timestamp
+            os.utime(body_path)
+        except OSError:
+            pass
+        return meta["status"], meta["headers"], body
+
+    def put(self, url: str, status: int, headers: Dict[str, str], body: bytes):
+        key = self.key(url)
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {k: v for k, v in headers.items() if k.lower() not in HOP_HEADERS},
+            "stored_at": time.time(),
+        }
+        with self._locked():
+            total = self._read_total() - self._remove(key)
+            self._write(self.root / f"{key}.body", body)
+            self._write(self.root / f"{key}.json", json.dumps(meta).encode("utf-8"))
+            self._write_total(total + len(body))
+            self._evict()
+
+    def _write(self, path: Path, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _remove(self, key: str) -> int:
+        """Delete an entry's files; returns the body size freed. Call with the lock held"""
+        body_path = self.root / f"{key}.body"
+        try:
+            size = body_path.stat().st_size
+        except OSError:
+            size = 0
+        body_path.unlink(missing_ok=True)
+        (self.root / f"{key}.json").unlink(missing_ok=True)
+        return size
+
+    def _evict(self):
+        """Remove least recently used entries until the on-disk total fits. Call with the lock held"""
+        total = self._read_total()
+        if total <= self.max_bytes:
+            return
+        # The scan also corrects a total that drifted from the files
+        bodies = self._bodies()
+        total = sum(size for _, size, _ in bodies)
+        for key, _, _ in sorted(bodies, key=lambda body: body[2]):
+            if total <= self.max_bytes:
+                break
+            total -= self._remove(key)
+        self._write_total(total)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked():
+            return {"entries": len(self._bodies()), "bytes": self._read_total(), "max_bytes": self.max_bytes}
+
+
+_shared_cache: Optional[HttpDiskCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> HttpDiskCache:
+    """Return the process-wide HTTP cache, creating it on first use"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = HttpDiskCache()
+        return _shared_cache
+
+
+class NetworkPolicy:
+    """Per-run interception rules applied to every page of a browser context"""
+
+    def __init__(self, block: Optional[List[str]] = None, cache: Optional[HttpDiskCache] = None):
+        self.patterns: List[str] = []
+        self.resource_types = set()
+        for rule in block or []:
+            preset = BLOCK_PRESETS.get(rule)
+            if preset:
+                self.patterns.extend(preset["patterns"])
+                self.resource_types.update(preset["resource_types"])
+            else:
+                self.patterns.append(rule)
+        self.globs = [p for p in self.patterns if "*" in p]
+        self.substrings = [p for p in self.patterns if "*" not in p]
+        self.cache = cache
+        self.stats = {"blocked": 0, "cache_hits": 0, "cache_misses": 0}
+
+    @classmethod
+    def from_options(cls, options: Optional[Dict[str, Any]]) -> "NetworkPolicy":
+        """Build a policy from the run_command 'network' body: {"block": [...], "cache": bool}"""
+        options = options or {}
+        cache = get_http_cache() if options.get("cache") else None
+        return cls(block=options.get("block"), cache=cache)
+
+    @property
+    def active(self) -> bool:
+        return bool(self.patterns or self.resource_types or self.cache)
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        if resource_type in self.resource_types:
+            return True
+        if any(s in url for s in self.substrings):
+            return True
+        return any(fnmatch(url, g) for g in self.globs)
+
+    async def handle_route(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self.stats["blocked"] += 1
+            await route.abort("blockedbyclient")
+            return
+        cache = self.cache
+        if cache is None or not cache.cacheable_request(request.method, request.resource_type):
+            await route.continue_()
+            return
+        # Disk I/O happens off the browser's event loop
+        hit = await asyncio.to_thread(cache.get, request.url)
+        if hit is not None:
+            self.stats["cache_hits"] += 1
+            status, headers, body = hit
+            await route.fulfill(status=status, headers=headers, body=body)
+            return
+        self.stats["cache_misses"] += 1
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception:
+            await route.continue_()
+            return
+        headers = response.headers
+        if cache.cacheable_response(response.status, headers, len(body)):
+            await asyncio.to_thread(cache.put, request.url, response.status, headers, body)
+        await route.fulfill(response=response, body=body)
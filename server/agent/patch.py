@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""Unified-diff parsing and all-or-nothing application across multiple files"""
+
+import os
+import re
+import difflib
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+DEV_NULL = "/dev/null"
+
+
+class PatchError(Exception):
+    """Raised for a diff that cannot be parsed"""
+    pass
+
+
+class HunkError(Exception):
+    """Raised when a hunk does not match the file it targets"""
+
+    def __init__(self, hunk: Dict[str, Any], reason: str, closest: Optional[Dict[str, Any]] = None):
+        super().__init__(reason)
+        self.hunk = hunk
+        self.reason = reason
+        self.closest = closest
+
+
+def _strip_header_path(value: str) -> str:
+    # "--- a/foo.py\t2024-01-01 ..." -> "a/foo.py"
+    return value.split("\t", 1)[0].strip()
+
+
+def parse_patch(text: str) -> List[Dict[str, Any]]:
+    """Parse a unified diff into file patches
+
+    Each file patch is {"old_path", "new_path", "hunks"}, and each hunk
+    {"header", "old_start", "lines": [(op, text, newline)]} where op is one of
+    ' ', '-', '+'. Line counts in hunk headers are not trusted; the hunk body
+    decides. Blank lines inside a hunk are read as blank context lines.
+    """
+    lines = text.splitlines()
+    files: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    hunk: Optional[Dict[str, Any]] = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ "):
+            old_path = _strip_header_path(line[4:])
+            new_path = _strip_header_path(lines[i + 1][4:])
+            # git-style a/ and b/ prefixes; /dev/null marks a created or deleted file
+            if (old_path.startswith("a/") or old_path == DEV_NULL) and (new_path.startswith("b/") or new_path == DEV_NULL):
+                old_path = old_path if old_path == DEV_NULL else old_path[2:]
+                new_path = new_path if new_path == DEV_NULL else new_path[2:]
+            current = {"old_path": old_path, "new_path": new_path, "hunks": []}
+            files.append(current)
+            hunk = None
+            i += 2
+            continue
+        if line.startswith("@@"):
+            if current is None:
+                raise PatchError(f"Hunk before any file header at diff line {i + 1}")
+            match = HUNK_HEADER.match(line)
+            hunk = {
+                "header": line,
+                "old_start": int(match.group(1)) if match else None,
+                "lines": [],
+            }
+            current["hunks"].append(hunk)
+        elif hunk is not None and line.startswith("\\"):
+            # "\ No newline at end of file" applies to the previous line
+            if hunk["lines"]:
+                op, body, _ = hunk["lines"][-1]
+                hunk["lines"][-1] = (op, body, False)
+        elif hunk is not None and (line[:1] in (" ", "-", "+") or line == ""):
+            hunk["lines"].append((line[:1] or " ", line[1:], True))
+        elif line.startswith(("diff ", "index ", "new file mode", "deleted file mode", "similarity", "rename ")):
+            hunk = None
+        elif hunk is not None:
+            raise PatchError(f"Unexpected line in hunk at diff line {i + 1}: {line[:80]!r}")
+        i += 1
+    if not files:
+        raise PatchError("No file headers (---/+++) found in patch")
+    for file_patch in files:
+        if not file_patch["hunks"]:
+            raise PatchError(f"No hunks for {file_patch['new_path']}")
+    return files
+
+
+def _matches(file_lines: List[str], block: List[str], position: int, loose: bool) -> bool:
+    if position < 0 or position + len(block) > len(file_lines):
+        return False
+    for offset, expected in enumerate(block):
+        actual = file_lines[position + offset].rstrip("\r\n")
+        if loose:
+            actual, expected = actual.rstrip(), expected.rstrip()
+        if actual != expected:
+            return False
+    return True
+
+
+def _closest_line(file_lines: List[str], expected: str) -> Optional[Dict[str, Any]]:
+    """Best fuzzy match of a hunk's first line, to point the author at the drift"""
+    best, best_ratio = None, 0.6
+    for number, line in enumerate(file_lines, 1):
+        ratio = difflib.SequenceMatcher(None, line.strip(), expected.strip()).ratio()
+        if ratio > best_ratio:
+            best, best_ratio = {"line": number, "text": line.rstrip("\r\n")}, ratio
+    return best
+
+
+def apply_hunks(original: str, hunks: List[Dict[str, Any]]) -> Tuple[str, int, int]:
+    """Apply hunks to text; returns (new_text, added, removed) or raises HunkError
+
+    Each hunk is located at its header position (shifted by earlier hunks),
+    else at the nearest position after the previous hunk where its context and
+    removed lines match exactly, then ignoring trailing whitespace.
+    """
+    file_lines = original.splitlines(keepends=True)
+    newline = "\r\n" if file_lines and file_lines[0].endswith("\r\n") else "\n"
+    result: List[str] = []
+    cursor = 0
+    # How far the file has drifted from the line numbers in the hunk headers
+    shift = 0
+    added = removed = 0
+    for hunk in hunks:
+        old_block = [body for op, body, _ in hunk["lines"] if op != "+"]
+        expected = (hunk["old_start"] or 1) - 1
+        hint = expected + shift
+        if not old_block:
+            # Pure insertion: "@@ -N,0" inserts after line N
+            expected = hunk["old_start"] or 0
+            position = min(max(expected + shift, cursor), len(file_lines))
+        else:
+            position = None
+            for loose in (False, True):
+                candidates = sorted(range(cursor, len(file_lines) - len(old_block) + 1), key=lambda p: abs(p - hint))
+                position = next((p for p in candidates if _matches(file_lines, old_block, p, loose)), None)
+                if position is not None:
+                    break
+            if position is None:
+                closest = _closest_line(file_lines, old_block[0])
+                raise HunkError(hunk, "context and removed lines not found", closest)
+        result.extend(file_lines[cursor:position])
+        index = position
+        for op, body, has_newline in hunk["lines"]:
+            ending = newline if has_newline else ""
+            if op == " ":
+                result.append(file_lines[index])
+                index += 1
+            elif op == "-":
+                index += 1
+                removed += 1
+            else:
+                result.append(body + ending)
+                added += 1
+        if hunk["old_start"] is not None:
+            shift = position - expected
+        cursor = index
+    result.extend(file_lines[cursor:])
+    # An insertion at the end of a file lacking a final newline needs one between
+    for n in range(len(result) - 1):
+        if not result[n].endswith("\n"):
+            result[n] += newline
+    return "".join(result), added, removed
+
+
+def merge_versions(original: bytes, ours: bytes, theirs: bytes) -> Optional[bytes]:
+    """Three-way merge of two edits of original with git merge-file
+
+    Returns the merged content, or None if the edits overlap (or git is not
+    available), in which case the caller has to serialize them.
+    """
+    with tempfile.TemporaryDirectory(prefix="merge-") as tmp:
+        paths = []
+        for name, data in (("ours", ours), ("base", original), ("theirs", theirs)):
+            path = Path(tmp) / name
+            path.write_bytes(data)
+            paths.append(str(path))
+        try:
+            result = subprocess.run(["git", "merge-file", "-p", *paths], capture_output=True)
+        except OSError:
+            return None
+    # Exit status is the number of conflicts; negative on errors
+    return result.stdout if result.returncode == 0 else None
+
+
+def _resolve(root: Path, name: str) -> Path:
+    """Map a diff path onto the workspace, refusing paths outside it"""
+    # Tools show workspace-relative paths, so relative names are relative to root
+    candidate = Path(name) if os.path.isabs(name) else root / name
+    try:
+        candidate.resolve().relative_to(root.resolve())
+    except ValueError:
+        raise PatchError(f"Path outside the workspace: {name}")
+    return candidate
+
+
+def write_atomic(path: Path, data: bytes):
+    """Replace path with data through a temp file, keeping its permissions"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = path.stat().st_mode & 0o7777 if path.exists() else None
+    tmp = path.parent / f".{path.name}.{os.urandom(6).hex()}.tmp"
+    # Created like any new file, so the process umask applies to its mode
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def apply_patch(patch_text: str, root: Union[str, Path], read_bytes=None) -> Dict[str, Any]:
+    """Validate every hunk of a multi-file diff, then write all files or none
+
+    read_bytes(path) lets callers serve current contents from a cache. Nothing
+    is written unless every hunk of every file applies; writes go through temp
+    files and os.replace, and already-replaced files are restored if a later
+    write fails. Several sections for one file apply in order, each on top of
+    the content the previous ones produced.
+    """
+    root = Path(root)
+    read_bytes = read_bytes or (lambda p: Path(p).read_bytes())
+    try:
+        file_patches = parse_patch(patch_text)
+    except PatchError as e:
+        return {"success": False, "error": f"Invalid patch: {e}"}
+
+    # Validation phase: compute every new file content in memory. Sections
+    # for a path already planned apply on top of its planned content.
+    plan: Dict[Path, Dict[str, Any]] = {}
+    failures: List[Dict[str, Any]] = []
+    for file_patch in file_patches:
+        creating = file_patch["old_path"] == DEV_NULL
+        deleting = file_patch["new_path"] == DEV_NULL
+        name = file_patch["old_path"] if deleting else file_patch["new_path"]
+        try:
+            path = _resolve(root, name)
+        except PatchError as e:
+            failures.append({"path": name, "reason": str(e)})
+            continue
+        planned = plan.get(path.resolve())
+        exists = planned["data"] is not None if planned else path.exists()
+        if creating and exists:
+            failures.append({"path": str(path), "reason": "file to create already exists"})
+            continue
+        if not creating and not (exists if planned else path.is_file()):
+            failures.append({"path": str(path), "reason": "file does not exist"})
+            continue
+        try:
+            if creating:
+                original = ""
+            elif planned:
+                original = planned["data"].decode("utf-8")
+            else:
+                original = read_bytes(path).decode("utf-8")
+        except UnicodeDecodeError:
+            failures.append({"path": str(path), "reason": "file is not UTF-8 text"})
+            continue
+        try:
+            new_text, added, removed = apply_hunks(original, file_patch["hunks"])
+        except HunkError as e:
+            number = file_patch["hunks"].index(e.hunk) + 1
+            failure = {
+                "path": str(path),
+                "hunk": number,
+                "header": e.hunk["header"],
+                "reason": e.reason,
+                "expected": [body for op, body, _ in e.hunk["lines"] if op != "+"][:5],
+            }
+            if e.closest:
+                failure["closest_match"] = e.closest
+            failures.append(failure)
+            continue
+        data = None if deleting else new_text.encode("utf-8")
+        if planned is None:
+            plan[path.resolve()] = {
+                "path": path,
+                "status": "created" if creating else "deleted" if deleting else "modified",
+                "data": data,
+                "backup": None if creating else original.encode("utf-8"),
+                "hunks": len(file_patch["hunks"]),
+                "added": added,
+                "removed": removed,
+            }
+            continue
+        # The status compares the final content with what is on disk now
+        planned["data"] = data
+        if planned["backup"] is None:
+            planned["status"] = "created"
+        else:
+            planned["status"] = "deleted" if deleting else "modified"
+        planned["hunks"] += len(file_patch["hunks"])
+        planned["added"] += added
+        planned["removed"] += removed
+    if failures:
+        return {
+            "success": False,
+            "error": f"Patch not applied: {len(failures)} of {len(file_patches)} file(s) failed validation; no files were changed",
+            "failures": failures,
+        }
+
+    # A file created and deleted again by the same diff is left alone
+    entries = [entry for entry in plan.values() if entry["backup"] is not None or entry["data"] is not None]
+
+    # Write phase: all validated, so only I/O errors can fail from here
+    done: List[Dict[str, Any]] = []
+    try:
+        for entry in entries:
+            if entry["status"] == "deleted":
+                entry["path"].unlink()
+            else:
+                write_atomic(entry["path"], entry["data"])
+            done.append(entry)
+    except OSError as e:
+        for entry in reversed(done):
+            if entry["status"] == "created":
+                entry["path"].unlink(missing_ok=True)
+            else:
+                write_atomic(entry["path"], entry["backup"])
+        return {"success": False, "error": f"Failed writing {entry['path']}: {e}; changes rolled back"}
+
+    return {
+        "success": True,
+        "files": [
+            {k: (str(v) if k == "path" else v) for k, v in entry.items() if k not in ("data", "backup")}
+            for entry in entries
+        ],
+    }
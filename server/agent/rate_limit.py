@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Process-wide token-bucket rate limiter for LLM requests, with priorities"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from workers import AGENT_WORKERS
+
+try:
+    from langchain_core.rate_limiters import BaseRateLimiter
+except ImportError:  # only the ChatOpenAI adapter needs it
+    BaseRateLimiter = object
+
+# Quota of the OpenAI key; 0 leaves that dimension unlimited. 429 responses
+# still pause every caller in the process while the server asks for it.
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+# Rough size of one browser_use step, whose prompt the limiter never sees
+LLM_BROWSER_CALL_TOKENS = int(os.getenv("LLM_BROWSER_CALL_TOKENS", "6000"))
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a request could not be admitted within its timeout"""
+    pass
+
+
+class TokenBucket:
+    """Capacity refilled continuously at capacity per minute; capacity 0 = unlimited"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds until amount is available (0 if it is now)"""
+        if self.unlimited or self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.level -= amount
+
+    def give(self, amount: float):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Admits LLM requests against request and token budgets, highest priority first
+
+    Waiters queue by (priority, arrival); only the head of the queue may take
+    budget, so interactive runs overtake queued background PR jobs while
+    requests of one priority stay first come, first served. Token use is
+    estimated up front and corrected with record_usage once the response
+    reports the real count.
+    """
+
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cond = threading.Condition()
+        self.waiting: List[Tuple[int, int]] = []
+        self.sequence = itertools.count()
+        self.blocked_until = 0.0
+        self.metrics: Dict[int, Dict[str, float]] = {
+            priority: {"admitted": 0, "wait_total": 0.0, "wait_max": 0.0} for priority in PRIORITY_NAMES
+        }
+        self.throttled = 0
+
+    def _delay(self, tokens: float, now: float) -> float:
+        return max(self.requests.delay(1), self.tokens.delay(tokens), self.blocked_until - now)
+
+    def _admit(self, tokens: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def _record_wait(self, priority: int, waited: float):
+        metrics = self.metrics.setdefault(priority, {"admitted": 0, "wait_total": 0.0, "wait_max": 0.0})
+        metrics["admitted"] += 1
+        metrics["wait_total"] += waited
+        metrics["wait_max"] = max(metrics["wait_max"], waited)
+
+    def acquire(self, tokens: float = 0, priority: int = PRIORITY_INTERACTIVE,
+                timeout: Optional[float] = None) -> float:
+        """Block until the request is admitted; returns the seconds spent waiting"""
+        if not self.tokens.unlimited:
+            # A request larger than the whole bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens.capacity)
+        start = time.monotonic()
+        with self.cond:
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait: Optional[float] = None
+                    if self.waiting[0] == ticket:
+                        wait = self._delay(tokens, now)
+                        if wait <= 0:
+                            self._admit(tokens)
+                            break
+                    if timeout is not None:
+                        remaining = timeout - (now - start)
+                        if remaining <= 0:
+                            raise RateLimitTimeout(f"LLM request not admitted within {timeout}s")
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self.cond.wait(wait)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.cond.notify_all()
+            waited = time.monotonic() - start
+            self._record_wait(priority, waited)
+        return waited
+
+    def try_acquire(self, tokens: float = 0, priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """Admit the request only if nobody is queued and budget is available now"""
+        with self.cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            if self.waiting or self._delay(tokens, now) > 0:
+                return False
+            self._admit(tokens)
+            self._record_wait(priority, 0.0)
+        return True
+
+    async def aacquire(self, tokens: float = 0, priority: int = PRIORITY_INTERACTIVE) -> float:
+        return await asyncio.to_thread(self.acquire, tokens, priority)
+
+    def record_usage(self, estimated: float, actual: Optional[float]):
+        """Settle an estimate against the token count the API reported"""
+        if actual is None:
+            return
+        with self.cond:
+            if actual < estimated:
+                self.tokens.give(estimated - actual)
+            else:
+                self.tokens.take(actual - estimated)
+            self.cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Hold every caller back after the server answered 429"""
+        with self.cond:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            by_priority = {
+                PRIORITY_NAMES.get(priority, str(priority)): {
+                    "admitted": int(m["admitted"]),
+                    "avg_wait_s": round(m["wait_total"] / m["admitted"], 3) if m["admitted"] else 0.0,
+                    "max_wait_s": round(m["wait_max"], 3),
+                }
+                for priority, m in self.metrics.items()
+            }
+            return {
+                "rpm": self.requests.capacity or None,
+                "tpm": self.tokens.capacity or None,
+                "queued": len(self.waiting),
+                "throttled_429": self.throttled,
+                "paused_for_s": round(max(0.0, self.blocked_until - time.monotonic()), 3),
+                "priorities": by_priority,
+            }
+
+
+class LangchainRateLimiter(BaseRateLimiter):  # type: ignore[misc]
+    """Adapter letting ChatOpenAI(rate_limiter=...) draw from a RateLimiter"""
+
+    def __init__(self, limiter: RateLimiter, priority: int = PRIORITY_INTERACTIVE,
+                 tokens_per_call: int = LLM_BROWSER_CALL_TOKENS):
+        self.limiter = limiter
+        self.priority = priority
+        self.tokens_per_call = tokens_per_call
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not blocking:
+            return self.limiter.try_acquire(self.tokens_per_call, self.priority)
+        self.limiter.acquire(self.tokens_per_call, self.priority)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        if not blocking:
+            return self.limiter.try_acquire(self.tokens_per_call, self.priority)
+        await self.limiter.aacquire(self.tokens_per_call, self.priority)
+        return True
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the process-wide limiter, creating it on first use
+
+    With AGENT_WORKERS the front-end and every worker process each get an
+    equal share of the quota, since they cannot see each other's usage.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            shares = 1 + max(AGENT_WORKERS, 0)
+            rpm = max(1, LLM_RPM // shares) if LLM_RPM else 0
+            tpm = max(1, LLM_TPM // shares) if LLM_TPM else 0
+            _limiter = RateLimiter(rpm, tpm)
+        return _limiter
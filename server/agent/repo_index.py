@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""In-memory search index over a cloned repository: file tree, content trigrams and Python symbols"""
+
+import os
+import re
+import ast
+import time
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Union
+
+# Files above this size are listed but not content-indexed
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+# Directories skipped when the workspace is not a git checkout
+SKIP_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv", "dist", "build", ".next"}
+
+
+def list_repo_files(root: Union[str, Path]) -> List[str]:
+    """List files under root as relative POSIX paths, honouring .gitignore
+
+    Uses `git ls-files` (tracked plus untracked-but-not-ignored files) when root
+    is the top of a git checkout, and falls back to a directory walk otherwise.
+    A subdirectory of a checkout, or a plain directory nested in an unrelated
+    repository, is walked so that it isn't filtered by that repository's index
+    and ignore rules.
+    """
+    root = Path(root)
+    toplevel = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=str(root),
+                              capture_output=True, text=True)
+    result = None
+    if toplevel.returncode == 0 and Path(toplevel.stdout.strip()).resolve() == root.resolve():
+        result = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            cwd=str(root), capture_output=True
+        )
+    if result is not None and result.returncode == 0:
+        files = [p for p in result.stdout.decode("utf-8", errors="replace").split("\0") if p]
+        # ls-files still lists tracked files deleted from the working tree
+        return sorted({p for p in files if (root / p).is_file()})
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        rel_dir = Path(dirpath).relative_to(root)
+        files.extend((rel_dir / name).as_posix() for name in filenames)
+    return sorted(files)
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _python_symbols(source: str) -> List[Dict[str, Any]]:
+    """Classes, functions and methods defined in a Python module"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    symbols = []
+
+    def visit(node, parent: Optional[str]):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, ast.ClassDef):
+                symbols.append({"name": child.name, "kind": "class", "line": child.lineno, "parent": parent})
+                visit(child, child.name)
+            elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kind = "method" if parent else "function"
+                symbols.append({"name": child.name, "kind": kind, "line": child.lineno, "parent": parent})
+            elif isinstance(child, ast.Assign) and parent is None:
+                for target in child.targets:
+                    if isinstance(target, ast.Name) and target.id.isupper():
+                        symbols.append({"name": target.id, "kind": "constant", "line": child.lineno, "parent": None})
+
+    visit(tree, None)
+    return symbols
+
+
+class RepoIndex:
+    """File list, trigram content index and symbol table for one workspace"""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.files: List[str] = []
+        # relative path -> text content, for indexed (text, size-capped) files
+        self.contents: Dict[str, str] = {}
+        self.trigram_index: Dict[str, Set[str]] = {}
+        self.file_trigrams: Dict[str, Set[str]] = {}
+        self.symbols: Dict[str, List[Dict[str, Any]]] = {}
+        self.build_seconds = 0.0
+
+    @classmethod
+    def build(cls, root: Union[str, Path]) -> "RepoIndex":
+        index = cls(root)
+        start = time.perf_counter()
+        index.files = list_repo_files(root)
+        for rel in index.files:
+            index._index_file(rel)
+        index.build_seconds = time.perf_counter() - start
+        return index
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "files": len(self.files),
+            "indexed_files": len(self.contents),
+            "symbols": sum(len(s) for s in self.symbols.values()),
+            "build_seconds": round(self.build_seconds, 3),
+        }
+
+    def _read_text(self, rel: str) -> Optional[str]:
+        path = self.root / rel
+        try:
+            if path.stat().st_size > MAX_INDEXED_FILE_BYTES:
+                return None
+            data = path.read_bytes()
+        except OSError:
+            return None
+        if b"\0" in data[:8192]:
+            return None
+        return data.decode("utf-8", errors="replace")
+
+    def _unindex_file(self, rel: str):
+        for gram in self.file_trigrams.pop(rel, set()):
+            paths = self.trigram_index.get(gram)
+            if paths is not None:
+                paths.discard(rel)
+                if not paths:
+                    del self.trigram_index[gram]
+        self.contents.pop(rel, None)
+        self.symbols.pop(rel, None)
+
+    def _index_file(self, rel: str):
+        text = self._read_text(rel)
+        if text is None:
+            return
+        self.contents[rel] = text
+        grams = _trigrams(text.lower())
+        self.file_trigrams[rel] = grams
+        for gram in grams:
+            self.trigram_index.setdefault(gram, set()).add(rel)
+        if rel.endswith(".py"):
+            symbols = _python_symbols(text)
+            if symbols:
+                self.symbols[rel] = symbols
+
+    def relative(self, path: Union[str, Path]) -> Optional[str]:
+        """Path relative to the index root, or None if it lies outside it"""
+        try:
+            return Path(path).resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return None
+
+    def update_file(self, path: Union[str, Path]):
+        """Re-index one file after it was created, edited or deleted
+
+        A relative path is relative to the index root, as in search results.
+        """
+        rel = self.relative(path if Path(path).is_absolute() else self.root / path)
+        if rel is None:
+            return
+        self._unindex_file(rel)
+        if (self.root / rel).is_file():
+            if rel not in self.files:
+                self.files.append(rel)
+                self.files.sort()
+            self._index_file(rel)
+        elif rel in self.files:
+            self.files.remove(rel)
+
+    def _candidates(self, query: str) -> List[str]:
+        """Files that can contain a literal query, narrowed via the trigram index"""
+        grams = _trigrams(query.lower())
+        if not grams:
+            return list(self.contents)
+        candidates: Optional[Set[str]] = None
+        for gram in grams:
+            paths = self.trigram_index.get(gram, set())
+            candidates = set(paths) if candidates is None else candidates & paths
+            if not candidates:
+                return []
+        return sorted(candidates or [])
+
+    def search(self, query: str, regex: bool = False, path: Optional[str] = None,
+               max_results: int = 50) -> Dict[str, Any]:
+        """Ranked symbol, file-name and content matches for a query
+
+        Symbol definitions rank first, then file paths, then content lines
+        (files with more hits first). path restricts results to a subdirectory
+        or file of the workspace, given relative to the root or absolute; a
+        path outside the root is an error.
+        """
+        if not query:
+            return {"success": False, "error": "Empty search query"}
+        try:
+            pattern = re.compile(query if regex else re.escape(query), re.IGNORECASE)
+        except re.error as e:
+            return {"success": False, "error": f"Invalid regex: {e}"}
+        scope = None
+        if path:
+            # Relative scopes are relative to the index root, not the process CWD
+            scope = self.relative(path if Path(path).is_absolute() else self.root / path)
+            if scope is None:
+                return {"success": False, "error": f"Search path is outside the workspace: {path}"}
+            if scope in (".", ""):
+                scope = None
+
+        def in_scope(rel: str) -> bool:
+            return scope is None or rel == scope or rel.startswith(scope.rstrip("/") + "/")
+
+        matches: List[Dict[str, Any]] = []
+        lowered = query.lower()
+        for rel, symbols in self.symbols.items():
+            if not in_scope(rel):
+                continue
+            for symbol in symbols:
+                name = symbol["name"]
+                if regex:
+                    score = 90 if pattern.fullmatch(name) else (40 if pattern.search(name) else 0)
+                else:
+                    low = name.lower()
+                    score = 100 if low == lowered else 60 if low.startswith(lowered) else 40 if lowered in low else 0
+                if score:
+                    qualified = f"{symbol['parent']}.{name}" if symbol["parent"] else name
+                    matches.append({"kind": symbol["kind"], "name": qualified, "path": rel,
+                                    "line": symbol["line"], "score": score})
+
+        for rel in self.files:
+            if in_scope(rel) and pattern.search(rel):
+                score = 50 if pattern.search(rel.rsplit("/", 1)[-1]) else 30
+                matches.append({"kind": "file", "path": rel, "score": score})
+
+        candidates = list(self.contents) if regex else self._candidates(query)
+        for rel in candidates:
+            if not in_scope(rel):
+                continue
+            hits = []
+            for number, line in enumerate(self.contents[rel].splitlines(), 1):
+                if pattern.search(line):
+                    hits.append((number, line.strip()[:200]))
+            for number, text in hits:
+                # Lines from files with more hits rank first
+                matches.append({"kind": "line", "path": rel, "line": number,
+                                "text": text, "score": 10 + min(len(hits), 10) / 10})
+
+        matches.sort(key=lambda m: (-m["score"], m["path"], m.get("line", 0)))
+        return {
+            "success": True,
+            "query": query,
+            "total": len(matches),
+            "truncated": len(matches) > max_results,
+            "matches": matches[:max_results],
+        }
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Per-turn choice between a fast and a strong chat model, with per-model stats"""
+
+import os
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+# Cheap, low-latency model for navigation turns and PR metadata; empty
+# disables routing so every turn uses the agent's (strong) model
+AGENT_FAST_MODEL = os.getenv("AGENT_FAST_MODEL", "gpt-4.1-mini-2025-04-14")
+AGENT_FAST_MAX_TOKENS = int(os.getenv("AGENT_FAST_MAX_TOKENS", "1000"))
+AGENT_STRONG_MAX_TOKENS = int(os.getenv("AGENT_STRONG_MAX_TOKENS", "2000"))
+
+# Actions the fast model may not decide on its own
+ESCALATING_ACTIONS = {"create", "str_replace", "insert", "patch"}
+# Latencies kept per model for the median
+LATENCY_SAMPLES = 200
+
+
+class ModelStats:
+    """Latency and token counts per model, thread-safe"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.models: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+        with self.lock:
+            entry = self.models.setdefault(model, {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                "latencies": deque(maxlen=LATENCY_SAMPLES),
+            })
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["latencies"].append(seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {model: summarize_calls(entry) for model, entry in self.models.items()}
+
+
+def summarize_calls(entry: Dict[str, Any]) -> Dict[str, Any]:
+    latencies: List[float] = sorted(entry["latencies"])
+    return {
+        "calls": entry["calls"],
+        "avg_latency_s": round(entry["seconds"] / entry["calls"], 3) if entry["calls"] else 0.0,
+        "p50_latency_s": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+        "max_latency_s": round(latencies[-1], 3) if latencies else 0.0,
+        "prompt_tokens": entry["prompt_tokens"],
+        "completion_tokens": entry["completion_tokens"],
+    }
+
+
+_model_stats = ModelStats()
+
+
+def get_model_stats() -> ModelStats:
+    return _model_stats
+
+
+class ModelRouter:
+    """Picks the model for each agent turn
+
+    Turns start on the fast model. A decision from it that edits files is
+    discarded and re-asked from the strong model (should_escalate), as is
+    one that cannot be parsed even after repairs, typically because it was
+    cut off at AGENT_FAST_MAX_TOKENS (should_retry_strong). The
+    strong model keeps the next turn after an edit, a failed action, a
+    repaired reply or a stall warning, since those turns need care rather
+    than speed.
+    """
+
+    def __init__(self, strong_model: str, fast_model: Optional[str] = AGENT_FAST_MODEL):
+        self.strong = strong_model
+        self.fast = fast_model if fast_model and fast_model != strong_model else None
+        self.prefer_strong = False
+        self.escalations = 0
+        # Stats of this run only; every call is also added to the process-wide stats
+        self.calls = ModelStats()
+
+    def choose(self) -> str:
+        return self.strong if self.prefer_strong or not self.fast else self.fast
+
+    def max_tokens(self, model: str) -> int:
+        return AGENT_FAST_MAX_TOKENS if model == self.fast else AGENT_STRONG_MAX_TOKENS
+
+    def should_escalate(self, model: str, actions: List[str]) -> bool:
+        """True if a fast-model decision must be re-asked from the strong model"""
+        if model != self.fast or not ESCALATING_ACTIONS.intersection(actions):
+            return False
+        self.escalations += 1
+        return True
+
+    def should_retry_strong(self, model: str) -> bool:
+        """True if a fast-model reply that stayed unparseable should be re-asked from the strong model"""
+        if model != self.fast:
+            return False
+        self.escalations += 1
+        return True
+
+    def observe(self, results: List[Dict[str, Any]], troubled: bool = False):
+        """Route the next turn from this turn's results; troubled marks repairs or stalls"""
+        wrote = any(step["action"] in ESCALATING_ACTIONS for step in results)
+        failed = any(not step["result"].get("success") for step in results)
+        self.prefer_strong = wrote or failed or troubled
+
+    def record(self, model: str, seconds: float, prompt_tokens: int, completion_tokens: int):
+        self.calls.record(model, seconds, prompt_tokens, completion_tokens)
+        _model_stats.record(model, seconds, prompt_tokens, completion_tokens)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"escalations": self.escalations, "models": self.calls.stats()}
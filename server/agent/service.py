@@ -1,4 +1,5 @@
 import asyncio
+import json
 import os
 import logging
 import threading
@@ -14,13 +15,17 @@ import io
 import subprocess
 import time
 from collections import deque
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
 import numpy as np
 from PIL import Image
 import av
 from aiortc import RTCPeerConnection, VideoStreamTrack, RTCSessionDescription
 
+from storage_state import storage_states
+from network import NetworkPolicy
+from rate_limit import LangchainRateLimiter, get_rate_limiter, PRIORITY_INTERACTIVE
+
 # Video streaming config constants
 HOST = "127.0.0.1"
 PORT = 5000
@@ -28,6 +33,27 @@ W, H, FPS = 1280, 720, 3
 SEG_DUR = 1
 SEG_KEEP = 600
 
+# DOM extraction profiles selectable per run. "full" extracts and highlights the
+# whole page on every step; the others trade page coverage for per-step cost
+# and prompt size.
+DOM_PROFILES: Dict[str, Dict[str, Any]] = {
+    "full": {"viewport_expansion": -1, "highlight_elements": True},
+    "bounded": {"viewport_expansion": 500, "highlight_elements": True},
+    "viewport": {"viewport_expansion": 0, "highlight_elements": True},
+    "headless_ci": {"viewport_expansion": 0, "highlight_elements": False},
+}
+DEFAULT_DOM_PROFILE = os.getenv("DOM_PROFILE", "full")
+
+
+def resolve_dom_profile(name: Optional[str]) -> str:
+    """Validate a DOM profile name, falling back to the default"""
+    name = name or DEFAULT_DOM_PROFILE
+    if name not in DOM_PROFILES:
+        raise ValueError(
+            f"Unknown dom_profile '{name}'. Choose one of: {', '.join(DOM_PROFILES)}"
+        )
+    return name
+
 
 class StreamingLogHandler(logging.Handler):
     def __init__(self, log_queue):
@@ -48,9 +74,21 @@ class StreamingLogHandler(logging.Handler):
 
 
 class AgentService:
-    def __init__(self):
+    def __init__(
+        self,
+        storage_state: Optional[Dict[str, Any]] = None,
+        network: Optional[Dict[str, Any]] = None,
+        dom_profile: Optional[str] = None,
+    ):
         # Flag to indicate agent completion status
         self.done = False
+        self.dom_profile = resolve_dom_profile(dom_profile)
+        # Playwright storage state (cookies, localStorage) to start the browser with
+        self.initial_storage_state = storage_state
+        # Request blocking / shared HTTP cache rules for this run
+        self.network_policy = NetworkPolicy.from_options(network)
+        # Wall-clock seconds per command of the current run, reported in metrics
+        self.command_durations: list[float] = []
         self.log_queue = queue.Queue()
         self.streaming_handler = None
         self.loop = asyncio.new_event_loop()
@@ -75,16 +113,22 @@ class AgentService:
             window_size={"width": W, "height": H},  # type: ignore
             viewport={"width": W, "height": H},  # type: ignore
             no_viewport=False,  # type: ignore
-            viewport_expansion=-1,  # type: ignore
-            highlight_elements=True,  # type: ignore
+            **DOM_PROFILES[self.dom_profile],  # type: ignore
             headless=True,  # type: ignore
             disable_security=True,  # type: ignore
             user_data_dir=None,  # type: ignore
             chromium_sandbox=False,  # type: ignore
             args=["--no-sandbox", "--disable-gpu-sandbox", "--disable-setuid-sandbox"],  # type: ignore
             keep_alive=True,  # type: ignore
+            storage_state=self.initial_storage_state,  # type: ignore
         )
         await self.session.start()
+        if self.network_policy.active:
+            # Routing disables Chromium's own HTTP cache, so the policy serves
+            # cacheable responses from the shared disk cache instead
+            await self.session.browser_context.route(
+                "**/*", self.network_policy.handle_route
+            )
 
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
@@ -93,6 +137,8 @@ class AgentService:
             model="gpt-4.1",  # type: ignore
             temperature=0.0,  # type: ignore
             api_key=SecretStr(api_key),  # type: ignore
+            # Browser runs are interactive and share the process-wide LLM quota
+            rate_limiter=LangchainRateLimiter(get_rate_limiter(), PRIORITY_INTERACTIVE),  # type: ignore
         )
 
     async def _run_command_async(self, command: str):
@@ -102,10 +148,74 @@ class AgentService:
         self.log_queue.put("__COMMAND_COMPLETE__")
         self.log_queue.put(str(result))
 
-    def run_command_streaming(self, commands: list[str]):
-        """Generator that yields logs as they come in sequentially for each command"""
+    async def _capture_storage_state(self) -> Dict[str, Any]:
+        return await self.session.browser_context.storage_state()
+
+    async def _apply_storage_state(self, state: Dict[str, Any]):
+        # Restore a snapshot into an already running browser context
+        context = self.session.browser_context
+        if state.get("cookies"):
+            await context.add_cookies(state["cookies"])
+        for origin in state.get("origins", []):
+            items = {
+                item["name"]: item["value"] for item in origin.get("localStorage", [])
+            }
+            if not items:
+                continue
+            await context.add_init_script(
+                "(([origin, items]) => {"
+                " if (location.origin !== origin) return;"
+                " for (const [k, v] of Object.entries(items)) localStorage.setItem(k, v);"
+                f" }})({json.dumps([origin['origin'], items])})"
+            )
+
+    def apply_storage_state(self, state: Dict[str, Any]):
+        asyncio.run_coroutine_threadsafe(
+            self._apply_storage_state(state), self.loop
+        ).result()
+
+    def _save_storage_state(self, options: Dict[str, Any]) -> str:
+        state = asyncio.run_coroutine_threadsafe(
+            self._capture_storage_state(), self.loop
+        ).result()
+        meta = storage_states.save(options["name"], state, ttl=options.get("ttl"))
+        return f"data: {{'type': 'storage_state_saved', 'name': '{meta['name']}', 'expires_at': {meta['expires_at']}}}\n\n"
+
+    def run_command_streaming(
+        self, commands: list[str], save_storage_state: Optional[Dict[str, Any]] = None
+    ):
+        """Generator that yields logs as they come in sequentially for each command
+
+        save_storage_state: optional {"name", "after_step", "ttl"}; once the test
+        step at index after_step succeeds (default: the last step), the browser's
+        cookies and localStorage are snapshotted under name for later runs.
+
+        A final 'metrics' event reports the DOM profile, per-command timings and
+        network interception counters for the run.
+        """
+        self.command_durations = []
+        t0 = time.perf_counter()
+        yield from self._stream_commands(commands, save_storage_state)
+        metrics = {
+            "type": "metrics",
+            "dom_profile": self.dom_profile,
+            **DOM_PROFILES[self.dom_profile],
+            "commands_run": len(self.command_durations),
+            "command_durations": [round(d, 3) for d in self.command_durations],
+            "total_duration": round(time.perf_counter() - t0, 3),
+            "network": dict(self.network_policy.stats),
+        }
+        yield f"data: {metrics!r}\n\n"
+
+    def _stream_commands(
+        self, commands: list[str], save_storage_state: Optional[Dict[str, Any]]
+    ):
+        save_after = None
+        if save_storage_state:
+            save_after = save_storage_state.get("after_step", len(commands) - 2)
         # commands[0] is navigation; commands[1:] correspond to test.steps[0:]
         for idx, command in enumerate(commands):
+            command_start = time.perf_counter()
             # Start the command execution
             future = asyncio.run_coroutine_threadsafe(
                 self._run_command_async(command), self.loop
@@ -118,6 +228,9 @@ class AgentService:
                     if log_msg == "__COMMAND_COMPLETE__":
                         # Get the final result
                         result = self.log_queue.get(timeout=0.1)
+                        self.command_durations.append(
+                            time.perf_counter() - command_start
+                        )
                         yield f"data: {{'type': 'result', 'content': '{result}'}}\n\n"
                         # Emit step status for actual test steps (skip nav)
                         if idx > 0:
@@ -127,6 +240,8 @@ class AgentService:
                                 return
                             else:
                                 yield f"data: {{'type': 'step_status', 'index': {step_index}, 'status': 'success'}}\n\n"
+                        if save_after is not None and idx - 1 == save_after:
+                            yield self._save_storage_state(save_storage_state)  # type: ignore
                         break
                     else:
                         # Only stop on the explicit failure phrase for actual test steps
@@ -356,9 +471,17 @@ class VideoAgentService(AgentService):
         page = await self.session.get_current_page()
         # await page.goto("https://example.com")
 
-    def __init__(self, run_id: str):
+    def __init__(
+        self,
+        run_id: str,
+        storage_state: Optional[Dict[str, Any]] = None,
+        network: Optional[Dict[str, Any]] = None,
+        dom_profile: Optional[str] = None,
+    ):
         self.run_id = run_id
-        super().__init__()
+        super().__init__(
+            storage_state=storage_state, network=network, dom_profile=dom_profile
+        )
         # prep the browser page to a known test site
         prep_future = asyncio.run_coroutine_threadsafe(self._prepare_page(), self.loop)
         prep_future.result()
@@ -394,6 +517,18 @@ class VideoAgentService(AgentService):
         answer = future.result(timeout=30)
         return {"sdp": answer.sdp, "type": answer.type}
 
+    def start_recording(self):
+        asyncio.run_coroutine_threadsafe(self.recorder.start(), self.loop).result()
+
+    def stop_recording(self):
+        asyncio.run_coroutine_threadsafe(self.recorder.stop(), self.loop).result()
+
+    def put_playlist(self, data: bytes):
+        self.hls.put_playlist(data)
+
+    def put_segment(self, name: str, data: bytes):
+        self.hls.put_segment(name, data)
+
     def get_playlist(self) -> str:
         return self.hls.get_playlist()
 
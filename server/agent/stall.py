@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Detection of agent runs that repeat themselves without making progress"""
+
+import os
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# Consecutive iterations without progress before a run is ended; 0 disables
+AGENT_STALL_ITERATIONS = int(os.getenv("AGENT_STALL_ITERATIONS", "5"))
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def describe_step(step: Dict[str, Any]) -> str:
+    """Short human-readable form of an action, e.g. view(pkg/parser.py)"""
+    parameters = step.get("parameters") or {}
+    subject = parameters.get("path") or parameters.get("query") or ""
+    return f"{step['action']}({subject})"
+
+
+class StallDetector:
+    """Fingerprints each iteration's actions and results to spot a stuck agent
+
+    An action makes progress when it succeeds and the (action, parameters,
+    result) fingerprint has not been seen before in the run: a view or search
+    returning something new, or an edit that changed the workspace. Repeating
+    an earlier action with an identical result, or failing, makes none.
+    After max_stalled consecutive iterations without progress, the run should
+    end; before that, feedback() tells the model what it is repeating.
+    """
+
+    def __init__(self, max_stalled: int = AGENT_STALL_ITERATIONS):
+        self.max_stalled = max_stalled
+        # fingerprint -> iteration it was first seen in
+        self.seen: Dict[str, int] = {}
+        self.stalled = 0
+        self.repeats: List[str] = []
+        self.failures: List[str] = []
+
+    def observe(self, iteration: int, results: List[Dict[str, Any]]) -> bool:
+        """Record one iteration's executed actions; returns True if it made progress"""
+        self.repeats, self.failures = [], []
+        progress = False
+        for step in results:
+            fingerprint = _digest([step["action"], step["parameters"], step["result"]])
+            first_seen = self.seen.setdefault(fingerprint, iteration)
+            if first_seen != iteration:
+                self.repeats.append(f"{describe_step(step)} (same result as in iteration {first_seen})")
+            elif not step["result"].get("success"):
+                self.failures.append(f"{describe_step(step)}: {step['result'].get('error', 'failed')}")
+            else:
+                progress = True
+        self.stalled = 0 if progress else self.stalled + 1
+        return progress
+
+    @property
+    def exhausted(self) -> bool:
+        return bool(self.max_stalled) and self.stalled >= self.max_stalled
+
+    @property
+    def reason(self) -> str:
+        detail = "; ".join((self.repeats + self.failures)[:3])
+        return f"no progress in {self.stalled} consecutive iterations" + (f" ({detail})" if detail else "")
+
+    def feedback(self) -> Optional[str]:
+        """Corrective note for the model after an iteration without progress"""
+        if not self.stalled or not self.max_stalled:
+            return None
+        lines = [f"Warning: your last {self.stalled} iteration(s) made no progress."]
+        if self.repeats:
+            lines.append("You repeated actions whose results have not changed: " + "; ".join(self.repeats[:5]) + ".")
+            lines.append("Use the earlier results instead of asking again.")
+        if self.failures:
+            lines.append("These actions failed: " + "; ".join(self.failures[:5]) + ".")
+            lines.append("View the current file content before retrying an edit, or try a different approach.")
+        remaining = self.max_stalled - self.stalled
+        lines.append(
+            f"The run ends after {remaining} more iteration(s) without progress; "
+            "use complete or abort if you are done or cannot proceed."
+        )
+        return "\n".join(lines)
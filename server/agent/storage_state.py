@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""On-disk store for named browser storage-state snapshots (cookies, localStorage)"""
+
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+STORAGE_STATE_DIR = Path(os.getenv("STORAGE_STATE_DIR", "storage_states"))
+DEFAULT_TTL = int(os.getenv("STORAGE_STATE_TTL", "3600"))
+
+
+class StorageStateStore:
+    """Saves Playwright storage states under a name with an expiry time"""
+
+    def __init__(self, root: Path = STORAGE_STATE_DIR, default_ttl: int = DEFAULT_TTL):
+        self.root = Path(root)
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+
+    def _path(self, name: str) -> Path:
+        # Keep names filesystem-safe so callers can't escape the store directory
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", name).strip(".")
+        if not safe:
+            raise ValueError(f"Invalid storage state name: {name!r}")
+        return self.root / f"{safe}.json"
+
+    def save(self, name: str, state: Dict[str, Any], ttl: Optional[int] = None) -> Dict[str, Any]:
+        """Persist a storage state and return its metadata"""
+        now = time.time()
+        entry = {
+            "name": name,
+            "saved_at": now,
+            "expires_at": now + (ttl if ttl is not None else self.default_ttl),
+            "state": state,
+        }
+        path = self._path(name)
+        with self.lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            # Write to a temp file first so readers never see a partial snapshot
+            fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        return {k: v for k, v in entry.items() if k != "state"}
+
+    def load(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return the stored state, or None if it is missing or expired"""
+        path = self._path(name)
+        with self.lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                return None
+            if entry.get("expires_at", 0) <= time.time():
+                path.unlink(missing_ok=True)
+                return None
+        return entry["state"]
+
+    def delete(self, name: str) -> bool:
+        path = self._path(name)
+        with self.lock:
+            if path.exists():
+                path.unlink()
+                return True
+        return False
+
+    def list(self) -> List[Dict[str, Any]]:
+        """List metadata of all unexpired snapshots, purging expired ones"""
+        entries = []
+        now = time.time()
+        with self.lock:
+            if not self.root.exists():
+                return entries
+            for path in self.root.glob("*.json"):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        entry = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if entry.get("expires_at", 0) <= now:
+                    path.unlink(missing_ok=True)
+                    continue
+                entries.append({k: v for k, v in entry.items() if k != "state"})
+        return entries
+
+
+# Shared store used by the HTTP front-ends
+storage_states = StorageStateStore()
+
+
+def check_save_options(options: Any) -> Optional[Dict[str, Any]]:
+    """Validate a run's save_storage_state body before the run starts
+
+    Returns the options ({"name", "after_step"?, "ttl"?}) or None when absent;
+    raises ValueError for a bad name or a step or ttl that is not an int >= 0,
+    which would otherwise only fail once the step to save after has run.
+    """
+    if options is None:
+        return None
+    if not isinstance(options, dict) or not isinstance(options.get("name"), str):
+        raise ValueError("save_storage_state needs a 'name'")
+    storage_states._path(options["name"])
+    for key in ("after_step", "ttl"):
+        value = options.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+            raise ValueError(f"save_storage_state '{key}' must be an integer >= 0")
+    return options
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Process-sharded pool hosting VideoAgentService instances behind the HTTP front-end
+
+With AGENT_WORKERS unset or 0, services live in the front-end process as before.
+Otherwise runs are routed by run_id to one of N worker processes ("auto" = one
+per core), each hosting many services, so frame encoding, SSE generation and
+browser_use's DOM processing stop contending for the front-end's GIL.
+"""
+
+import os
+import time
+import zlib
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+from typing import Any, Dict, List, Optional
+
+
+def _configured_workers() -> int:
+    value = os.getenv("AGENT_WORKERS", "0").strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    return int(value or 0)
+
+
+AGENT_WORKERS = _configured_workers()
+
+# Seconds a forwarded call may take, and a stream may go without an event
+# (services send keepalives while idle), before the front-end gives up on it
+WORKER_CALL_TIMEOUT = float(os.getenv("AGENT_WORKER_CALL_TIMEOUT", "60"))
+WORKER_STREAM_TIMEOUT = float(os.getenv("AGENT_WORKER_STREAM_TIMEOUT", "120"))
+# How often a waiting call checks that its worker process is still alive
+WORKER_POLL_SECONDS = 1.0
+
+# Service methods a worker executes on behalf of the front-end
+FORWARDED_METHODS = {
+    "start_recording",
+    "stop_recording",
+    "handle_offer",
+    "get_playlist",
+    "get_segment",
+    "put_playlist",
+    "put_segment",
+    "apply_storage_state",
+}
+
+
+class WorkerError(Exception):
+    """Raised in the front-end when a call fails inside a worker process"""
+    pass
+
+
+class WorkerDied(WorkerError):
+    """Raised in the front-end when the worker process hosting a call exits"""
+    pass
+
+
+def _worker_main(requests_q, responses_q):
+    """Worker process loop: host services and execute forwarded calls"""
+    from service import VideoAgentService
+
+    services: Dict[str, Any] = {}
+
+    def reply(call_id, kind, value=None):
+        responses_q.put((call_id, kind, value))
+
+    def handle(call_id, run_id, op, args, kwargs):
+        try:
+            if op == "create":
+                services[run_id] = VideoAgentService(run_id, **kwargs)
+                reply(call_id, "result")
+                return
+            if op == "discard":
+                services.pop(run_id, None)
+                reply(call_id, "result")
+                return
+            service = services.get(run_id)
+            if service is None:
+                raise KeyError(f"Run ID {run_id} not found in worker")
+            if op == "run_command_streaming":
+                for event in service.run_command_streaming(*args, **kwargs):
+                    reply(call_id, "event", event)
+                reply(call_id, "end")
+            elif op == "get_done":
+                reply(call_id, "result", service.done)
+            elif op == "set_done":
+                service.done = args[0]
+                reply(call_id, "result")
+            elif op == "shutdown":
+                service.shutdown()
+                reply(call_id, "result")
+            elif op in FORWARDED_METHODS:
+                reply(call_id, "result", getattr(service, op)(*args, **kwargs))
+            else:
+                raise ValueError(f"Unsupported worker call: {op}")
+        except Exception as e:
+            reply(call_id, "error", f"{type(e).__name__}: {e}")
+
+    while True:
+        message = requests_q.get()
+        if message is None:
+            break
+        # Calls block on the service's own loop thread, so each gets a thread
+        threading.Thread(target=handle, args=message, daemon=True).start()
+
+
+class WorkerPool:
+    """Routes service calls to worker processes over multiprocessing queues"""
+
+    def __init__(self, size: int):
+        self.ctx = mp.get_context("spawn")
+        self.responses = self.ctx.Queue()
+        self.requests: List[Any] = [None] * size
+        self.processes: List[Any] = [None] * size
+        for index in range(size):
+            self._spawn(index)
+        self.call_ids = itertools.count()
+        self.pending: Dict[int, "queue.Queue[Any]"] = {}
+        self.lock = threading.Lock()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def _spawn(self, index: int):
+        requests_q = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=_worker_main,
+            args=(requests_q, self.responses),
+            name=f"agent-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.requests[index] = requests_q
+        self.processes[index] = process
+
+    def _dispatch(self):
+        while True:
+            call_id, kind, value = self.responses.get()
+            with self.lock:
+                inbox = self.pending.get(call_id)
+            # Responses for abandoned calls (e.g. a disconnected stream) are dropped
+            if inbox is not None:
+                inbox.put((kind, value))
+
+    def worker_for(self, run_id: str) -> int:
+        return zlib.crc32(run_id.encode("utf-8")) % len(self.processes)
+
+    def _submit(self, run_id: str, op: str, args, kwargs):
+        inbox: "queue.Queue[Any]" = queue.Queue()
+        index = self.worker_for(run_id)
+        with self.lock:
+            call_id = next(self.call_ids)
+            self.pending[call_id] = inbox
+            process = self.processes[index]
+            if not process.is_alive():
+                # Its services are gone; later runs on this shard get a fresh worker
+                print(f"Worker {process.name} exited with code {process.exitcode}; restarting it")
+                self._spawn(index)
+            process = self.processes[index]
+        self.requests[index].put((call_id, run_id, op, args, kwargs))
+        return call_id, inbox, process
+
+    def _receive(self, inbox, process, run_id: str, op: str, timeout: Optional[float]):
+        """Next response for a call, failing if its worker dies or timeout passes"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = WORKER_POLL_SECONDS
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise WorkerError(f"Worker call {op} for {run_id} timed out")
+            try:
+                return inbox.get(timeout=wait)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise WorkerDied(
+                        f"Worker {process.name} exited with code {process.exitcode} during {op} for {run_id}"
+                    )
+
+    def _release(self, call_id: int):
+        with self.lock:
+            self.pending.pop(call_id, None)
+
+    def call(self, run_id: str, op: str, *args, timeout: Optional[float] = WORKER_CALL_TIMEOUT, **kwargs):
+        call_id, inbox, process = self._submit(run_id, op, args, kwargs)
+        try:
+            kind, value = self._receive(inbox, process, run_id, op, timeout)
+        finally:
+            self._release(call_id)
+        if kind == "error":
+            raise WorkerError(value)
+        return value
+
+    def stream(self, run_id: str, op: str, *args, idle_timeout: Optional[float] = WORKER_STREAM_TIMEOUT, **kwargs):
+        call_id, inbox, process = self._submit(run_id, op, args, kwargs)
+        try:
+            while True:
+                kind, value = self._receive(inbox, process, run_id, op, idle_timeout)
+                if kind == "event":
+                    yield value
+                elif kind == "end":
+                    return
+                else:
+                    raise WorkerError(value)
+        finally:
+            self._release(call_id)
+
+    def close(self):
+        for requests_q in self.requests:
+            requests_q.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+
+class RemoteService:
+    """Front-end handle mirroring VideoAgentService for a service in a worker"""
+
+    def __init__(self, pool: WorkerPool, run_id: str, **options):
+        self.pool = pool
+        self.run_id = run_id
+        pool.call(run_id, "create", **options)
+
+    @property
+    def done(self) -> bool:
+        return self.pool.call(self.run_id, "get_done")
+
+    @done.setter
+    def done(self, value: bool):
+        self.pool.call(self.run_id, "set_done", value)
+
+    def run_command_streaming(self, commands, save_storage_state=None):
+        return self.pool.stream(
+            self.run_id,
+            "run_command_streaming",
+            commands,
+            save_storage_state=save_storage_state,
+        )
+
+    def start_recording(self):
+        self.pool.call(self.run_id, "start_recording")
+
+    def stop_recording(self):
+        self.pool.call(self.run_id, "stop_recording")
+
+    def handle_offer(self, params):
+        try:
+            return self.pool.call(self.run_id, "handle_offer", params, timeout=35)
+        except WorkerError as e:
+            # Match the in-process service, whose closed loop raises RuntimeError
+            raise RuntimeError(str(e))
+
+    def get_playlist(self) -> str:
+        return self.pool.call(self.run_id, "get_playlist")
+
+    def get_segment(self, name: str) -> Optional[bytes]:
+        return self.pool.call(self.run_id, "get_segment", name)
+
+    def put_playlist(self, data: bytes):
+        self.pool.call(self.run_id, "put_playlist", data)
+
+    def put_segment(self, name: str, data: bytes):
+        self.pool.call(self.run_id, "put_segment", name, data)
+
+    def apply_storage_state(self, state: Dict[str, Any]):
+        self.pool.call(self.run_id, "apply_storage_state", state)
+
+    def shutdown(self):
+        self.pool.call(self.run_id, "shutdown")
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[WorkerPool]:
+    """Return the worker pool, starting it on first use, or None when disabled"""
+    global _pool
+    if AGENT_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(AGENT_WORKERS)
+        return _pool
+
+
+def create_service(run_id: str, **options):
+    """Create a service for run_id in-process or on its owning worker"""
+    pool = get_pool()
+    if pool is None:
+        from service import VideoAgentService
+
+        return VideoAgentService(run_id, **options)
+    return RemoteService(pool, run_id, **options)
+
+
+def release_service(run_id: str):
+    """Drop a run's service from its worker once the front-end forgets it"""
+    pool = get_pool()
+    if pool is not None:
+        try:
+            pool.call(run_id, "discard")
+        except WorkerError as e:
+            # A dead or hung worker has nothing left to release
+            print(f"Could not release {run_id}: {e}")
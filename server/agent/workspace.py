@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""Cached model of an agent workspace: gitignore-filtered file tree and file contents"""
+
+import os
+import mmap
+import bisect
+import shutil
+import tempfile
+import threading
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from repo_index import list_repo_files
+from patch import write_atomic
+
+# Above this many files the rendered tree collapses to directories with file counts
+MAX_TREE_ENTRIES = 400
+# Files larger than this are read through a LineIndex instead of the content cache
+LARGE_FILE_BYTES = int(os.getenv("AGENT_LARGE_FILE_BYTES", str(1024 * 1024)))
+
+
+def is_binary(data: bytes) -> bool:
+    """Heuristic used by git: a NUL byte in the first 8 KB means binary"""
+    return b"\0" in data[:8192]
+
+
+class LineIndex:
+    """Line offsets of a large file, read through mmap without loading it
+
+    Only the requested line ranges are ever copied out of the mapping.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.key = (stat.st_mtime_ns, stat.st_size)
+            self.size = stat.st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        # offsets[n] is the byte offset where line n + 1 starts
+        self.offsets = array("Q", [0])
+        position = self.data.find(b"\n")
+        while position != -1:
+            self.offsets.append(position + 1)
+            position = self.data.find(b"\n", position + 1)
+        if self.offsets[-1] != self.size:
+            self.offsets.append(self.size)
+
+    @property
+    def line_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def binary(self) -> bool:
+        return is_binary(self.data[:8192])
+
+    def lines(self, start: int, end: int, max_chars: Optional[int] = None, from_end: bool = False) -> str:
+        """Text of lines start..end (1-based, inclusive)
+
+        With max_chars only the first (or, from_end, the last) max_chars
+        characters are returned, and only the bytes that can hold them are
+        decoded: a UTF-8 character takes at most 4 bytes.
+        """
+        start = max(start, 1)
+        end = min(end, self.line_count)
+        if start > end:
+            return ""
+        low, high = self.offsets[start - 1], self.offsets[end]
+        if max_chars is None:
+            return self.data[low:high].decode("utf-8", errors="replace")
+        if from_end:
+            text = self.data[max(low, high - 4 * max_chars):high].decode("utf-8", errors="replace")
+            return text[-max_chars:] if max_chars else ""
+        return self.data[low:min(high, low + 4 * max_chars)].decode("utf-8", errors="replace")[:max_chars]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class Workspace:
+    """File tree and contents of one workspace, cached between agent iterations
+
+    The tree is listed once (gitignore-aware) and then only changed by the
+    agent's own writes. File bytes are cached keyed by (mtime, size), so a
+    re-read costs a stat() unless the file actually changed.
+    """
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.lock = threading.Lock()
+        self._files: Optional[List[str]] = None
+        # resolved path -> (mtime_ns, size, data)
+        self._contents: Dict[Path, Tuple[int, int, bytes]] = {}
+        self._line_indexes: Dict[Path, LineIndex] = {}
+
+    def relative(self, path: Union[str, Path]) -> Optional[str]:
+        """Path relative to the workspace root, or None if it lies outside it"""
+        try:
+            rel = Path(path).resolve().relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return None
+        return "" if rel == "." else rel
+
+    def resolve(self, path: Union[str, Path]) -> Path:
+        """Filesystem path of a tool path; relative paths are relative to the workspace root"""
+        path = Path(path)
+        return path if path.is_absolute() else self.root / path
+
+    def display(self, path: Union[str, Path]) -> str:
+        """Path as shown to the model: workspace-relative inside the workspace"""
+        rel = self.relative(path)
+        if rel is None:
+            return str(path)
+        return rel or "."
+
+    def scrub(self, text: str) -> str:
+        """Text with absolute workspace paths rewritten relative to the root"""
+        for root in dict.fromkeys([str(self.root.resolve()), str(self.root)]):
+            text = text.replace(root + os.sep, "").replace(root, ".")
+        return text
+
+    def files(self) -> List[str]:
+        """All workspace files as sorted relative POSIX paths"""
+        with self.lock:
+            if self._files is None:
+                self._files = list_repo_files(self.root)
+            return self._files
+
+    def list_dir(self, path: Union[str, Path]) -> Optional[List[Dict[str, Any]]]:
+        """Immediate children of a workspace directory, from the cached tree
+
+        Returns None when path is outside the workspace, so callers can fall
+        back to the filesystem.
+        """
+        rel = self.relative(path)
+        if rel is None:
+            return None
+        prefix = f"{rel}/" if rel else ""
+        files = self.files()
+        children: Dict[str, str] = {}
+        for entry in files[bisect.bisect_left(files, prefix):]:
+            if not entry.startswith(prefix):
+                break
+            name, sep, _ = entry[len(prefix):].partition("/")
+            children.setdefault(name, "directory" if sep else "file")
+        return [
+            {"name": name, "type": kind, "path": f"{prefix}{name}"}
+            for name, kind in children.items()
+        ]
+
+    def read_bytes(self, path: Union[str, Path]) -> bytes:
+        """Read a file, reusing the cached content while mtime and size match"""
+        resolved = Path(path).resolve()
+        stat = resolved.stat()
+        cached = self._contents.get(resolved)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        data = resolved.read_bytes()
+        self._contents[resolved] = (stat.st_mtime_ns, stat.st_size, data)
+        return data
+
+    def read_text(self, path: Union[str, Path], errors: str = "strict") -> str:
+        return self.read_bytes(path).decode("utf-8", errors=errors)
+
+    def line_index(self, path: Union[str, Path]) -> LineIndex:
+        """mmap-backed line index of a large file, rebuilt only when it changes"""
+        resolved = Path(path).resolve()
+        stat = resolved.stat()
+        with self.lock:
+            index = self._line_indexes.get(resolved)
+            if index is None or index.key != (stat.st_mtime_ns, stat.st_size):
+                if index is not None:
+                    index.close()
+                index = self._line_indexes[resolved] = LineIndex(resolved)
+            return index
+
+    def write_text(self, path: Union[str, Path], text: str):
+        """Write a file and update the cached tree and content
+
+        The file is replaced rather than written in place, which keeps the
+        hard links of an overlay (see create_overlay) from leaking edits.
+        """
+        resolved = Path(path).resolve()
+        data = text.encode("utf-8")
+        write_atomic(resolved, data)
+        self.forget(resolved)
+        stat = resolved.stat()
+        self._contents[resolved] = (stat.st_mtime_ns, stat.st_size, data)
+
+    def forget(self, path: Union[str, Path]):
+        """Drop cached state for a file changed outside write_text and update the tree"""
+        resolved = Path(path).resolve()
+        self._contents.pop(resolved, None)
+        rel = self.relative(resolved)
+        with self.lock:
+            stale = self._line_indexes.pop(resolved, None)
+            if stale is not None:
+                stale.close()
+            if not rel or self._files is None:
+                return
+            position = bisect.bisect_left(self._files, rel)
+            listed = position < len(self._files) and self._files[position] == rel
+            if resolved.is_file() and not listed:
+                self._files.insert(position, rel)
+            elif not resolved.exists() and listed:
+                del self._files[position]
+
+    def render_tree(self, max_entries: int = MAX_TREE_ENTRIES) -> str:
+        """Compact indented listing of the workspace
+
+        Large workspaces are rendered as directories with their file counts
+        plus top-level files, which the agent can expand with view.
+        """
+        files = self.files()
+        if len(files) > max_entries:
+            counts: Dict[str, int] = {}
+            top_level = []
+            for entry in files:
+                parts = entry.split("/")
+                if len(parts) == 1:
+                    top_level.append(entry)
+                for depth in range(1, min(len(parts), 3)):
+                    key = "/".join(parts[:depth])
+                    counts[key] = counts.get(key, 0) + 1
+            lines = [
+                f"{'  ' * d.count('/')}{d.rsplit('/', 1)[-1]}/ ({n} files)"
+                for d, n in sorted(counts.items(), key=lambda kv: kv[0].split("/"))
+            ]
+            return "\n".join(lines + top_level)
+
+        lines = []
+        open_dirs: List[str] = []
+        for entry in files:
+            parts = entry.split("/")
+            # Reuse the directory headers already printed for the previous entry
+            common = 0
+            while common < min(len(open_dirs), len(parts) - 1) and open_dirs[common] == parts[common]:
+                common += 1
+            open_dirs = open_dirs[:common]
+            for depth in range(common, len(parts) - 1):
+                lines.append(f"{'  ' * depth}{parts[depth]}/")
+                open_dirs.append(parts[depth])
+            lines.append(f"{'  ' * (len(parts) - 1)}{parts[-1]}")
+        return "\n".join(lines)
+
+
+def create_overlay(root: Union[str, Path], files: Optional[List[str]] = None) -> Path:
+    """Copy-on-write mirror of a workspace, for an agent run isolated from others
+
+    Every file (gitignore-filtered, or the given relative paths) is hard-linked
+    into a new directory, falling back to a copy across filesystems. Agent
+    writes replace files instead of modifying them in place, so edits made in
+    the overlay never reach root. The caller removes the overlay when done.
+    """
+    root = Path(root).resolve()
+    try:
+        # Next to the workspace, so hard links stay on one filesystem
+        overlay = Path(tempfile.mkdtemp(prefix=f".{root.name}.overlay-", dir=root.parent))
+    except OSError:
+        overlay = Path(tempfile.mkdtemp(prefix=f"{root.name}.overlay-"))
+    for rel in list_repo_files(root) if files is None else files:
+        source, target = root / rel, overlay / rel
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source, target)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            shutil.copy2(source, target)
+    return overlay
+
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible chat-completions stub for exercising the agent's LLM client.
+
+    python openai_stub.py --port 8765 --fail-first 2 --script replies.jsonl
+    cd ../agent && OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub \
+        python -c "from fetch import quick_edit; print(quick_edit('noop', '.'))"
+
+• --fail-first N answers the first N requests with 429 + Retry-After
+• --error-rate P answers a random fraction P of requests with 503
+• --script FILE replays one assistant message per line, in order (cycled);
+  without it every request gets a "complete" action
+• --no-response-format answers requests carrying response_format with 400,
+  like servers without structured outputs
+• --honor-max-tokens cuts replies off at max_tokens (4 characters a token)
+  with finish_reason "length"
+• "stream": true requests get SSE chunks of --chunk-chars, --token-delay apart
+
+The tests in server/tests start it in-process through the openai_stub fixture:
+    cd server && python -m pytest tests
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = json.dumps({
+    "action": "complete",
+    "parameters": {},
+    "reasoning": "Stub reply",
+    "status": "complete",
+})
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.replies = []
+        if args.script:
+            with open(args.script, "r", encoding="utf-8") as f:
+                self.replies = [line.rstrip("\n") for line in f if line.strip()]
+
+    def next(self):
+        with self.lock:
+            self.requests += 1
+            number = self.requests
+        if number <= self.args.fail_first:
+            return number, 429, None
+        if random.random() < self.args.error_rate:
+            return number, 503, None
+        served = number - self.args.fail_first - 1
+        reply = self.replies[served % len(self.replies)] if self.replies else DEFAULT_REPLY
+        return number, 200, reply
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            if state.args.no_response_format and "response_format" in payload:
+                self._send(400, {"error": {"message": "Unrecognized request argument supplied: response_format (stub)",
+                                           "param": "response_format"}})
+                return
+            number, status, reply = state.next()
+            finish_reason = "stop"
+            max_chars = 4 * int(payload.get("max_tokens") or 0)
+            if state.args.honor_max_tokens and max_chars and len(reply) > max_chars:
+                reply, finish_reason = reply[:max_chars], "length"
+            time.sleep(state.args.delay)
+            if status == 429:
+                self._send(429, {"error": {"message": "Rate limit reached (stub)"}},
+                           {"Retry-After": str(state.args.retry_after)})
+                return
+            if status != 200:
+                self._send(status, {"error": {"message": "Service unavailable (stub)"}})
+                return
+            prompt_chars = sum(len(m.get("content") or "") for m in payload.get("messages", []))
+            usage = {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": len(reply) // 4,
+                "total_tokens": (prompt_chars + len(reply)) // 4,
+            }
+            if payload.get("stream"):
+                self._stream(number, payload, reply, usage, finish_reason)
+                return
+            self._send(200, {
+                "id": f"chatcmpl-stub-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+
+        def _stream(self, number, payload, reply, usage, finish_reason):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def event(body):
+                data = f"data: {body if isinstance(body, str) else json.dumps(body)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            base = {"id": f"chatcmpl-stub-{number}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": payload.get("model", "stub")}
+            size = state.args.chunk_chars
+            try:
+                for start in range(0, len(reply), size):
+                    event({**base, "choices": [{"index": 0, "delta": {"content": reply[start:start + size]},
+                                                "finish_reason": None}]})
+                    time.sleep(state.args.token_delay)
+                event({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    event({**base, "choices": [], "usage": usage})
+                event("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                print(f"[stub] stream {number} closed by client", flush=True)
+
+        def log_message(self, fmt, *args):
+            print(f"[stub] {self.address_string()} {fmt % args}", flush=True)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--chunk-chars", type=int, default=8)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--no-response-format", action="store_true")
+    parser.add_argument("--honor-max-tokens", action="store_true")
+    parser.add_argument("--script")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args)))
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Shared fixtures: the agent modules on sys.path and a local OpenAI stub server"""
+
+import sys
+import argparse
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+# The agent modules import each other as top-level modules, as when run from server/agent
+sys.path.insert(0, str(SERVER_DIR / "agent"))
+sys.path.insert(0, str(SERVER_DIR / "testing"))
+
+from openai_stub import StubState, make_handler  # noqa: E402
+
+STUB_DEFAULTS = {
+    "fail_first": 0,
+    "retry_after": 0,
+    "error_rate": 0.0,
+    "delay": 0.0,
+    "chunk_chars": 8,
+    "token_delay": 0.0,
+    "no_response_format": False,
+    "honor_max_tokens": False,
+    "script": None,
+}
+
+
+@pytest.fixture
+def openai_stub():
+    """Start testing/openai_stub.py on a free port; returns start(**options) -> (base_url, state)
+
+    Options are the stub's command-line flags with underscores, e.g.
+    start(fail_first=2) or start(script="replies.jsonl").
+    """
+    servers = []
+
+    def start(**options):
+        state = StubState(argparse.Namespace(**{**STUB_DEFAULTS, **options}))
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1", state
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,45 @@
+import pytest
+
+from fetch import FetchAIAgent
+from repo_index import RepoIndex
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    """An agent on a small workspace, run from a different working directory"""
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "mod.py").write_text("def alpha():\n    return 1\n")
+    agent = FetchAIAgent(index=RepoIndex.build(tmp_path))
+    agent.build_initial_messages("task", tmp_path)
+    return agent
+
+
+def names(result):
+    return sorted({match["path"] for match in result["matches"]})
+
+
+def test_tool_results_use_workspace_relative_paths(agent):
+    result = agent.view("pkg/mod.py")
+    assert result["success"]
+    assert result["path"] == "pkg/mod.py"
+    assert names(agent.search("alpha")) == ["pkg/mod.py"]
+
+
+def test_search_sees_patched_files(agent):
+    diff = "--- a/pkg/mod.py\n+++ b/pkg/mod.py\n@@ -1,2 +1,2 @@\n-def alpha():\n+def beta():\n     return 1\n"
+    (step,) = agent.execute_actions([{"action": "patch", "parameters": {"diff": diff}}])
+    assert step["result"]["success"], step["result"]
+    assert names(agent.search("beta")) == ["pkg/mod.py"]
+    assert agent.search("alpha")["matches"] == []
+
+
+def test_search_sees_created_and_edited_files(agent):
+    agent.execute_actions([
+        {"action": "create", "parameters": {"path": "pkg/new.py", "content": "class Gamma:\n    pass\n"}},
+        {"action": "str_replace", "parameters": {"path": "pkg/mod.py", "old_str": "return 1", "new_str": "return delta"}},
+        {"action": "insert", "parameters": {"path": "pkg/new.py", "line_num": 1, "text": "# epsilon"}},
+    ])
+    assert names(agent.search("Gamma")) == ["pkg/new.py"]
+    assert names(agent.search("delta")) == ["pkg/mod.py"]
+    assert names(agent.search("epsilon")) == ["pkg/new.py"]
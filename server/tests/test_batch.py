@@ -0,0 +1,95 @@
+import ast
+
+import pytest
+
+from storage_state import StorageStateStore
+
+# batch imports the browser service, which needs the full browser stack
+batch = pytest.importorskip("batch")
+from service import DEFAULT_DOM_PROFILE  # noqa: E402
+
+
+def parse(event):
+    assert event.startswith("data: ") and event.endswith("\n\n")
+    return ast.literal_eval(event[len("data: "):].strip())
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = StorageStateStore(tmp_path / "states")
+    monkeypatch.setattr(batch, "storage_states", store)
+    return store
+
+
+def test_tag_event_puts_the_tags_first():
+    tagged = batch.tag_event("data: {'type': 'log', 'content': 'hi'}\n\n", test_case_id="t1", run_id="r1")
+    assert parse(tagged) == {"test_case_id": "t1", "run_id": "r1", "type": "log", "content": "hi"}
+    assert tagged.startswith("data: {'test_case_id': 't1', 'run_id': 'r1', 'type'")
+
+
+def test_duplicate_case_id_finds_the_first_repeat():
+    assert batch.duplicate_case_id(["a", "b", "c"]) is None
+    assert batch.duplicate_case_id(["a", "b", "a", "b"]) == "a"
+    assert batch.duplicate_case_id([]) is None
+
+
+def test_case_options_override_batch_defaults(store):
+    store.save("login", {"cookies": []})
+    defaults = {"storage_state": "login", "network": {"block": ["ads"]}, "dom_profile": None}
+    options = batch.build_service_options(defaults, {"network": None, "dom_profile": DEFAULT_DOM_PROFILE})
+    assert options == {"storage_state": {"cookies": []}, "network": {"block": ["ads"]},
+                       "dom_profile": DEFAULT_DOM_PROFILE}
+    assert batch.build_service_options(defaults, {"network": {"cache": True}})["network"] == {"cache": True}
+
+
+def test_build_service_options_rejects_unknown_profiles_and_missing_states(store):
+    with pytest.raises(ValueError):
+        batch.build_service_options({}, {"dom_profile": "no-such-profile"})
+    with pytest.raises(LookupError):
+        batch.build_service_options({"storage_state": "missing"}, {})
+    store.save("expired", {"cookies": []}, ttl=0)
+    with pytest.raises(LookupError):
+        batch.build_service_options({}, {"storage_state": "expired"})
+
+
+class FakeService:
+    def __init__(self, commands_failing=()):
+        self.commands_failing = commands_failing
+        self.recording = None
+        self.shut_down = False
+
+    def start_recording(self):
+        self.recording = True
+
+    def stop_recording(self):
+        self.recording = False
+
+    def shutdown(self):
+        self.shut_down = True
+
+    def run_command_streaming(self, commands, save_storage_state=None):
+        for command in commands:
+            status = "failure" if command in self.commands_failing else "success"
+            yield f"data: {{'type': 'step_status', 'step': {command!r}, 'status': '{status}'}}\n\n"
+
+
+def test_run_batch_streaming_tags_events_and_summarizes(store):
+    services = {}
+
+    def create_service(run_id, **options):
+        services[run_id] = FakeService(commands_failing={"bad"})
+        return services[run_id]
+
+    cases = [
+        {"test_case_id": "ok", "commands": ["a", "b"], "service_options": {}},
+        {"test_case_id": "fails", "commands": ["bad"], "service_options": {}},
+    ]
+    events = [parse(event) for event in batch.run_batch_streaming(cases, create_service, parallelism=2)
+              if event != batch.KEEPALIVE]
+    assert events[0] == {"type": "batch", "test_cases": 2, "parallelism": 2}
+    done = {event["test_case_id"]: event["status"] for event in events if event["type"] == "case_done"}
+    assert done == {"ok": "success", "fails": "failure"}
+    assert all("run_id" in event for event in events[1:-1])
+    summary = events[-1]
+    assert (summary["type"], summary["passed"], summary["failed"], summary["errors"]) == ("batch_summary", 1, 1, 0)
+    assert all(service.recording is False and not service.shut_down for service in services.values())
@@ -0,0 +1,60 @@
+import pytest
+
+from fetch import ContextBudget, FetchAIError
+
+
+def message(content, role="user"):
+    return {"role": role, "content": content}
+
+
+def view_result(path, content):
+    return {"success": True, "type": "file", "path": path, "content": content}
+
+
+def test_count_follows_messages_replaced_in_place():
+    budget = ContextBudget()
+    messages = [message("a" * 4000)]
+    large = budget.count(messages)
+    messages[0] = message("a")
+    assert budget.count(messages) < large
+
+
+def test_repeated_view_of_an_unchanged_file_is_a_reference():
+    budget = ContextBudget()
+    messages = []
+    budget.add_result(messages, "view", view_result("pkg/a.py", "print(1)\n" * 50))
+    budget.add_result(messages, "view", view_result("pkg/a.py", "print(1)\n" * 50))
+    assert "print(1)" in messages[0]["content"]
+    assert "print(1)" not in messages[1]["content"]
+    assert '"unchanged":true' in messages[1]["content"]
+
+
+def test_fit_compacts_old_results_and_keeps_recent_ones():
+    budget = ContextBudget(max_tokens=1500, keep_recent=2, truncate_chars=200)
+    messages = [message("system prompt", "system"), message("task")]
+    for n in range(4):
+        budget.add_result(messages, "view", view_result(f"f{n}.py", f"line {n}\n" * 300))
+        messages.append(message('{"action": "view"}', "assistant"))
+    recent = messages[-2]["content"]
+    total = budget.fit(messages)
+    assert total <= 1500
+    assert total == ContextBudget().count(messages)
+    assert "chars elided" in messages[2]["content"] or "summarized" in messages[2]["content"]
+    assert messages[-2]["content"] == recent
+
+
+def test_fit_raises_when_protected_messages_exceed_the_budget():
+    budget = ContextBudget(max_tokens=10, keep_recent=2)
+    with pytest.raises(FetchAIError):
+        budget.fit([message("x" * 1000, "system"), message("task")])
+
+
+def test_count_matches_a_fresh_count_after_a_repair_turn():
+    budget = ContextBudget()
+    messages = [message("system prompt", "system"), message("task")]
+    budget.count(messages)
+    # A repair turn counts a temporary list that extends the conversation...
+    budget.count(messages + [message("x" * 8000, "assistant"), message("Your reply was not valid JSON")])
+    # ...and the next real turn reuses those indexes with different content
+    messages += [message('{"action": "view"}', "assistant"), message("short result")]
+    assert budget.count(messages) == ContextBudget().count(messages)
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from fetch import JsonObjectScanner, parse_actions, parse_decision
+
+
+def test_scanner_closes_at_the_end_of_the_first_object():
+    scanner = JsonObjectScanner()
+    reply = '{"action": "create", "parameters": {"content": "a } \\" {"}} trailing text'
+    chunks = [reply[i:i + 7] for i in range(0, len(reply), 7)]
+    closed_at = next(n for n, chunk in enumerate(chunks) if scanner.feed(chunk))
+    assert closed_at < len(chunks) - 1
+    assert json.loads(scanner.text) == {"action": "create", "parameters": {"content": 'a } " {'}}
+
+
+def test_scanner_keeps_prose_before_the_object():
+    scanner = JsonObjectScanner()
+    assert not scanner.feed("Sure, here it is: ")
+    assert scanner.feed('{"action": "complete"}')
+    # parse_decision extracts the object from the surrounding prose
+    assert scanner.text == 'Sure, here it is: {"action": "complete"}'
+
+
+def test_scanner_waits_for_nested_objects_to_close():
+    scanner = JsonObjectScanner()
+    assert not scanner.feed('{"actions": [{"action": "view"}')
+    assert scanner.feed(']}')
+    assert scanner.feed("ignored")
+
+
+@pytest.mark.parametrize("content, decision", [
+    ('{"action": "view", "parameters": {"path": "."}}', {"action": "view", "parameters": {"path": "."}}),
+    ('Here you go:\n{"action": "complete"}\nDone.', {"action": "complete"}),
+    ('{"actions": [{"action": "view"}, {"action": "search"}]}', {"actions": [{"action": "view"}, {"action": "search"}]}),
+])
+def test_parse_decision_accepts(content, decision):
+    assert parse_decision(content) == (decision, None)
+
+
+@pytest.mark.parametrize("content, problem", [
+    ('{"action": "view"', "invalid JSON"),
+    ("[1, 2]", "must be a JSON object"),
+    ('{"reasoning": "thinking"}', 'missing "action"'),
+    ('{"actions": [{"parameters": {}}]}', 'needs an "action"'),
+])
+def test_parse_decision_explains_rejections(content, problem):
+    decision, error = parse_decision(content)
+    assert decision is None
+    assert problem in error
+
+
+def test_parse_actions_drops_null_parameters():
+    decision = {"actions": [{"action": "view", "parameters": {"path": "a.py", "start_line": None}}]}
+    assert parse_actions(decision) == [{"action": "view", "parameters": {"path": "a.py"}}]
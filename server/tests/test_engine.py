@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+import router
+from engine import AgentEngine
+from fetch import FetchAIAgent
+from llm_cache import LLMCache
+from llm_client import LLMClient
+from rate_limit import RateLimiter
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch, openai_stub):
+    """An agent routed between a fast and a strong model, talking to the stub"""
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setattr(router, "AGENT_FAST_MAX_TOKENS", 10)
+    long_view = {"action": "view", "reasoning": "x" * 200, "parameters": {"path": "."}}
+    script = tmp_path / "replies.jsonl"
+    script.write_text(json.dumps(long_view) + "\n" + json.dumps({"action": "complete"}) + "\n")
+    base_url, state = openai_stub(script=str(script), honor_max_tokens=True)
+    agent = FetchAIAgent(model="strong", fast_model="fast")
+    agent.client = LLMClient(api_key="stub", base_url=base_url, limiter=RateLimiter(0, 0),
+                             cache=LLMCache("passthrough"))
+    agent.state = state
+    return agent
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_a_truncated_fast_reply_goes_to_the_strong_model_unrepaired(agent, tmp_path, stream):
+    events = list(AgentEngine(agent, stream=stream).run("task", tmp_path))
+    result = events[-1]["result"]
+    assert result["outcome"] == "completed", result
+    (metrics,) = [event["metrics"] for event in events if event["type"] == "metrics"]
+    assert (metrics["model"], metrics["escalated"], metrics["repairs"]) == ("strong", True, 0)
+    assert agent.state.requests == 2
@@ -0,0 +1,119 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import git
+
+
+def run(*args, cwd=None):
+    return subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, check=True).stdout.strip()
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    """A local repository with three commits touching d1/ and d2/, and a feature branch"""
+    for key in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{key}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{key}_EMAIL", "test@example.com")
+    path = tmp_path / "origin"
+    path.mkdir()
+    run("init", "-q", "-b", "main", cwd=path)
+    # Partial clones from a local repository need the server side to allow filters
+    run("config", "uploadpack.allowFilter", "true", cwd=path)
+    for n in range(3):
+        for directory in ("d1", "d2"):
+            (path / directory).mkdir(exist_ok=True)
+            (path / directory / "f.txt").write_text(f"{directory} version {n}\n")
+        run("add", "-A", cwd=path)
+        run("commit", "-q", "-m", f"commit {n}", cwd=path)
+    run("branch", "feature", cwd=path)
+    return path
+
+
+def clone(origin, tmp_path, **kwargs):
+    info = {}
+    destination = git.clone_repo(str(origin), destination=str(tmp_path / "clone"), info=info, **kwargs)
+    assert destination is not None
+    return destination, info
+
+
+def test_clone_options_resolve_modes():
+    assert git.clone_options("full") == ("full", ["--no-single-branch"])
+    assert git.clone_options("shallow") == ("shallow", ["--depth=1", "--single-branch"])
+    assert git.clone_options("partial") == ("partial", ["--filter=blob:none", "--single-branch"])
+    assert git.clone_options("shallow", depth=5)[1][0] == "--depth=5"
+    assert git.clone_options("auto", size_kb=1)[0] == "full"
+    assert git.clone_options("auto", size_kb=git.GIT_FULL_CLONE_MAX_KB + 1)[0] == "shallow"
+    assert git.clone_options("auto", size_kb=None)[0] == "shallow"
+    # Sparse checkouts fetch blobs lazily
+    assert git.clone_options("full", sparse=["d1"])[1] == ["--filter=blob:none", "--no-single-branch", "--sparse"]
+    with pytest.raises(ValueError):
+        git.clone_options("deep")
+
+
+def test_full_clone_has_all_history_and_branches(origin, tmp_path):
+    path, info = clone(origin, tmp_path, mode="full")
+    assert info["mode"] == "full"
+    assert run("rev-list", "--count", "HEAD", cwd=path) == "3"
+    assert run("rev-parse", "--is-shallow-repository", cwd=path) == "false"
+    assert "origin/feature" in run("branch", "-r", cwd=path)
+
+
+def test_shallow_clone_has_depth_one(origin, tmp_path):
+    path, info = clone(origin, tmp_path, mode="shallow")
+    assert info["args"] == ["--depth=1", "--single-branch"]
+    assert run("rev-parse", "--is-shallow-repository", cwd=path) == "true"
+    assert run("rev-list", "--count", "HEAD", cwd=path) == "1"
+    assert "origin/feature" not in run("branch", "-r", cwd=path)
+
+
+def test_partial_clone_keeps_history_without_blobs(origin, tmp_path):
+    path, _ = clone(origin, tmp_path, mode="partial")
+    assert run("config", "remote.origin.partialclonefilter", cwd=path) == "blob:none"
+    assert run("rev-list", "--count", "HEAD", cwd=path) == "3"
+    # Old blobs were never fetched
+    missing = run("rev-list", "--objects", "--missing=print", "HEAD", cwd=path)
+    assert any(line.startswith("?") for line in missing.splitlines())
+    assert (tmp_path / "clone" / "d1" / "f.txt").read_text() == "d1 version 2\n"
+
+
+def test_sparse_clone_checks_out_only_the_listed_directories(origin, tmp_path):
+    path, info = clone(origin, tmp_path, mode="full", sparse=["d1"])
+    assert info["sparse"] == ["d1"]
+    assert (tmp_path / "clone" / "d1" / "f.txt").is_file()
+    assert not (tmp_path / "clone" / "d2").exists()
+    assert run("config", "remote.origin.partialclonefilter", cwd=path) == "blob:none"
+
+
+def test_auto_mode_picks_full_for_a_small_local_repository(origin, tmp_path):
+    path, info = clone(origin, tmp_path, mode="auto")
+    assert info["mode"] == "full"
+    assert info["size_kb"] is not None
+    assert run("rev-list", "--count", "HEAD", cwd=path) == "3"
+
+
+def test_clone_checks_out_the_requested_branch(origin, tmp_path):
+    run("checkout", "-q", "feature", cwd=origin)
+    (origin / "feature.txt").write_text("feature\n")
+    run("add", "-A", cwd=origin)
+    run("commit", "-q", "-m", "feature work", cwd=origin)
+    run("checkout", "-q", "main", cwd=origin)
+    clone(origin, tmp_path, mode="shallow", branch="feature")
+    assert (tmp_path / "clone" / "feature.txt").is_file()
+
+
+def test_mirror_checkouts_are_removable_worktrees(origin, tmp_path, monkeypatch):
+    monkeypatch.setattr(git, "REPOS_DIR", tmp_path / "repos")
+    monkeypatch.setattr(git, "MIRRORS_DIR", tmp_path / "repos" / ".mirrors")
+    monkeypatch.setattr(git, "GIT_USE_MIRRORS", True)
+    first_info, second_info = {}, {}
+    first = git.clone_repo(str(origin), mode="full", info=first_info)
+    second = git.clone_repo(str(origin), mode="full", info=second_info)
+    assert first != second
+    assert (first_info["mirror"], second_info["mirror"]) == ("created", "fetched")
+    assert git.is_worktree(first) and git.is_worktree(second)
+    assert run("rev-parse", "HEAD", cwd=first) == run("rev-parse", "HEAD", cwd=origin)
+    assert git.remove_worktree(first)
+    assert not Path(first).exists()
+    assert git.is_worktree(second)
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import llm_client
+from llm_cache import LLMCache
+from llm_client import LLMClient, LLMError, retry_delay
+from rate_limit import RateLimiter
+
+PAYLOAD = {"model": "stub", "messages": [{"role": "user", "content": "hello"}]}
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.01)
+
+
+def make_client(base_url, **kwargs):
+    return LLMClient(api_key="stub", base_url=base_url, limiter=RateLimiter(0, 0),
+                     cache=LLMCache("passthrough"), **kwargs)
+
+
+def test_retry_delay_prefers_server_headers():
+    assert retry_delay(0, {"retry-after-ms": "1500"}) == 1.5
+    assert retry_delay(0, {"retry-after": "2"}) == 2.0
+    assert retry_delay(0, {"retry-after": "Thu, 01 Jan 1970 00:00:00 GMT"}) == 0.0
+    assert retry_delay(0, {"retry-after": "10000"}) == llm_client.LLM_BACKOFF_MAX
+
+
+def test_retry_delay_backoff_is_jittered_and_capped():
+    for attempt in range(12):
+        delay = retry_delay(attempt)
+        assert 0 <= delay <= min(llm_client.LLM_BACKOFF_MAX, llm_client.LLM_BACKOFF_BASE * 2 ** attempt)
+
+
+def test_chat_retries_rate_limited_requests(openai_stub):
+    base_url, state = openai_stub(fail_first=2)
+    client = make_client(base_url)
+    body = client.chat(PAYLOAD)
+    assert json.loads(body["choices"][0]["message"]["content"])["action"] == "complete"
+    assert state.requests == 3
+    assert client.retries == 2
+    assert client.limiter.stats()["throttled_429"] == 2
+
+
+def test_chat_gives_up_after_max_retries(openai_stub):
+    base_url, state = openai_stub(error_rate=1.0)
+    client = make_client(base_url, max_retries=2)
+    with pytest.raises(LLMError) as error:
+        client.chat(PAYLOAD)
+    assert error.value.status_code == 503
+    assert state.requests == 3
+
+
+def test_chat_does_not_retry_client_errors(openai_stub):
+    base_url, state = openai_stub(no_response_format=True)
+    client = make_client(base_url)
+    with pytest.raises(LLMError) as error:
+        client.chat({**PAYLOAD, "response_format": {"type": "json_object"}})
+    assert error.value.status_code == 400
+    assert state.requests == 0
+    assert client.retries == 0
+
+
+def test_stream_chat_yields_the_whole_reply(openai_stub, tmp_path):
+    script = tmp_path / "replies.jsonl"
+    script.write_text('{"action": "view", "parameters": {"path": "."}}\n')
+    base_url, _ = openai_stub(script=str(script), chunk_chars=5)
+    client = make_client(base_url)
+    chunks = list(client.stream_chat({**PAYLOAD, "stream": True}))
+    assert len(chunks) > 1
+    assert json.loads("".join(chunks)) == {"action": "view", "parameters": {"path": "."}}
+
+
+def test_usage_settles_the_token_estimate(openai_stub):
+    base_url, _ = openai_stub()
+    client = LLMClient(api_key="stub", base_url=base_url, limiter=RateLimiter(0, 100000),
+                       cache=LLMCache("passthrough"))
+    client.chat({**PAYLOAD, "max_tokens": 5000})
+    # The 5000-token completion allowance is given back once usage is reported
+    assert client.limiter.tokens.level > 99000
+
+
+def test_stream_chat_reports_the_finish_reason(openai_stub):
+    base_url, _ = openai_stub(honor_max_tokens=True)
+    client = make_client(base_url)
+    info = {}
+    text = "".join(client.stream_chat({**PAYLOAD, "stream": True, "max_tokens": 2}, info=info))
+    assert len(text) == 8
+    assert info["finish_reason"] == "length"
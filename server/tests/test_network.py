@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from network import BLOCK_PRESETS, HttpDiskCache, NetworkPolicy
+
+HEADERS = {"content-type": "text/css", "content-encoding": "gzip"}
+
+
+def total_on_disk(cache):
+    return int((cache.root / cache.SIZE_FILE).read_text())
+
+
+def age(cache, url, seconds):
+    """Set an entry's last access seconds into the past"""
+    when = time.time() - seconds
+    os.utime(cache.root / f"{cache.key(url)}.body", (when, when))
+
+
+def test_put_and_get_round_trip_without_wire_headers(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=1000)
+    cache.put("https://x/a.css", 200, HEADERS, b"body")
+    assert cache.get("https://x/a.css") == (200, {"content-type": "text/css"}, b"body")
+    assert cache.get("https://x/missing.css") is None
+
+
+def test_the_size_total_follows_puts_replacements_and_removals(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=1000)
+    cache.put("https://x/a", 200, {}, b"a" * 100)
+    cache.put("https://x/b", 200, {}, b"b" * 50)
+    assert total_on_disk(cache) == 150
+    cache.put("https://x/a", 200, {}, b"a" * 10)
+    assert total_on_disk(cache) == 60
+    assert cache.stats() == {"entries": 2, "bytes": 60, "max_bytes": 1000}
+
+
+def test_opening_a_cache_recounts_a_drifted_total(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=1000)
+    cache.put("https://x/a", 200, {}, b"a" * 100)
+    (tmp_path / cache.SIZE_FILE).write_text("12345")
+    (tmp_path / "orphan.json").write_text("{}")
+    reopened = HttpDiskCache(tmp_path, max_bytes=1000)
+    assert total_on_disk(reopened) == 100
+    assert not (tmp_path / "orphan.json").exists()
+
+
+def test_eviction_removes_the_least_recently_used_entries(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=350)
+    for name, seconds in (("a", 30), ("b", 20), ("c", 10)):
+        cache.put(f"https://x/{name}", 200, {}, b"." * 100)
+        age(cache, f"https://x/{name}", seconds)
+    # Reading a makes b the least recently used entry
+    assert cache.get("https://x/a") is not None
+    cache.put("https://x/d", 200, {}, b"." * 100)
+    assert not (tmp_path / f"{cache.key('https://x/b')}.body").exists()
+    assert [cache.get(f"https://x/{name}") is not None for name in "acd"] == [True, True, True]
+    assert total_on_disk(cache) == 300
+
+
+def test_opening_a_smaller_cache_evicts_down_to_its_bound(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=1000)
+    for name in "abc":
+        cache.put(f"https://x/{name}", 200, {}, b"." * 100)
+    assert HttpDiskCache(tmp_path, max_bytes=150).stats()["bytes"] == 100
+
+
+def test_expired_entries_are_removed_on_read(tmp_path):
+    cache = HttpDiskCache(tmp_path, max_bytes=1000, ttl=60)
+    cache.put("https://x/a", 200, {}, b"a" * 100)
+    assert cache.get("https://x/a") is not None
+    cache.ttl = 0
+    assert cache.get("https://x/a") is None
+    assert list(tmp_path.glob("*.body")) == []
+    assert total_on_disk(cache) == 0
+
+
+def fill(root, worker, count):
+    cache = HttpDiskCache(root, max_bytes=10 ** 6)
+    for n in range(count):
+        cache.put(f"https://x/{worker}/{n}", 200, {}, b"." * (n + 1))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_concurrent_processes_keep_the_total_exact(tmp_path):
+    HttpDiskCache(tmp_path)
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=fill, args=(tmp_path, worker, 30)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+    total = int((tmp_path / HttpDiskCache.SIZE_FILE).read_text())
+    assert total == 4 * sum(range(1, 31))
+    assert total == sum(path.stat().st_size for path in tmp_path.glob("*.body"))
+
+
+@pytest.mark.parametrize("preset", sorted(BLOCK_PRESETS))
+def test_presets_expand_to_their_patterns_and_resource_types(preset):
+    policy = NetworkPolicy(block=[preset])
+    assert policy.patterns == BLOCK_PRESETS[preset]["patterns"]
+    assert policy.resource_types == set(BLOCK_PRESETS[preset]["resource_types"])
+    assert policy.active
+
+
+def test_should_block_matches_presets_substrings_and_globs():
+    policy = NetworkPolicy(block=["analytics", "media", "tracker.example", "https://cdn.*/ads/*"])
+    assert policy.should_block("https://www.google-analytics.com/collect", "xhr")
+    assert policy.should_block("https://site.test/video.mp4", "media")
+    assert policy.should_block("https://tracker.example/pixel.gif", "image")
+    assert policy.should_block("https://cdn.site.test/ads/banner.js", "script")
+    assert not policy.should_block("https://cdn.site.test/app.js", "script")
+    assert not policy.should_block("https://site.test/logo.png", "image")
+
+
+def test_from_options_without_rules_is_inactive():
+    assert not NetworkPolicy.from_options(None).active
+    assert not NetworkPolicy.from_options({"block": [], "cache": False}).active
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+from patch import PatchError, apply_patch, parse_patch
+
+MODIFY = """\
+--- a/pkg/mod.py
++++ b/pkg/mod.py
+@@ -1,3 +1,3 @@
+ def f():
+-    return 1
++    return 2
+
+"""
+
+CREATE = """\
+--- /dev/null
++++ b/pkg/new.py
+@@ -0,0 +1,2 @@
++x = 1
++y = 2
+"""
+
+DELETE = """\
+--- a/pkg/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-gone = True
+"""
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "mod.py").write_text("def f():\n    return 1\n\n")
+    (tmp_path / "pkg" / "old.py").write_text("gone = True\n")
+    return tmp_path
+
+
+def test_parse_strips_git_prefixes_and_reads_hunks():
+    (file_patch,) = parse_patch(MODIFY)
+    assert file_patch["old_path"] == file_patch["new_path"] == "pkg/mod.py"
+    (hunk,) = file_patch["hunks"]
+    assert hunk["old_start"] == 1
+    assert [op for op, _, _ in hunk["lines"]] == [" ", "-", "+", " "]
+
+
+def test_parse_marks_missing_final_newline():
+    text = "--- a/f\n+++ b/f\n@@ -1 +1 @@\n-a\n+b\n\\ No newline at end of file\n"
+    (file_patch,) = parse_patch(text)
+    assert file_patch["hunks"][0]["lines"][-1] == ("+", "b", False)
+
+
+@pytest.mark.parametrize("text", [
+    "just prose",
+    "--- a/f\n+++ b/f\n",
+    "@@ -1 +1 @@\n-a\n+b\n",
+    "--- a/f\n+++ b/f\n@@ -1 +1 @@\n-a\n?b\n",
+])
+def test_parse_rejects_malformed_diffs(text):
+    with pytest.raises(PatchError):
+        parse_patch(text)
+
+
+def test_apply_creates_modifies_and_deletes_together(workspace):
+    result = apply_patch(MODIFY + CREATE + DELETE, workspace)
+    assert result["success"], result
+    assert {f["path"]: f["status"] for f in result["files"]} == {
+        str(workspace / "pkg" / "mod.py"): "modified",
+        str(workspace / "pkg" / "new.py"): "created",
+        str(workspace / "pkg" / "old.py"): "deleted",
+    }
+    assert (workspace / "pkg" / "mod.py").read_text() == "def f():\n    return 2\n\n"
+    assert (workspace / "pkg" / "new.py").read_text() == "x = 1\ny = 2\n"
+    assert not (workspace / "pkg" / "old.py").exists()
+
+
+def test_apply_tolerates_drifted_line_numbers(workspace):
+    (workspace / "pkg" / "mod.py").write_text("import os\n\n\ndef f():\n    return 1\n\n")
+    assert apply_patch(MODIFY, workspace)["success"]
+    assert "return 2" in (workspace / "pkg" / "mod.py").read_text()
+
+
+def test_apply_writes_nothing_if_any_hunk_fails(workspace):
+    stale = MODIFY.replace("-    return 1", "-    return 99")
+    result = apply_patch(CREATE + stale, workspace)
+    assert not result["success"]
+    (failure,) = result["failures"]
+    assert failure["hunk"] == 1
+    assert failure["expected"][1] == "    return 99"
+    assert not (workspace / "pkg" / "new.py").exists()
+    assert (workspace / "pkg" / "mod.py").read_text() == "def f():\n    return 1\n\n"
+
+
+@pytest.mark.parametrize("old, new", [("a/../outside.py", "b/../outside.py"), ("/etc/passwd", "/etc/passwd")])
+def test_apply_refuses_paths_outside_the_workspace(workspace, old, new):
+    result = apply_patch(f"--- {old}\n+++ {new}\n@@ -1 +1 @@\n-a\n+b\n", workspace)
+    assert not result["success"]
+    assert "outside the workspace" in result["failures"][0]["reason"]
+
+
+def test_apply_refuses_to_create_an_existing_file(workspace):
+    result = apply_patch(CREATE.replace("pkg/new.py", "pkg/old.py"), workspace)
+    assert result["failures"][0]["reason"] == "file to create already exists"
+
+
+def test_sections_for_the_same_file_apply_in_order(workspace):
+    (workspace / "pkg" / "letters.txt").write_text("a\nb\nc\n")
+    first = "--- a/pkg/letters.txt\n+++ b/pkg/letters.txt\n@@ -1 +1 @@\n-a\n+A\n"
+    second = "--- a/pkg/letters.txt\n+++ b/pkg/letters.txt\n@@ -3 +3 @@\n-c\n+C\n"
+    result = apply_patch(first + second, workspace)
+    assert result["success"], result
+    (entry,) = result["files"]
+    assert (entry["status"], entry["hunks"], entry["added"], entry["removed"]) == ("modified", 2, 2, 2)
+    assert (workspace / "pkg" / "letters.txt").read_text() == "A\nb\nC\n"
+
+
+def test_later_sections_see_earlier_ones(workspace):
+    # The second section only matches after the first one applied
+    first = "--- a/pkg/old.py\n+++ b/pkg/old.py\n@@ -1 +1 @@\n-gone = True\n+gone = False\n"
+    second = "--- a/pkg/old.py\n+++ b/pkg/old.py\n@@ -1 +1 @@\n-gone = False\n+gone = None\n"
+    assert apply_patch(first + second, workspace)["success"]
+    assert (workspace / "pkg" / "old.py").read_text() == "gone = None\n"
+
+
+def test_a_file_created_and_deleted_in_one_diff_is_untouched(workspace):
+    delete_new = "--- a/pkg/new.py\n+++ /dev/null\n@@ -1,2 +0,0 @@\n-x = 1\n-y = 2\n"
+    result = apply_patch(CREATE + delete_new, workspace)
+    assert result == {"success": True, "files": []}
+    assert not (workspace / "pkg" / "new.py").exists()
+
+
+def test_a_deleted_file_cannot_be_edited_later_in_the_diff(workspace):
+    result = apply_patch(DELETE + DELETE, workspace)
+    assert not result["success"]
+    assert result["failures"][0]["reason"] == "file does not exist"
+    assert (workspace / "pkg" / "old.py").exists()
+
+
+def test_new_files_follow_the_umask_and_edits_keep_their_mode(workspace):
+    (workspace / "pkg" / "mod.py").chmod(0o754)
+    old_umask = os.umask(0o027)
+    try:
+        assert apply_patch(MODIFY + CREATE, workspace)["success"]
+    finally:
+        os.umask(old_umask)
+    assert (workspace / "pkg" / "new.py").stat().st_mode & 0o777 == 0o640
+    assert (workspace / "pkg" / "mod.py").stat().st_mode & 0o777 == 0o754
+    assert not list(workspace.glob("pkg/.*.tmp"))
@@ -0,0 +1,79 @@
+import time
+import threading
+
+import pytest
+
+from rate_limit import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RateLimiter, RateLimitTimeout, TokenBucket
+
+
+def test_zero_capacity_bucket_is_unlimited():
+    bucket = TokenBucket(0)
+    bucket.take(10 ** 9)
+    assert bucket.unlimited
+    assert bucket.delay(10 ** 9) == 0.0
+
+
+def test_bucket_delay_follows_the_refill_rate():
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.delay(1) == pytest.approx(1.0)
+    bucket.refill(bucket.updated + 30)
+    assert bucket.level == pytest.approx(30)
+    bucket.refill(bucket.updated + 600)
+    assert bucket.level == 60
+
+
+def test_try_acquire_stops_at_the_request_budget():
+    limiter = RateLimiter(rpm=2, tpm=0)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+
+
+def test_acquire_times_out_without_budget():
+    limiter = RateLimiter(rpm=1, tpm=0)
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.1)
+    assert limiter.stats()["queued"] == 0
+
+
+def test_oversized_requests_are_capped_at_the_bucket():
+    limiter = RateLimiter(rpm=0, tpm=1000)
+    assert limiter.acquire(tokens=50000, timeout=0.1) < 0.1
+
+
+def test_record_usage_returns_unused_tokens():
+    limiter = RateLimiter(rpm=0, tpm=1000)
+    limiter.acquire(tokens=800)
+    limiter.record_usage(800, 100)
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+    limiter.record_usage(100, 400)
+    assert limiter.tokens.level == pytest.approx(600, abs=1)
+
+
+def test_pause_holds_every_caller():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    limiter.pause(0.2)
+    assert not limiter.try_acquire()
+    assert limiter.acquire() >= 0.15
+    assert limiter.stats()["throttled_429"] == 1
+
+
+def test_interactive_requests_overtake_queued_background_ones():
+    limiter = RateLimiter(rpm=0, tpm=0)
+    limiter.pause(0.3)
+    order = []
+
+    def request(priority, name):
+        limiter.acquire(priority=priority)
+        order.append(name)
+
+    background = threading.Thread(target=request, args=(PRIORITY_BACKGROUND, "background"))
+    background.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=request, args=(PRIORITY_INTERACTIVE, "interactive"))
+    interactive.start()
+    background.join()
+    interactive.join()
+    assert order == ["interactive", "background"]
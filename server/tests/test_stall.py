@@ -0,0 +1,65 @@
+from stall import StallDetector, describe_step
+
+
+def step(action, result, **parameters):
+    return {"action": action, "parameters": parameters, "result": result}
+
+
+OK = {"success": True, "content": "print(1)"}
+FAILED = {"success": False, "error": "old_str not found"}
+
+
+def test_new_results_are_progress():
+    detector = StallDetector(max_stalled=2)
+    assert detector.observe(1, [step("view", OK, path="a.py")])
+    assert detector.observe(2, [step("view", OK, path="b.py")])
+    assert detector.stalled == 0
+    assert detector.feedback() is None
+
+
+def test_repeating_an_action_with_the_same_result_stalls():
+    detector = StallDetector(max_stalled=2)
+    detector.observe(1, [step("view", OK, path="a.py")])
+    assert not detector.observe(2, [step("view", OK, path="a.py")])
+    assert detector.repeats == ["view(a.py) (same result as in iteration 1)"]
+    assert not detector.exhausted
+    assert "repeated actions" in detector.feedback()
+    assert not detector.observe(3, [step("view", OK, path="a.py")])
+    assert detector.exhausted
+    assert detector.reason.startswith("no progress in 2 consecutive iterations")
+
+
+def test_the_same_view_after_an_edit_is_progress():
+    detector = StallDetector(max_stalled=2)
+    detector.observe(1, [step("view", OK, path="a.py")])
+    changed = {"success": True, "content": "print(2)"}
+    assert detector.observe(2, [step("view", changed, path="a.py")])
+
+
+def test_failures_stall_and_are_reported():
+    detector = StallDetector(max_stalled=3)
+    assert not detector.observe(1, [step("str_replace", FAILED, path="a.py", old_str="x", new_str="y")])
+    assert detector.failures == ["str_replace(a.py): old_str not found"]
+    assert "These actions failed" in detector.feedback()
+    assert "2 more iteration(s)" in detector.feedback()
+
+
+def test_one_successful_action_resets_the_count():
+    detector = StallDetector(max_stalled=2)
+    detector.observe(1, [step("view", OK, path="a.py")])
+    detector.observe(2, [step("view", OK, path="a.py")])
+    assert detector.observe(3, [step("view", OK, path="a.py"), step("search", OK, query="Parser")])
+    assert detector.stalled == 0
+
+
+def test_zero_disables_stall_detection():
+    detector = StallDetector(max_stalled=0)
+    for iteration in range(1, 10):
+        detector.observe(iteration, [step("view", FAILED, path="a.py")])
+    assert not detector.exhausted
+    assert detector.feedback() is None
+
+
+def test_describe_step_names_the_subject():
+    assert describe_step(step("search", OK, query="Parser")) == "search(Parser)"
+    assert describe_step({"action": "complete", "parameters": None}) == "complete()"
@@ -0,0 +1,85 @@
+import pytest
+
+from storage_state import StorageStateStore, check_save_options
+
+STATE = {"cookies": [{"name": "sid", "value": "1"}], "origins": []}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StorageStateStore(tmp_path / "states", default_ttl=60)
+
+
+def test_save_then_load_round_trips(store):
+    meta = store.save("login", STATE)
+    assert meta["name"] == "login"
+    assert meta["expires_at"] - meta["saved_at"] == 60
+    assert "state" not in meta
+    assert store.load("login") == STATE
+    assert store.load("other") is None
+
+
+def test_saving_again_replaces_the_snapshot(store):
+    store.save("login", STATE)
+    store.save("login", {"cookies": [], "origins": []})
+    assert store.load("login") == {"cookies": [], "origins": []}
+    assert len(store.list()) == 1
+    assert not list(store.root.glob("*.tmp"))
+
+
+def test_expired_snapshots_are_purged(store):
+    store.save("old", STATE, ttl=0)
+    store.save("new", STATE)
+    assert [entry["name"] for entry in store.list()] == ["new"]
+    assert not (store.root / "old.json").exists()
+    store.save("old", STATE, ttl=0)
+    assert store.load("old") is None
+    assert not (store.root / "old.json").exists()
+
+
+def test_list_and_delete(store):
+    assert store.list() == []
+    store.save("a", STATE)
+    store.save("b", STATE)
+    assert sorted(entry["name"] for entry in store.list()) == ["a", "b"]
+    assert store.delete("a")
+    assert not store.delete("a")
+    assert [entry["name"] for entry in store.list()] == ["b"]
+
+
+def test_names_cannot_leave_the_store_directory(store):
+    store.save("../escape", STATE)
+    assert [path.name for path in store.root.iterdir()] == ["_escape.json"]
+    assert store.load("../escape") == STATE
+
+
+@pytest.mark.parametrize("name", ["", ".", "..", "..."])
+def test_names_without_safe_characters_are_rejected(store, name):
+    with pytest.raises(ValueError):
+        store.save(name, STATE)
+    with pytest.raises(ValueError):
+        store.load(name)
+
+
+def test_check_save_options_accepts_valid_bodies():
+    assert check_save_options(None) is None
+    assert check_save_options({"name": "login"}) == {"name": "login"}
+    options = {"name": "login", "after_step": 0, "ttl": 600}
+    assert check_save_options(options) == options
+    assert check_save_options({"name": "login", "after_step": None}) == {"name": "login", "after_step": None}
+
+
+@pytest.mark.parametrize("options", [
+    "login",
+    {},
+    {"name": 5},
+    {"name": ".."},
+    {"name": "login", "after_step": -1},
+    {"name": "login", "after_step": "2"},
+    {"name": "login", "after_step": 1.5},
+    {"name": "login", "after_step": True},
+    {"name": "login", "ttl": -5},
+])
+def test_check_save_options_rejects_bad_bodies(options):
+    with pytest.raises(ValueError):
+        check_save_options(options)
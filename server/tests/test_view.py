@@ -0,0 +1,84 @@
+import pytest
+
+import fetch
+from fetch import FetchAIAgent
+from workspace import LineIndex
+
+TEXT = "alpha\nßeta γamma\n€uro 😀 smile\n\nlast line without newline"
+
+
+class SliceRecorder:
+    """Wraps LineIndex.data and records the size of every slice taken from it"""
+
+    def __init__(self, data):
+        self.data = data
+        self.sizes = []
+
+    @property
+    def read_sizes(self):
+        # The first slice is the 8 KiB binary sniff
+        return self.sizes[1:]
+
+    def __getitem__(self, key):
+        chunk = self.data[key]
+        self.sizes.append(len(chunk))
+        return chunk
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    # Every file goes through the mmap line index
+    monkeypatch.setattr(fetch, "LARGE_FILE_BYTES", 0)
+    monkeypatch.setattr(fetch, "VIEW_MAX_CHARS", 1000)
+    agent = FetchAIAgent()
+    agent.build_initial_messages("task", tmp_path)
+    return agent
+
+
+def recorded(agent, path):
+    index = agent.workspace.line_index(path)
+    index.data = SliceRecorder(index.data)
+    return index.data
+
+
+def test_bounded_lines_match_the_decoded_text(tmp_path):
+    path = tmp_path / "f.txt"
+    path.write_text(TEXT, encoding="utf-8")
+    index = LineIndex(path)
+    for start, end in ((1, 5), (2, 3), (3, 3), (5, 5)):
+        full = index.lines(start, end)
+        for max_chars in range(0, len(full) + 2):
+            assert index.lines(start, end, max_chars) == full[:max_chars]
+            assert index.lines(start, end, max_chars, from_end=True) == (full[-max_chars:] if max_chars else "")
+    index.close()
+
+
+def test_a_few_huge_lines_are_summarized_from_their_ends(agent, tmp_path):
+    path = tmp_path / "bundle.min.js"
+    path.write_text("a" * 100000 + "\n" + "b" * 100000 + "\n")
+    data = recorded(agent, path)
+    result = agent.view("bundle.min.js")
+    assert result["truncated"]
+    assert result["content"].startswith("a" * 500 + "\n... [about 199002 bytes omitted] ...\n")
+    assert result["content"].endswith("b" * 499 + "\n")
+    assert data.read_sizes and max(data.read_sizes) <= 4 * 500
+
+
+def test_a_large_range_is_capped_before_decoding(agent, tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text("".join(f"line {n:06}\n" for n in range(1, 50001)))
+    data = recorded(agent, path)
+    result = agent.view("log.txt", start_line=11, end_line=50000)
+    assert result["truncated"]
+    assert result["content"].startswith("line 000011\n")
+    assert result["end_line"] == 10 + 1000 // 12
+    assert result["content"].endswith(f"line {result['end_line']:06}\n")
+    assert data.read_sizes == [4 * 1001]
+
+
+def test_a_short_range_is_returned_whole(agent, tmp_path):
+    (tmp_path / "f.txt").write_text(TEXT, encoding="utf-8")
+    result = agent.view("f.txt", start_line=2, end_line=3)
+    assert result["content"] == "ßeta γamma\n€uro 😀 smile\n"
+    assert "truncated" not in result
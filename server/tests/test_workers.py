@@ -0,0 +1,73 @@
+import os
+import time
+
+import pytest
+
+import workers
+from workers import WorkerDied, WorkerError, WorkerPool
+
+
+def fake_worker_main(requests_q, responses_q):
+    """Stands in for _worker_main; ops: echo, hang, die, stream_then_die"""
+    while True:
+        message = requests_q.get()
+        if message is None:
+            break
+        call_id, run_id, op, args, kwargs = message
+        if op == "hang":
+            continue
+        if op == "die":
+            os._exit(3)
+        if op == "stream_then_die":
+            responses_q.put((call_id, "event", "first"))
+            # Flush the queue's feeder thread, which _exit would cut off
+            responses_q.close()
+            responses_q.join_thread()
+            os._exit(4)
+        responses_q.put((call_id, "result", [run_id, *args]))
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # Spawned children import this module to find the fake main
+    monkeypatch.setattr(workers, "_worker_main", fake_worker_main)
+    monkeypatch.setattr(workers, "WORKER_POLL_SECONDS", 0.1)
+    pool = WorkerPool(1)
+    yield pool
+    pool.close()
+
+
+def test_calls_are_answered_by_the_worker(pool):
+    assert pool.call("run", "echo", 1, 2) == ["run", 1, 2]
+
+
+def test_a_call_times_out_when_the_worker_does_not_answer(pool):
+    started = time.monotonic()
+    with pytest.raises(WorkerError, match="timed out"):
+        pool.call("run", "hang", timeout=0.5)
+    assert 0.5 <= time.monotonic() - started < 5
+    assert not pool.pending
+
+
+def test_a_dead_worker_fails_the_call_and_is_restarted(pool):
+    first = pool.processes[0]
+    with pytest.raises(WorkerDied, match="exited with code 3"):
+        pool.call("run", "die", timeout=None)
+    assert pool.call("run", "echo") == ["run"]
+    assert pool.processes[0] is not first
+    assert pool.processes[0].is_alive()
+
+
+def test_a_stream_fails_when_its_worker_dies(pool):
+    stream = pool.stream("run", "stream_then_die", idle_timeout=None)
+    assert next(stream) == "first"
+    with pytest.raises(WorkerDied, match="exited with code 4"):
+        next(stream)
+    assert not pool.pending
+
+
+def test_the_pool_routes_a_run_to_the_same_worker():
+    pool = WorkerPool.__new__(WorkerPool)
+    pool.processes = [None] * 4
+    assert len({pool.worker_for("run-1") for _ in range(10)}) == 1
+    assert {pool.worker_for(f"run-{n}") for n in range(100)} == {0, 1, 2, 3}